@@ -0,0 +1,367 @@
+"""
+Audio sources for the recorders (see audio_streaming.py). Every source
+writes int16 frames into a preallocated AudioRingBuffer, from its own
+thread, and consumers read them through cursors:
+
+    MicrophoneSource : PyAudio microphone, in callback mode
+    FileSource       : replay of a WAV or raw PCM file, converted to the rate
+                       and channels asked for
+    ToneSource       : synthetic sine tone and/or white noise
+    ArraySource      : replay of an in-memory NumPy array
+
+Replayed sources run at arg::speed times real time (1.0 paces them like
+a microphone), or as fast as consumers keep up with (speed=None). They
+close the ring when they run out, which ends the recording.
+
+Usage:
+    source = FileSource('utterance.wav', speed=4.0)
+    source.open()
+    cursor = source.cursor()
+    source.start()
+    block = cursor.read_exact(source.chunk, timeout=1.0)  # int16 array
+    source.stop()
+    source.stats()
+"""
+from typing import Optional
+import threading
+import time
+import wave
+import numpy as np
+from .config import (AUDIO_SAMPLE_RATE, CHANNELS, AUDIO_CHUNK_SIZE, AUDIO_RING_SECONDS,
+                     AUDIO_DEVICE_RATE)
+from .utils import AudioRingBuffer, StreamingResampler
+
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None # only MicrophoneSource needs it
+
+class AudioSource:
+    """
+    Base class. Subclasses implement start() and stop(), writing into
+    self.ring between the two. open() must be called before each use.
+    """
+    def __init__(self, rate=AUDIO_SAMPLE_RATE,
+                       channels=CHANNELS,
+                       chunk=AUDIO_CHUNK_SIZE,
+                       ring_seconds=AUDIO_RING_SECONDS):
+        self.rate = rate
+        self.channels = channels
+        self.chunk = chunk
+        self.ring_seconds = ring_seconds
+        self.ring = None
+        self._cursors = []
+
+    def open(self):
+        """
+        Fresh ring and counters, for a new recording. Create cursors
+        after open() and before start() to get every frame.
+        """
+        self.ring = AudioRingBuffer(int(self.rate * self.ring_seconds), self.channels)
+        self._cursors = []
+
+    def cursor(self, from_oldest=False):
+        cursor = self.ring.cursor(from_oldest)
+        self._cursors.append(cursor)
+        return cursor
+
+    def start(self):
+        raise NotImplementedError
+
+    def stop(self):
+        """
+        Stop producing. Frames already written stay readable; waiting
+        consumers get what is left, then empty blocks.
+        """
+        self.ring.close()
+
+    @property
+    def finished(self):
+        return self.ring is not None and self.ring.closed
+
+    def wake(self):
+        """
+        Wake waiting consumers, e.g. so they notice a stop request.
+        """
+        self.ring.wake()
+
+    def stats(self):
+        """
+        Overruns: audio lost by a consumer that fell more than the ring's
+        length behind. Underruns: reads that timed out waiting for audio
+        (source starved).
+        """
+        return dict(ring_overruns=sum(c.overruns for c in self._cursors),
+                    underruns=sum(c.underruns for c in self._cursors))
+
+
+class MicrophoneSource(AudioSource):
+    """
+    Microphone capture in PyAudio callback mode. PortAudio's own thread
+    hands each buffer to _callback, which only copies it into the ring:
+    no blocking reads, no sleeps, and a slow consumer can never stall
+    the device.
+
+    The device is opened at arg::device_rate (by default its own native
+    rate), and audio converted to arg::rate with a StreamingResampler
+    before it reaches the ring: PortAudio/ALSA's own rate conversion is
+    slow, and differs between devices.
+    """
+    def __init__(self, rate=AUDIO_SAMPLE_RATE,
+                       channels=CHANNELS,
+                       chunk=AUDIO_CHUNK_SIZE,
+                       ring_seconds=AUDIO_RING_SECONDS,
+                       device_rate=AUDIO_DEVICE_RATE):
+        super().__init__(rate, channels, chunk, ring_seconds)
+        self.device_rate = device_rate
+        self.resampler = None
+        self.audio = None
+        self.stream = None
+        self.device_overflows = 0  # input lost by the device (paInputOverflow)
+        self.device_underflows = 0 # gaps filled by the device (paInputUnderflow)
+
+    def open(self):
+        super().open()
+        self.device_overflows = 0
+        self.device_underflows = 0
+
+    def start(self):
+        if pyaudio is None:
+            raise RuntimeError("MicrophoneSource needs PyAudio (pip install pyaudio)")
+        self.audio = pyaudio.PyAudio()
+        device_rate = self.device_rate or int(
+            self.audio.get_default_input_device_info()['defaultSampleRate'])
+        self.resampler = None
+        if device_rate != self.rate:
+            self.resampler = StreamingResampler(device_rate, self.rate, self.channels)
+        self.stream = self.audio.open(format=pyaudio.paInt16,
+                                      channels=self.channels,
+                                      rate=device_rate,
+                                      input=True,
+                                      frames_per_buffer=round(self.chunk * device_rate / self.rate),
+                                      stream_callback=self._callback)
+        self.stream.start_stream()
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        if self.audio is not None:
+            self.audio.terminate()
+            self.audio = None
+        super().stop()
+
+    def stats(self):
+        """
+        Extends AudioSource.stats() with overflows (audio lost by the
+        device) and underflows reported by PortAudio.
+        """
+        return dict(device_overflows=self.device_overflows,
+                    device_underflows=self.device_underflows,
+                    **super().stats())
+
+    def _callback(self, in_data, frame_count, time_info, status_flags):
+        if status_flags & pyaudio.paInputOverflow:
+            self.device_overflows += 1
+        if status_flags & pyaudio.paInputUnderflow:
+            self.device_underflows += 1
+        if self.resampler is not None:
+            in_data = self.resampler.process(in_data)
+        self.ring.write(in_data)
+        return (None, pyaudio.paContinue)
+
+
+class ReplaySource(AudioSource):
+    """
+    Base class for sources that generate audio on a feeder thread:
+    subclasses implement blocks(), yielding int16 arrays of (at most)
+    self.chunk frames, interleaved.
+
+    Paced at arg::speed times real time. With speed=None, blocks are
+    written as soon as every cursor has room for them, so no audio is
+    lost however slow the consumers are.
+    """
+    def __init__(self, rate=AUDIO_SAMPLE_RATE,
+                       channels=CHANNELS,
+                       chunk=AUDIO_CHUNK_SIZE,
+                       speed: Optional[float] = 1.0,
+                       ring_seconds=AUDIO_RING_SECONDS):
+        super().__init__(rate, channels, chunk, ring_seconds)
+        self.speed = speed
+        self.frames_written = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def blocks(self):
+        raise NotImplementedError
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._feed, name=f'[{type(self).__name__}]',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        super().stop()
+
+    def _feed(self):
+        start = time.perf_counter()
+        written = self.frames_written = 0
+        try:
+            for block in self.blocks():
+                if self._stop_event.is_set():
+                    break
+                n_frames = len(block) // self.channels
+                if self.speed:
+                    delay = start + (written + n_frames) / self.rate / self.speed - time.perf_counter()
+                    if delay > 0 and self._stop_event.wait(delay):
+                        break
+                elif not self._wait_for_room(n_frames):
+                    break
+                self.ring.write(block)
+                written += n_frames
+                self.frames_written = written
+        finally:
+            self.ring.close()
+
+    def _wait_for_room(self, n_frames):
+        """
+        Unpaced replay: wait until the slowest cursor could take
+        arg::n_frames more. False if stopped meanwhile.
+        """
+        while self._cursors:
+            behind = self.ring.write_pos - min(c.pos for c in self._cursors)
+            if behind + n_frames <= self.ring.capacity - max(self.ring.max_write, n_frames):
+                break
+            if self._stop_event.wait(0.001):
+                return False
+        return not self._stop_event.is_set()
+
+
+class ArraySource(ReplaySource):
+    """
+    Replays an in-memory array: int16 samples, or floats in [-1, 1],
+    shaped (n_frames,) or (n_frames, channels).
+    """
+    def __init__(self, samples: np.ndarray,
+                       rate=AUDIO_SAMPLE_RATE,
+                       chunk=AUDIO_CHUNK_SIZE,
+                       speed: Optional[float] = 1.0,
+                       ring_seconds=AUDIO_RING_SECONDS):
+        samples = np.asarray(samples)
+        channels = samples.shape[1] if samples.ndim == 2 else 1
+        super().__init__(rate, channels, chunk, speed, ring_seconds)
+        if samples.dtype.kind == 'f':
+            samples = (np.clip(samples, -1, 1) * np.iinfo(np.int16).max).astype(np.int16)
+        self.samples = samples.astype(np.int16, copy=False).reshape(-1)
+
+    def blocks(self):
+        step = self.chunk * self.channels
+        for i in range(0, len(self.samples), step):
+            yield self.samples[i:i+step]
+
+
+class FileSource(ReplaySource):
+    """
+    Replays a 16-bit WAV file, or a headerless raw PCM file (any other
+    suffix) at arg::rate with arg::channels. A WAV file at another rate
+    is resampled to arg::rate, and a multichannel one down-mixed if
+    arg::channels is 1, so consumers always get the format they asked
+    for. With arg::loop, starts over at the end of the file, until
+    stopped.
+    """
+    def __init__(self, path,
+                       rate=AUDIO_SAMPLE_RATE,
+                       channels=CHANNELS,
+                       chunk=AUDIO_CHUNK_SIZE,
+                       speed: Optional[float] = 1.0,
+                       loop=False,
+                       ring_seconds=AUDIO_RING_SECONDS):
+        self.path = path
+        self.loop = loop
+        self.is_wav = path.lower().endswith('.wav')
+        self.file_rate, self.file_channels = rate, channels
+        if self.is_wav:
+            with wave.open(path, 'rb') as wf:
+                if wf.getsampwidth() != 2:
+                    raise ValueError(f"{path}: only 16-bit WAV files are supported")
+                self.file_rate, self.file_channels = wf.getframerate(), wf.getnchannels()
+            if self.file_channels != channels and channels != 1:
+                raise ValueError(f"{path}: has {self.file_channels} channels, "
+                                 f"and can only be down-mixed to mono, not {channels}")
+        super().__init__(rate, channels, chunk, speed, ring_seconds)
+
+    def blocks(self):
+        resampler = None
+        if self.file_rate != self.rate:
+            resampler = StreamingResampler(self.file_rate, self.rate, self.channels)
+        # file frames per block, so that resampled blocks hold at most chunk frames
+        n_frames = max(1, self.chunk * self.file_rate // self.rate)
+        while True:
+            for block in self._read(n_frames):
+                if self.file_channels != self.channels:
+                    block = self._down_mix(block)
+                yield block if resampler is None else resampler.process(block)
+            if resampler is not None:
+                yield resampler.flush()
+                resampler.reset()
+            if not self.loop:
+                return
+
+    def _read(self, n_frames):
+        if self.is_wav:
+            with wave.open(self.path, 'rb') as wf:
+                while data := wf.readframes(n_frames):
+                    yield np.frombuffer(data, dtype=np.int16)
+        else:
+            with open(self.path, 'rb') as f:
+                while data := f.read(n_frames * self.file_channels * 2):
+                    yield np.frombuffer(data[:len(data) // 2 * 2], dtype=np.int16)
+
+    def _down_mix(self, block):
+        frames = block[:len(block) // self.file_channels * self.file_channels]
+        mono = frames.reshape(-1, self.file_channels).mean(axis=1)
+        return np.rint(mono).astype(np.int16)
+
+
+class ToneSource(ReplaySource):
+    """
+    Synthetic test signal: a sine tone at arg::frequency (None for no
+    tone) plus white noise, with amplitudes as fractions of full scale.
+    Runs for arg::duration seconds, or until stopped.
+    """
+    def __init__(self, frequency: Optional[float] = 440.0,
+                       amplitude=0.3,
+                       noise=0.0,
+                       duration: Optional[float] = None,
+                       rate=AUDIO_SAMPLE_RATE,
+                       chunk=AUDIO_CHUNK_SIZE,
+                       speed: Optional[float] = 1.0,
+                       seed=None,
+                       ring_seconds=AUDIO_RING_SECONDS):
+        super().__init__(rate, 1, chunk, speed, ring_seconds)
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.noise = noise
+        self.duration = duration
+        self.seed = seed
+
+    def blocks(self):
+        rng = np.random.default_rng(self.seed)
+        total = None if self.duration is None else int(self.duration * self.rate)
+        full_scale = np.iinfo(np.int16).max
+        pos = 0
+        while total is None or pos < total:
+            n = self.chunk if total is None else min(self.chunk, total - pos)
+            x = np.zeros(n, dtype=np.float32)
+            if self.frequency:
+                t = (pos + np.arange(n)) / self.rate
+                x += self.amplitude * np.sin(2 * np.pi * self.frequency * t, dtype=np.float32)
+            if self.noise:
+                x += rng.normal(0, self.noise, n).astype(np.float32)
+            yield (np.clip(x, -1, 1) * full_scale).astype(np.int16)
+            pos += n
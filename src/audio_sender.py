@@ -0,0 +1,153 @@
+from typing import Callable, Optional
+import collections
+import threading
+from .config import (AUDIO_SAMPLE_RATE, CHANNELS, SENDER_QUEUE_CHUNKS,
+                     SENDER_FULL_POLICY, SENDER_MAX_BATCH_BYTES)
+
+class SenderError(Exception):
+    """
+    Sending audio to the server failed; the original error is __cause__.
+    """
+
+class AudioSender:
+    """
+    Sends captured audio from its own thread, so a stalled network never
+    holds up the capture thread. put() queues raw PCM chunks; the sender
+    thread encodes and sends them, in order.
+
+    When the link is slower than capture, chunks pile up in the queue,
+    and the sender sends everything queued (up to max_batch_bytes of PCM)
+    as one larger frame: fewer, bigger writes let it catch up.
+
+    With a full queue (max_chunks), put() follows arg::policy:
+        block       : wait for room (capture buffers upstream meanwhile)
+        drop-oldest : discard the oldest queued chunk (audio is lost)
+        spill       : keep queueing in memory past the bound
+
+    Errors raised by the sender thread are re-raised (as SenderError) by
+    the next put() or by close(), so the recorder finds out.
+
+    Usage:
+        sender = AudioSender(client.send, encode=codec.encode)
+        sender.put(pcm_bytes) # repeatedly, from the capture thread
+        sender.close()        # flush what is queued
+        sender.stats()
+    """
+    policies = ('block', 'drop-oldest', 'spill')
+
+    def __init__(self, send: Callable[[bytes], None],
+                       encode: Optional[Callable[[bytes], bytes]] = None,
+                       rate: int = AUDIO_SAMPLE_RATE,
+                       channels: int = CHANNELS,
+                       max_chunks: int = SENDER_QUEUE_CHUNKS,
+                       policy: str = SENDER_FULL_POLICY,
+                       max_batch_bytes: int = SENDER_MAX_BATCH_BYTES):
+        if policy not in self.policies:
+            raise ValueError(f"Unknown sender policy {policy!r}: use one of {self.policies}")
+        self.send = send
+        self.encode = encode
+        self.max_chunks = max_chunks
+        self.policy = policy
+        self.max_batch_bytes = max_batch_bytes
+        self.bytes_per_ms = rate * channels * 2 / 1000 # 16-bit samples
+        self.error = None
+
+        self._chunks = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._pending_bytes = 0 # queued plus being sent, for lag
+
+        self.chunks_sent = 0
+        self.frames_sent = 0
+        self.chunks_dropped = 0
+        self.chunks_spilled = 0
+        self.max_lag_ms = 0.0
+
+        self._thread = threading.Thread(target=self._send_loop, name='[audio sender]', daemon=True)
+        self._thread.start()
+
+    def put(self, data: bytes) -> None:
+        """
+        Queue a chunk of raw PCM for sending.
+        """
+        with self._cond:
+            self._raise_if_failed()
+            if len(self._chunks) >= self.max_chunks:
+                if self.policy == 'block':
+                    while len(self._chunks) >= self.max_chunks and self.error is None:
+                        self._cond.wait()
+                    self._raise_if_failed()
+                elif self.policy == 'drop-oldest':
+                    dropped = self._chunks.popleft()
+                    self._pending_bytes -= len(dropped)
+                    self.chunks_dropped += 1
+                else:
+                    self.chunks_spilled += 1
+            self._chunks.append(data)
+            self._pending_bytes += len(data)
+            self.max_lag_ms = max(self.max_lag_ms, self._pending_bytes / self.bytes_per_ms)
+            self._cond.notify_all()
+
+    def lag_ms(self) -> float:
+        """
+        Milliseconds of audio captured but not yet sent.
+        """
+        return self._pending_bytes / self.bytes_per_ms
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Send whatever is still queued, then stop the sender thread.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        with self._cond:
+            self._raise_if_failed()
+
+    def stats(self) -> dict:
+        return dict(chunks_sent=self.chunks_sent,
+                    frames_sent=self.frames_sent,
+                    chunks_dropped=self.chunks_dropped,
+                    chunks_spilled=self.chunks_spilled,
+                    lag_ms=round(self.lag_ms(), 1),
+                    max_lag_ms=round(self.max_lag_ms, 1))
+
+    def _raise_if_failed(self) -> None:
+        if self.error is not None:
+            raise SenderError(f"Audio sender failed: {self.error}") from self.error
+
+    def _next_batch(self):
+        """
+        Everything queued, up to max_batch_bytes (but at least one chunk).
+        Returns None once closed and drained.
+        """
+        with self._cond:
+            while not self._chunks and not self._closed:
+                self._cond.wait()
+            if not self._chunks:
+                return None
+            batch = [self._chunks.popleft()]
+            size = len(batch[0])
+            while self._chunks and size + len(self._chunks[0]) <= self.max_batch_bytes:
+                chunk = self._chunks.popleft()
+                batch.append(chunk)
+                size += len(chunk)
+            self._cond.notify_all() # room for a blocked put()
+            return batch
+
+    def _send_loop(self) -> None:
+        try:
+            while (batch := self._next_batch()) is not None:
+                data = b''.join(batch) if len(batch) > 1 else batch[0]
+                self.send(self.encode(data) if self.encode else data)
+                with self._cond:
+                    self._pending_bytes -= len(data)
+                self.chunks_sent += len(batch)
+                self.frames_sent += 1
+        except Exception as e:
+            with self._cond:
+                self.error = e
+                self._chunks.clear()
+                self._pending_bytes = 0
+                self._cond.notify_all()
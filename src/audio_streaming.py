@@ -1,31 +1,44 @@
-import pyaudio
-import wave
 import time
 import threading
 import queue
-from pydub import AudioSegment
-from .config import PORT, AUDIO_SAMPLE_RATE, CHANNELS, AUDIO_CHUNK_SIZE, WHISPER_HOST
-from .utils import KeyboardListener
+from .config import (PORT, AUDIO_SAMPLE_RATE, CHANNELS, AUDIO_CHUNK_SIZE, AUDIO_CODEC,
+                     SENDER_FULL_POLICY, WHISPER_HOST)
+from .utils import get_codec, SilenceTrimmer, WavWriter, get_encoder_pool
+try:
+    from .utils import KeyboardListener
+except ImportError:
+    KeyboardListener = None # no KeyedStreamingAudioRecorder (see utils/__init__.py)
 from .network import Client
+from .audio_capture import MicrophoneSource
+from .audio_sender import AudioSender, SenderError
 
 class BaseAudioRecorder:
     """
     Base class for LocalAudioRecorder and StreamingAudioRecorder.
     Main methods to override are _init() _start(), _handle_data(), and _stop().
     (See these methods on this class for more detail).
-    The main engine of recording is done in _record().
+    The main engine of recording is done in _record(), which reads
+    chunks from an AudioSource (see audio_capture.py): the microphone by
+    default, or e.g. a FileSource to replay recordings without one.
     The public api to use the class consists of the record() and stop() methods.
     """
-    def __init__(self, rate=AUDIO_SAMPLE_RATE, channels=CHANNELS, chunk=AUDIO_CHUNK_SIZE):
+    def __init__(self, rate=AUDIO_SAMPLE_RATE, channels=CHANNELS, chunk=AUDIO_CHUNK_SIZE,
+                       source=None):
+        """
+        With a arg::source, its rate, channels and chunk size are used.
+        """
+        if source is not None:
+            rate, channels, chunk = source.rate, source.channels, source.chunk
         self.rate = rate
         self.channels = channels
         self.chunk = chunk
-        self.format = pyaudio.paInt16
+        self.source = source
         self.recording = False
-        self.audio = pyaudio.PyAudio()
-        self.stream = None
-        self.width = self.audio.get_sample_size(self.format)
-        self.poll_delay = 0.01
+        self.capture = None
+        self.cursor = None
+        self.width = 2 # 16-bit samples
+        # a chunk later than this counts as a capture underrun
+        self.chunk_timeout = 2 * chunk / rate + 0.1
 
     def record(self):
         """
@@ -44,29 +57,39 @@ class BaseAudioRecorder:
         """
         if self.recording:
             self.recording = False
+            if self.capture is not None:
+                self.capture.wake()
             print('Stop-recording request submitted...')
         else:
             print('Recording has not started: call to stop() ignored.')
 
     def start_stream(self):
         """
-        Initializes microphone input capture for recording.
+        Starts the audio source (microphone input capture by default).
         """
-        self.audio = pyaudio.PyAudio()
-        self.stream = self.audio.open(format=self.format,
-                                      channels=self.channels,
-                                      rate=self.rate,
-                                      input=True,
-                                      frames_per_buffer=self.chunk)
+        self.capture = self.source or MicrophoneSource(self.rate, self.channels, self.chunk)
+        self.capture.open()
+        self.cursor = self.capture.cursor()
+        self.capture.start()
 
     def stop_stream(self):
         """
-        Ends microphone input capture.
+        Ends microphone input capture. Audio captured but not yet read is
+        still handed to _handle_data.
         """
-        self.stream.stop_stream()
-        self.stream.close()
-        self.audio.terminate()
+        self.capture.stop()
+        while len(block := self.cursor.read(self.chunk)):
+            self._handle_data(block.tobytes())
         print('Stopped recording.')
+        stats = self.capture.stats()
+        if any(stats.values()):
+            print(f"Capture problems: {stats}")
+
+    def capture_stats(self):
+        """
+        Overflow / underrun counts of the last (or current) recording.
+        """
+        return self.capture.stats() if self.capture is not None else {}
 
     def _init(self):
         """
@@ -107,64 +130,104 @@ class BaseAudioRecorder:
         self._start()
         try:        
             while self.recording:
-                try:
-                    data = self.stream.read(self.chunk, exception_on_overflow=False)
-                    self._handle_data(data)
-                except IOError as e:
-                    print(f"Error: {e}")
-                time.sleep(self.poll_delay)
+                # wakes early when stop() is called
+                block = self.cursor.read_exact(self.chunk, timeout=self.chunk_timeout)
+                if block is not None and len(block):
+                    self._handle_data(block.tobytes())
+                if self.capture.finished and not self.cursor.available():
+                    break # replayed source ran out
         except KeyboardInterrupt:
             print("Recording interrupted.")
         finally:
+            self.recording = False
             self._stop()
 
 class LocalAudioRecorder(BaseAudioRecorder):
     """
     Record audio from microphone and save to disk as wav/mp3.
+    The wav file is written as audio arrives (memory use stays constant),
+    then encoded to each of arg::formats in a background process pool.
     """
     def __init__(self, filename="test",
                         rate=AUDIO_SAMPLE_RATE,
                         channels=CHANNELS,
-                        chunk=AUDIO_CHUNK_SIZE):
+                        chunk=AUDIO_CHUNK_SIZE,
+                        formats=('mp3',),
+                        encoder=None,
+                        source=None):
+
+        super().__init__(rate, channels, chunk, source)
+        self.set_basename(filename)
+        self.formats = formats
+        self.encoder = encoder # an EncoderPool; by default the shared one
+        self.wav = None
+        self.jobs = {} # format -> Future of the encoded file's path
+        self.saved = threading.Event()
+
+    def get_basename(self, filename):
+        return filename.rsplit('.', maxsplit=1)[0] # remove any suffix
 
-        super().__init__(rate, channels, chunk)
+    def set_basename(self, filename):
         self.basename = self.get_basename(filename)
         self.wav_path = self.basename + '.wav'
         self.mp3_path = self.basename + '.mp3'
 
-    def get_basename(self, filename):
-        return filename.rsplit('.', maxsplit=1)[0] # remove any suffix
+    def _init(self):
+        """
+        Overrides BaseAudioRecorder._init()
+        """
+        self.saved.clear()
+        self.jobs = {}
+        self.wav = WavWriter(self.wav_path, self.channels, self.width, self.rate)
+
+    def _handle_data(self, data):
+        """
+        Overrides BaseAudioRecorder._handle_data()
+        """
+        self.wav.write(data)
 
     def _stop(self):
         """
         Extends BaseAudioRecorder._stop()
         """
         super()._stop()
-        self.save_wav()
-        self.convert_to_mp3()
+        self.wav.close()
+        self.encode()
+        self.saved.set()
 
-    def save_wav(self):
-        wf = wave.open(self.wav_path, 'wb')
-        wf.setnchannels(self.channels)
-        wf.setsampwidth(self.width)
-        wf.setframerate(self.rate)
-        wf.writeframes(b''.join(self.frames))
-        wf.close()
+    def encode(self):
+        """
+        Queue encoding of the wav file to each format. Returns at once.
+        """
+        encoder = self.encoder or get_encoder_pool()
+        for fmt in self.formats:
+            self.jobs[fmt] = encoder.submit(self.wav_path, fmt, self.basename + '.' + fmt)
+        return self.jobs
 
-    def convert_to_mp3(self):
-        audio_segment = AudioSegment.from_wav(self.wav_path)
-        audio_segment.export(self.mp3_path, format="mp3")
+    def wait(self, timeout=None):
+        """
+        Wait for the recording to be saved and encoded. Returns the paths
+        written (wav first).
+        """
+        self.saved.wait(timeout)
+        paths = [self.wav_path]
+        for fmt, job in self.jobs.items():
+            try:
+                paths.append(job.result(timeout))
+            except Exception as e:
+                print(f"Encoding {self.wav_path} to {fmt} failed: {e}")
+        return paths
 
     def record_and_save(self, filename, duration):
         """
         Conveinence function to test recording behavior.
         """
         print(f'Recording for {duration} seconds...')
-        self.basename = self.get_basename(filename)
+        self.set_basename(filename)
         self.record()
         time.sleep(duration)
         self.stop()
-        print(f"Recording saved as: {self.wav_path}, {self.mp3_path}")
+        print(f"Recording saved as: {', '.join(self.wait())}")
 
 class StreamingAudioRecorder(BaseAudioRecorder):
     """
@@ -174,28 +237,94 @@ class StreamingAudioRecorder(BaseAudioRecorder):
                         channels=CHANNELS,
                         chunk=AUDIO_CHUNK_SIZE,
                         server_ip='127.0.0.1',
-                        server_port=PORT):
-
-        super().__init__(rate, channels, chunk)
+                        server_port=PORT,
+                        pool=None,
+                        codec=AUDIO_CODEC,
+                        sender_policy=SENDER_FULL_POLICY,
+                        trim_silence=False,
+                        source=None,
+                        partials=False,
+                        on_partial=None):
+
+        super().__init__(rate, channels, chunk, source)
         self.server_ip = server_ip
         self.server_port = server_port
+        self.pool = pool # optional ClientPool, to reuse one connection
+        self.codec_name = codec # requested; the server may fall back to pcm16
+        self.codec = get_codec('pcm16')
         self.client = None
+        self.sender_policy = sender_policy # when the network falls behind (see AudioSender)
+        self.sender = None
+        self.error = None
+        # with trim_silence, only audio around detected speech is sent (see utils/vad.py)
+        self.trimmer = SilenceTrimmer(self.rate, self.chunk / self.rate * 1000) if trim_silence else None
+        # with partials, a streaming server sends hypotheses while we record
+        self.partials = partials
+        self.on_partial = on_partial or self.print_partial
+        self.partials_accepted = False
+        self.partial_reader = None
+        self.final_response = None
         self.waiting_for_response = False
         self.q = queue.Queue()
 
     def wait_for_input(self):
-        return self.q.get()
+        """
+        Next transcription. Raises SenderError if streaming the recording
+        to the server failed, or the error (e.g. ServerBusyError) if the
+        transcription could not be received.
+        """
+        response = self.q.get()
+        if isinstance(response, Exception):
+            raise response
+        return response
 
     def open_socket(self):
         """
         Creates a TCP Socket to stream audio data over a network,
         incrementally, as it is recorded from a microphone input source.
+        With a pool, this opens a new stream on a persistent connection.
         """
-        self.client = Client(self.server_ip, self.server_port)
+        if self.pool is not None:
+            self.client = self.pool.stream(self.server_ip, self.server_port)
+        else:
+            self.client = Client(self.server_ip, self.server_port)
+
+        options = {}
+        if self.codec_name != 'pcm16':
+            options['codecs'] = [self.codec_name, 'pcm16']
+        if self.partials:
+            options['partials'] = True
+        accepted = self.client.negotiate(**options) if options else {}
+        self.codec = get_codec(accepted.get('codec', 'pcm16'))
+        self.partials_accepted = accepted.get('partials', False)
 
     def close_socket(self):
         self.client.close()
 
+    def print_partial(self, text):
+        print(f'\r(partial) {text}', end='', flush=True)
+
+    def _read_partials(self):
+        """
+        Runs in its own thread while recording, when the server accepted
+        partials: every frame but the last is a partial transcript.
+        """
+        previous = None
+        try:
+            for frame in self.client.receive_stream():
+                if previous is not None:
+                    self.on_partial(previous.decode('utf-8'))
+                previous = frame
+        except Exception as e:
+            previous = e
+        self.final_response = previous if previous is not None else b''
+
+    def sender_lag_ms(self):
+        """
+        Milliseconds of recorded audio not yet sent to the server.
+        """
+        return self.sender.lag_ms() if self.sender is not None else 0.0
+
     ### The below four methods ovverride BaseAudioRecorder methods: 
     ##      _init, _start, _handle_data, _stop
     
@@ -208,21 +337,80 @@ class StreamingAudioRecorder(BaseAudioRecorder):
         self.open_socket()
 
     def _start(self):
+        self._start_sender()
+        if self.trimmer is not None:
+            self.trimmer.reset()
         super()._start()
 
     def _handle_data(self, data):
-        self.client.send(data)
+        if self.error is not None:
+            return # already failed: drop the rest of the recording
+        chunks = self.trimmer.feed(data) if self.trimmer is not None else (data,)
+        try:
+            for chunk in chunks:
+                self.sender.put(chunk)
+        except SenderError as e:
+            self.error = e
+            self.recording = False
+            print(f"Stopping recording: {e}")
 
     def _stop(self):
         super()._stop()
-        self.client.end_transmission()
-        self._receive_response()
+        self._end_request()
+
+    def _start_sender(self):
+        self.error = None
+        self.sender = AudioSender(self.client.send, self.codec.encode,
+                                  self.rate, self.channels, policy=self.sender_policy)
+        self.partial_reader = None
+        if self.partials_accepted:
+            self.partial_reader = threading.Thread(target=self._read_partials,
+                                                   name='[partials]', daemon=True)
+            self.partial_reader.start()
+
+    def _end_request(self):
+        """
+        Flush the sender, end the transmission and wait for the transcription
+        (or pass on the sender's error).
+        """
+        try:
+            self.sender.close()
+        except SenderError as e:
+            self.error = self.error or e
+        stats = self.sender.stats()
+        if stats['chunks_dropped'] or stats['chunks_spilled']:
+            print(f"Network fell behind: {stats}")
+        if self.trimmer is not None:
+            print(f"Silence trimmed: {self.trimmer.trimmed_ratio:.0%} of the audio")
+
+        if self.error is not None:
+            self.close_socket()
+            self.q.put(self.error)
+            return
+        try:
+            self.client.end_transmission()
+            self._receive_response()
+        except Exception as e: # e.g. ServerBusyError, or the connection was reset
+            print(f"Transcription request failed: {e!r}")
+            try:
+                self.close_socket()
+            except OSError:
+                pass
+            self.q.put(e) # raised by wait_for_input()
 
     def _receive_response(self):
         self.waiting_for_response = True
-        self.response = self.client.receive() 
-        self.waiting_for_response = False
-        self.close_socket()
+        try:
+            if self.partial_reader is not None:
+                self.partial_reader.join()
+                if isinstance(self.final_response, Exception):
+                    raise self.final_response
+                self.response = self.final_response
+            else:
+                self.response = self.client.receive()
+        finally:
+            self.waiting_for_response = False
+            self.close_socket()
         self.q.put(self.response)
         print('\nGot:', self.response.decode('utf-8'))
    
@@ -240,9 +428,16 @@ class KeyedStreamingAudioRecorder(StreamingAudioRecorder):
                         channels=CHANNELS,
                         chunk=AUDIO_CHUNK_SIZE,
                         server_ip='127.0.0.1',
-                        server_port=PORT):
-
-        super().__init__(rate, channels, chunk, server_ip, server_port)
+                        server_port=PORT,
+                        pool=None,
+                        codec=AUDIO_CODEC,
+                        sender_policy=SENDER_FULL_POLICY,
+                        trim_silence=False,
+                        source=None,
+                        partials=False):
+
+        super().__init__(rate, channels, chunk, server_ip, server_port, pool, codec,
+                         sender_policy, trim_silence, source, partials)
         self.key = key
         self.keyboard = KeyboardListener(key=self.key,
                                          start_callback=self.record,
@@ -264,6 +459,105 @@ class KeyedStreamingAudioRecorder(StreamingAudioRecorder):
     def stop_listening(self):
         self.keyboard.stop_listening()
 
+
+class VADStreamingAudioRecorder(StreamingAudioRecorder):
+    """
+    Hands-free StreamingAudioRecorder: the microphone stays open, and
+    voice activity detection starts an utterance when speech begins and
+    ends it after VAD_END_SILENCE_MS of silence. Only the speech (plus a
+    short pre-roll) is streamed; each utterance is a separate request,
+    and its transcription is delivered through wait_for_input().
+    """
+    def __init__(self, rate=AUDIO_SAMPLE_RATE,
+                        channels=CHANNELS,
+                        chunk=AUDIO_CHUNK_SIZE,
+                        server_ip='127.0.0.1',
+                        server_port=PORT,
+                        pool=None,
+                        codec=AUDIO_CODEC,
+                        sender_policy=SENDER_FULL_POLICY,
+                        source=None,
+                        partials=False):
+
+        super().__init__(rate, channels, chunk, server_ip, server_port, pool, codec,
+                         sender_policy, trim_silence=True, source=source, partials=partials)
+        self.in_utterance = False
+        self.paused = False
+
+    def standby(self):
+        """
+        Start listening for speech (in the background).
+        """
+        print("Listening: start speaking to stream audio...")
+        self.record()
+
+    def stop_listening(self):
+        self.stop()
+
+    def pause(self):
+        """
+        Ignore the microphone (e.g. while a spoken reply is playing, so the
+        reply is not taken for the user speaking) until resume().
+        """
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    ### Overridden StreamingAudioRecorder methods: a socket is opened
+    ##  per utterance, not per recording.
+
+    def _init(self):
+        self.in_utterance = False
+        self.trimmer.reset()
+
+    def _start(self):
+        BaseAudioRecorder._start(self)
+
+    def _handle_data(self, data):
+        if self.paused and not self.in_utterance:
+            self.trimmer.reset()
+            return
+        chunks = self.trimmer.feed(data)
+        if chunks and not self.in_utterance:
+            self._begin_utterance()
+        if self.in_utterance and self.error is None:
+            try:
+                for chunk in chunks:
+                    self.sender.put(chunk)
+            except SenderError as e:
+                self.error = e
+                print(f"Abandoning utterance: {e}")
+        if self.in_utterance and (self.trimmer.ended or self.error is not None):
+            self._end_utterance()
+
+    def _stop(self):
+        BaseAudioRecorder._stop(self)
+        if self.in_utterance:
+            self._end_utterance()
+
+    ##
+    ### END Overridden StreamingAudioRecorder methods.
+
+    def _begin_utterance(self):
+        try:
+            self.open_socket()
+        except OSError as e:
+            print(f"Could not connect to {self.server_ip}:{self.server_port}: {e}")
+            self.trimmer.reset()
+            return
+        self._start_sender()
+        self.in_utterance = True
+        print('Speech detected, streaming...')
+
+    def _end_utterance(self):
+        self.in_utterance = False
+        self._end_request()
+        self.trimmer.reset()
+        # Skip what was said while the transcription was on its way.
+        if self.cursor is not None:
+            self.cursor.read()
+
 if __name__ == "__main__":
     # Example usage for recording and saving to MP3
     #local_recorder = LocalAudioRecorder()
@@ -0,0 +1 @@
+from .network_bench import run_benchmarks, compare_transports, save_report, compare_reports, SCENARIOS
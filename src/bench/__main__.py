@@ -0,0 +1,55 @@
+"""
+Loopback benchmark of the network layer. Runs offline, on localhost only.
+
+Examples:
+    python -m src.bench --output before.json
+    python -m src.bench --output after.json --compare before.json
+    python -m src.bench --scenarios miso --n-tokens 400 --token-rate 50
+    python -m src.bench --scenarios mimo simo --frame-size 1048576 --transport tcp unix shm
+"""
+import argparse
+from .network_bench import (run_benchmarks, compare_transports, save_report,
+                            compare_reports, SCENARIOS, TRANSPORTS, DEFAULT_SETTINGS)
+
+def parse_args():
+    d = DEFAULT_SETTINGS
+    parser = argparse.ArgumentParser(prog='python -m src.bench', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS),
+                        default=list(SCENARIOS))
+    parser.add_argument('--frame-size', type=int, default=d['frame_size'],
+                        help='payload bytes per client frame')
+    parser.add_argument('--concurrency', type=int, default=d['concurrency'],
+                        help='client threads')
+    parser.add_argument('--duration', type=float, default=d['duration'],
+                        help='seconds per scenario')
+    parser.add_argument('--frames-per-request', type=int, default=d['frames_per_request'],
+                        help='frames streamed per SIMO/SISO request')
+    parser.add_argument('--n-tokens', type=int, default=d['n_tokens'],
+                        help='tokens per MISO response')
+    parser.add_argument('--token-rate', type=float, default=d['token_rate'],
+                        help='MISO tokens per second (0: unthrottled)')
+    parser.add_argument('--transcribe-delay', type=float, default=d['transcribe_delay'],
+                        help='seconds the fake SIMO transcriber sleeps')
+    parser.add_argument('--transport', nargs='+', choices=TRANSPORTS, default=[d['transport']],
+                        help='several: run each, and compare them to the first')
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--compare', help='JSON report to compare against')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    settings = vars(args)
+    scenarios = settings.pop('scenarios')
+    output = settings.pop('output')
+    baseline = settings.pop('compare')
+    transports = settings.pop('transport')
+    if len(transports) > 1:
+        report = compare_transports(scenarios, transports, **settings)
+    else:
+        report = run_benchmarks(scenarios, transport=transports[0], **settings)
+    if output:
+        save_report(report, output)
+        print(f"\nreport written to {output}")
+    if baseline:
+        compare_reports(baseline, report)
@@ -0,0 +1,321 @@
+"""
+Loopback benchmarks for Transmit, Client and the Server variants.
+
+Each scenario starts a stand-in server (see standins.py) on localhost,
+then drives it from `concurrency` client threads for `duration` seconds.
+Everything runs in one process, so reported CPU covers client and server.
+"""
+from typing import Callable, Dict, List, Optional
+import contextlib
+import json
+import os
+import platform
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from ..network import Client, ClientPool, UnixTransport, ShmTransport
+from . import standins
+
+class Sample:
+    """
+    One completed request, as measured by the client.
+    """
+    __slots__ = ('n_bytes', 'n_frames', 'latency', 'first_frame')
+
+    def __init__(self, n_bytes, n_frames, latency, first_frame=None):
+        self.n_bytes = n_bytes
+        self.n_frames = n_frames
+        self.latency = latency
+        self.first_frame = first_frame
+
+
+def mimo_request(client, payload, settings) -> Sample:
+    start = time.perf_counter()
+    client.send(payload)
+    response = client.receive()
+    latency = time.perf_counter() - start
+    return Sample(len(payload) + len(response), 2, latency)
+
+def miso_request(client, payload, settings) -> Sample:
+    start = time.perf_counter()
+    client.send(payload)
+    first_frame = None
+    n_bytes, n_frames = len(payload), 1
+    for token in client.receive_stream(copy=False):
+        if first_frame is None:
+            first_frame = time.perf_counter() - start
+        n_bytes += len(token)
+        n_frames += 1
+    return Sample(n_bytes, n_frames, time.perf_counter() - start, first_frame)
+
+def simo_request(client, payload, settings) -> Sample:
+    """
+    Latency is measured from end of transmission to the response, i.e.
+    what a user waits for after releasing the push-to-talk key.
+    """
+    n = settings['frames_per_request']
+    for _ in range(n):
+        client.send(payload)
+    start = time.perf_counter()
+    client.end_transmission()
+    response = client.receive()
+    latency = time.perf_counter() - start
+    return Sample(n * len(payload) + len(response), n + 1, latency)
+
+def siso_request(client, payload, settings) -> Sample:
+    n = settings['frames_per_request']
+    start = time.perf_counter()
+    first_frame = None
+    n_bytes, n_frames = n * len(payload), n
+    for frame in client.duplex([payload] * n, copy=False):
+        if first_frame is None:
+            first_frame = time.perf_counter() - start
+        n_bytes += len(frame)
+        n_frames += 1
+    return Sample(n_bytes, n_frames, time.perf_counter() - start, first_frame)
+
+
+TRANSPORTS = ('tcp', 'mux', 'unix', 'shm')
+
+# name: (stand-in server class, request driver, transports it runs on)
+SCENARIOS = {
+    'mimo': (standins.EchoServer, mimo_request, TRANSPORTS),
+    'miso': (standins.FakeTokenServer, miso_request, TRANSPORTS),
+    'simo': (standins.FakeTranscriberServer, simo_request, TRANSPORTS),
+    'siso': (standins.EchoStreamServer, siso_request, TRANSPORTS),
+    'async-mimo': (standins.AsyncEchoServer, mimo_request, ('tcp',)),
+    'async-miso': (standins.AsyncFakeTokenServer, miso_request, ('tcp',)),
+    'async-simo': (standins.AsyncFakeTranscriberServer, simo_request, ('tcp',)),
+    'async-siso': (standins.AsyncEchoStreamServer, siso_request, ('tcp',)),
+}
+
+DEFAULT_SETTINGS = dict(frame_size=4096,
+                        concurrency=4,
+                        duration=3.0,
+                        frames_per_request=16,
+                        n_tokens=100,
+                        token_rate=0,
+                        transcribe_delay=0.0,
+                        transport='tcp')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    ix = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[ix]
+
+def make_transport(transport: str, port: int):
+    """
+    Unix and shared-memory transports listen on a socket file instead of
+    a port; tcp and mux return None (plain host and port).
+    """
+    path = os.path.join(tempfile.gettempdir(), f'audio-stream-bench-{port}.sock')
+    if transport == 'unix':
+        return UnixTransport(path)
+    if transport == 'shm':
+        return ShmTransport(path)
+    return None
+
+def start_server(server_cls, settings):
+    port = free_port()
+    concurrency = settings['concurrency']
+    if issubclass(server_cls, standins.AsyncServer):
+        server = server_cls(host='localhost', port=port, max_workers=concurrency)
+    else:
+        server = server_cls(host='localhost', port=port,
+                            max_in_flight=concurrency,
+                            max_queued=2 * concurrency,
+                            transport=make_transport(settings['transport'], port))
+    server.n_tokens = settings['n_tokens']
+    server.token_rate = settings['token_rate']
+    server.transcribe_delay = settings['transcribe_delay']
+    server.serve()
+    time.sleep(0.05) # let the accept loop start
+    return server, port
+
+def stop_server_threads(server, timeout: float = 5.0) -> None:
+    """
+    Wait for the server's accept loop to exit, so its last log lines are
+    not interleaved with the results.
+    """
+    for thread in threading.enumerate():
+        if thread.name == server.name and thread is not threading.current_thread():
+            thread.join(timeout)
+
+def drive(request: Callable, connect: Callable, settings):
+    """
+    Run `request` in a loop on each of `concurrency` threads until the
+    duration is up. Returns every completed sample, and every error.
+    """
+    payload = os.urandom(settings['frame_size'])
+    deadline = time.perf_counter() + settings['duration']
+    samples, errors = [], []
+
+    def worker():
+        while time.perf_counter() < deadline:
+            client = connect()
+            try:
+                samples.append(request(client, payload, settings))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                client.close()
+
+    threads = [threading.Thread(target=worker, name=f'[bench worker {i}]')
+               for i in range(settings['concurrency'])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, errors
+
+def summarize(samples: List[Sample], elapsed: float, cpu: float) -> Dict:
+    latencies = sorted(s.latency for s in samples)
+    first_frames = sorted(s.first_frame for s in samples if s.first_frame is not None)
+    n_bytes = sum(s.n_bytes for s in samples)
+    n_frames = sum(s.n_frames for s in samples)
+    mb = n_bytes / 1e6
+    ms = lambda v: None if v is None else round(v * 1e3, 3)
+    return dict(requests=len(samples),
+                requests_per_s=round(len(samples) / elapsed, 1),
+                frames_per_s=round(n_frames / elapsed, 1),
+                mb_per_s=round(mb / elapsed, 3),
+                latency_ms=dict(p50=ms(percentile(latencies, 50)),
+                                p95=ms(percentile(latencies, 95)),
+                                p99=ms(percentile(latencies, 99))),
+                first_frame_ms=dict(p50=ms(percentile(first_frames, 50)),
+                                    p95=ms(percentile(first_frames, 95)),
+                                    p99=ms(percentile(first_frames, 99))) if first_frames else None,
+                cpu_s=round(cpu, 3),
+                cpu_ms_per_mb=round(1e3 * cpu / mb, 3) if mb else None)
+
+def run_scenario(name: str, settings: Dict) -> Optional[Dict]:
+    server_cls, request, transports = SCENARIOS[name]
+    if settings['transport'] not in transports:
+        print(f"  skipping {name}: transport {settings['transport']} is not supported")
+        return None
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        server, port = start_server(server_cls, settings)
+        pool = ClientPool()
+        transport = server.transport if settings['transport'] in ('unix', 'shm') else None
+        if settings['transport'] == 'mux':
+            connect = lambda: pool.stream('localhost', port)
+        else:
+            connect = lambda: Client('localhost', port, transport=transport)
+        try:
+            cpu_start = time.process_time()
+            start = time.perf_counter()
+            samples, errors = drive(request, connect, settings)
+            elapsed = time.perf_counter() - start
+            cpu = time.process_time() - cpu_start
+        finally:
+            pool.close()
+            server.shutdown()
+            stop_server_threads(server)
+    if errors:
+        print(f"  {len(errors)} requests failed, e.g.: {errors[0]!r}")
+    result = summarize(samples, elapsed, cpu)
+    result['errors'] = len(errors)
+    return result
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(scenarios=None, **settings) -> Dict:
+    """
+    Run the named scenarios (default: all) and return a JSON-able report.
+    """
+    settings = {**DEFAULT_SETTINGS, **settings}
+    report = dict(meta=dict(commit=git_commit(),
+                            time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                            python=platform.python_version(),
+                            platform=platform.platform(),
+                            cpus=os.cpu_count(),
+                            settings=settings),
+                  results={})
+    for name in scenarios or SCENARIOS:
+        print(f"running {name}...")
+        result = run_scenario(name, settings)
+        if result is not None:
+            report['results'][name] = result
+            lat = result['latency_ms']
+            print(f"  {result['requests_per_s']} req/s, {result['mb_per_s']} MB/s, "
+                  f"p50/p95/p99 {lat['p50']}/{lat['p95']}/{lat['p99']} ms")
+    return report
+
+def compare_transports(scenarios=None, transports=TRANSPORTS, **settings) -> Dict:
+    """
+    Run the scenarios once per transport, and print each transport's
+    throughput and median latency relative to the first one (e.g. tcp).
+    Results are keyed "<scenario>@<transport>".
+    """
+    report = None
+    for transport in transports:
+        print(f"\n[{transport}]")
+        run = run_benchmarks(scenarios, **{**settings, 'transport': transport})
+        if report is None:
+            report = dict(meta=run['meta'], results={})
+        report['meta']['settings']['transport'] = list(transports)
+        for name, result in run['results'].items():
+            report['results'][f'{name}@{transport}'] = result
+
+    base = transports[0]
+    print(f"\nrelative to {base}:")
+    for name in scenarios or SCENARIOS:
+        old = report['results'].get(f'{name}@{base}')
+        if old is None:
+            continue
+        for transport in transports[1:]:
+            new = report['results'].get(f'{name}@{transport}')
+            if new is None or not old['requests_per_s']:
+                continue
+            p50 = (f", p50 x{new['latency_ms']['p50'] / old['latency_ms']['p50']:.2f}"
+                   if old['latency_ms']['p50'] and new['latency_ms']['p50'] else '')
+            print(f"  {name:<12} {transport:<5} req/s x{new['requests_per_s'] / old['requests_per_s']:.2f}, "
+                  f"MB/s x{new['mb_per_s'] / old['mb_per_s']:.2f}{p50}")
+    return report
+
+def save_report(report: Dict, path: str) -> None:
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+def compare_reports(baseline_path: str, report: Dict) -> None:
+    """
+    Print each metric of arg::report as a ratio against a saved baseline.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\ncompared to {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    metrics = [('requests_per_s', 'req/s'), ('mb_per_s', 'MB/s'),
+               ('latency_ms.p50', 'p50'), ('latency_ms.p99', 'p99'),
+               ('cpu_ms_per_mb', 'cpu/MB')]
+
+    def get(result, key):
+        for part in key.split('.'):
+            result = (result or {}).get(part)
+        return result
+
+    for name, result in report['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        cells = []
+        for key, label in metrics:
+            new_value, old_value = get(result, key), get(old, key)
+            if new_value is not None and old_value:
+                cells.append(f"{label} x{new_value / old_value:.2f}")
+        print(f"  {name:<12} " + ', '.join(cells))
@@ -0,0 +1,70 @@
+"""
+CPU cost of StreamingResampler (utils/resample.py), in milliseconds of
+CPU per second of audio, for the rate conversions we use: device-native
+mic rates down to 16 kHz, and TTS audio up to device-native output rates.
+Linear interpolation (np.interp, which aliases) is timed alongside as a
+floor for what any converter costs.
+
+Examples:
+    python -m src.bench.resample_bench
+    python -m src.bench.resample_bench --chunk 1024 4096 --taps 8 16 32
+"""
+from typing import Dict, List
+import argparse
+import time
+import numpy as np
+from ..utils import StreamingResampler
+
+CONVERSIONS = [(48000, 16000), (44100, 16000), (22050, 48000), (22050, 44100)]
+
+def test_signal(rate: int, seconds: float) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    t = np.arange(int(rate * seconds)) / rate
+    x = 8000 * np.sin(2 * np.pi * 440 * t) + rng.normal(0, 1000, len(t))
+    return x.astype(np.int16)
+
+def time_streaming(x, in_rate, out_rate, chunk, taps) -> float:
+    resampler = StreamingResampler(in_rate, out_rate, taps_per_phase=taps)
+    start = time.process_time()
+    for i in range(0, len(x), chunk):
+        resampler.process(x[i:i+chunk])
+    return time.process_time() - start
+
+def time_interp(x, in_rate, out_rate, chunk) -> float:
+    start = time.process_time()
+    for i in range(0, len(x), chunk):
+        block = x[i:i+chunk]
+        n_out = len(block) * out_rate // in_rate
+        np.interp(np.arange(n_out) * (in_rate / out_rate), np.arange(len(block)), block).astype(np.int16)
+    return time.process_time() - start
+
+def run(chunks: List[int], taps: List[int], seconds: float) -> List[Dict]:
+    results = []
+    for in_rate, out_rate in CONVERSIONS:
+        x = test_signal(in_rate, seconds)
+        for chunk in chunks:
+            row = dict(conversion=f'{in_rate}->{out_rate}', chunk=chunk,
+                       interp_ms_per_s=round(1e3 * time_interp(x, in_rate, out_rate, chunk) / seconds, 3))
+            for k in taps:
+                cpu = time_streaming(x, in_rate, out_rate, chunk, k)
+                row[f'taps{k}_ms_per_s'] = round(1e3 * cpu / seconds, 3)
+            results.append(row)
+            cells = ', '.join(f'{key} {value}' for key, value in row.items()
+                              if key.endswith('ms_per_s'))
+            print(f"  {row['conversion']:<13} chunk {chunk:<6} {cells}")
+    return results
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m src.bench.resample_bench', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunk', nargs='+', type=int, default=[4096],
+                        help='input frames per process() call')
+    parser.add_argument('--taps', nargs='+', type=int, default=[16],
+                        help='filter taps per polyphase branch')
+    parser.add_argument('--seconds', type=float, default=20.0, help='audio per measurement')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    print('CPU milliseconds per second of audio:')
+    run(args.chunk, args.taps, args.seconds)
@@ -0,0 +1,138 @@
+"""
+Stand-in servers for benchmarking the network layer without loading any
+models. Each mirrors the shape of a real server:
+    EchoServer             (MIMO) : echoes the request.
+    FakeTokenServer        (MISO) : streams n_tokens tokens at a fixed rate, like GPTServer.
+    FakeTranscriberServer  (SIMO) : sleeps transcribe_delay per request, like SpeechToTextServer.
+    EchoStreamServer       (SISO) : echoes each frame as it arrives.
+Async variants mirror the same behaviour on the AsyncServer family.
+FakeBatchModel stands in for a speech-to-text model (see stt/scheduler.py).
+"""
+import threading
+import time
+from ..network import (Server, MessageInSequenceOutServer, SequenceInMessageOutServer,
+                       SequenceInSequenceOutServer, AsyncServer,
+                       AsyncMessageInSequenceOutServer, AsyncSequenceInMessageOutServer,
+                       AsyncSequenceInSequenceOutServer)
+
+def fake_tokens(message, n_tokens, token_rate):
+    """
+    Yield n_tokens small tokens, token_rate per second (0: unthrottled).
+    """
+    interval = 1 / token_rate if token_rate else 0
+    start = time.perf_counter()
+    for i in range(n_tokens):
+        if interval:
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield b' tok%d' % i
+
+
+class EchoServer(Server):
+    pass
+
+class FakeTokenServer(MessageInSequenceOutServer):
+    n_tokens = 100
+    token_rate = 0
+
+    def _process(self, message):
+        return fake_tokens(message, self.n_tokens, self.token_rate)
+
+class FakeTranscriberServer(SequenceInMessageOutServer):
+    transcribe_delay = 0.0
+
+    def _process(self, message):
+        time.sleep(self.transcribe_delay)
+        return b'transcript of %d bytes' % len(message)
+
+class EchoStreamServer(SequenceInSequenceOutServer):
+    def _process(self, sequence):
+        yield from sequence
+
+
+class AsyncEchoServer(AsyncServer):
+    pass
+
+class AsyncFakeTokenServer(AsyncMessageInSequenceOutServer):
+    n_tokens = 100
+    token_rate = 0
+
+    def _process(self, message):
+        return fake_tokens(message, self.n_tokens, self.token_rate)
+
+class AsyncFakeTranscriberServer(AsyncSequenceInMessageOutServer):
+    transcribe_delay = 0.0
+
+    def _process(self, message):
+        time.sleep(self.transcribe_delay)
+        return b'transcript of %d bytes' % len(message)
+
+class AsyncEchoStreamServer(AsyncSequenceInSequenceOutServer):
+    async def _process(self, sequence):
+        async for frame in sequence:
+            yield frame
+
+
+class FakeBatchModel:
+    """
+    Stand-in for a GPU speech-to-text model: one pass at a time, each
+    costing a fixed overhead plus a smaller amount per utterance in the
+    batch, so batching pays off the way it does on a GPU.
+    """
+    def __init__(self, overhead=0.08, per_item=0.01):
+        self.overhead = overhead
+        self.per_item = per_item
+        self.lock = threading.Lock()
+
+    def transcribe_batch(self, audios):
+        with self.lock:
+            time.sleep(self.overhead + self.per_item * len(audios))
+        return [f'transcript of {len(audio)} samples' for audio in audios]
+
+    def transcribe(self, audio):
+        return self.transcribe_batch([audio])[0]
+
+
+class FakeWhisper:
+    """
+    Stand-in for Whisper in worker processes (see stt/pool.py): burns
+    arg::cost CPU seconds, holding the GIL, per second of audio.
+    """
+    def __init__(self, model_name=None, cost=0.05):
+        self.cost = cost
+
+    def transcribe(self, audio_data):
+        deadline = time.process_time() + self.cost * len(audio_data) / 16000
+        while time.process_time() < deadline:
+            pass
+        return f'transcript of {len(audio_data)} samples'
+
+    def transcribe_words(self, audio_data, prompt=''):
+        return [(0.0, len(audio_data) / 16000, ' ' + self.transcribe(audio_data))]
+
+    def transcribe_batch(self, audios):
+        return [self.transcribe(audio) for audio in audios]
+
+
+class FakeGPT:
+    """
+    Stand-in for a GPT model instance (see gpt/sessions.py): n_tokens
+    tokens, token_rate per second, echoing the end of the prompt.
+    """
+    def __init__(self, n_tokens=20, token_rate=200):
+        self.n_tokens = n_tokens
+        self.token_rate = token_rate
+        self.sessions_started = 0
+        self.prompts = []
+
+    def start_session(self, ping=True):
+        self.sessions_started += 1
+
+    def end_session(self):
+        pass
+
+    def get_tokens(self, prompt):
+        self.prompts.append(prompt)
+        for token in fake_tokens(prompt, self.n_tokens, self.token_rate):
+            yield token.decode()
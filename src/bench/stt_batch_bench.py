@@ -0,0 +1,87 @@
+"""
+Benchmark of cross-request batching (stt/scheduler.py) with a stand-in
+model (see FakeBatchModel in standins.py): `concurrency` clients submit
+utterances in a closed loop, first straight to the model (each pass
+serialized, as on one GPU), then through a BatchScheduler for each
+batch size. Reports seconds of audio transcribed per second, and latency.
+
+Examples:
+    python -m src.bench.stt_batch_bench
+    python -m src.bench.stt_batch_bench --concurrency 16 --batch-sizes 4 8 16 --max-wait-ms 10
+"""
+from typing import Dict, List
+import argparse
+import threading
+import time
+import numpy as np
+from ..config import AUDIO_SAMPLE_RATE
+from ..stt.scheduler import BatchScheduler
+from .network_bench import percentile
+from .standins import FakeBatchModel
+
+def drive(transcribe, concurrency: int, duration: float, utterance_s: float) -> Dict:
+    audio = np.zeros(int(utterance_s * AUDIO_SAMPLE_RATE), dtype=np.float32)
+    deadline = time.perf_counter() + duration
+    latencies = []
+
+    def client():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            transcribe(audio)
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, name=f'[stt client {i}]')
+               for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    ms = lambda v: None if v is None else round(v * 1e3, 1)
+    return dict(requests=len(latencies),
+                audio_s_per_s=round(len(latencies) * utterance_s / elapsed, 2),
+                latency_ms=dict(p50=ms(percentile(latencies, 50)),
+                                p95=ms(percentile(latencies, 95))))
+
+def run(concurrency: int, duration: float, utterance_s: float, batch_sizes: List[int],
+        max_wait_ms: float, overhead: float, per_item: float) -> Dict:
+    model = FakeBatchModel(overhead, per_item)
+    results = {}
+
+    def report(name, result):
+        results[name] = result
+        lat = result['latency_ms']
+        print(f"  {name:<12} {result['audio_s_per_s']:>8} s audio/s, "
+              f"p50/p95 {lat['p50']}/{lat['p95']} ms")
+
+    report('unbatched', drive(model.transcribe, concurrency, duration, utterance_s))
+    for size in batch_sizes:
+        scheduler = BatchScheduler(model.transcribe_batch, max_batch_size=size,
+                                   max_wait_ms=max_wait_ms)
+        result = drive(scheduler.transcribe, concurrency, duration, utterance_s)
+        result['mean_batch'] = round(scheduler.requests / max(scheduler.batches, 1), 2)
+        scheduler.shutdown()
+        report(f'batch<={size}', result)
+    return results
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m src.bench.stt_batch_bench', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--duration', type=float, default=3.0, help='seconds per run')
+    parser.add_argument('--utterance', type=float, default=3.0, help='seconds of audio per request')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[2, 4, 8])
+    parser.add_argument('--max-wait-ms', type=float, default=20.0)
+    parser.add_argument('--overhead', type=float, default=0.08,
+                        help='stand-in model: seconds per pass')
+    parser.add_argument('--per-item', type=float, default=0.01,
+                        help='stand-in model: extra seconds per utterance in a pass')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    print(f"{args.concurrency} clients, {args.utterance} s utterances:")
+    run(args.concurrency, args.duration, args.utterance, args.batch_sizes,
+        args.max_wait_ms, args.overhead, args.per_item)
@@ -0,0 +1,133 @@
+"""
+Replay a corpus of recorded utterances against a SpeechToTextServer, the
+way StreamingAudioRecorder streams a microphone, at N times real time and
+from several clients at once. Reports throughput in seconds of audio
+transcribed per second.
+
+Examples:
+    python -m src.bench.stt_replay corpus/*.wav --host 192.168.1.219 --speed 4 --concurrency 8
+    python -m src.bench.stt_replay --synthetic 20 --standin --speed 0   # offline, unpaced
+"""
+from typing import Dict, List, Optional
+import argparse
+import contextlib
+import os
+import threading
+import time
+import numpy as np
+from ..config import PORT, AUDIO_SAMPLE_RATE
+from ..audio_capture import FileSource, ArraySource
+from ..audio_streaming import StreamingAudioRecorder
+from .network_bench import percentile, start_server, stop_server_threads, DEFAULT_SETTINGS
+from . import standins
+
+def synthetic_corpus(n: int, seconds: float = 3.0, seed: int = 0) -> List[np.ndarray]:
+    """
+    arg::n noisy tones of arg::seconds each, for runs without recordings.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * AUDIO_SAMPLE_RATE)) / AUDIO_SAMPLE_RATE
+    return [0.3 * np.sin(2 * np.pi * rng.uniform(100, 400) * t) + rng.normal(0, 0.02, len(t))
+            for _ in range(n)]
+
+def make_source(item, speed):
+    if isinstance(item, str):
+        return FileSource(item, speed=speed)
+    return ArraySource(item, speed=speed)
+
+def replay_one(item, host, port, speed) -> Dict:
+    source = make_source(item, speed)
+    recorder = StreamingAudioRecorder(server_ip=host, server_port=port, source=source)
+    start = time.perf_counter()
+    recorder.record()
+    transcript = recorder.wait_for_input()
+    elapsed = time.perf_counter() - start
+    audio_s = source.frames_written / source.rate
+    # time spent waiting after the last of the audio was captured
+    latency = elapsed - (audio_s / speed if speed else 0)
+    return dict(audio_s=audio_s, elapsed=elapsed, latency=max(latency, 0.0),
+                transcript=transcript)
+
+def replay_corpus(corpus, host='localhost', port=PORT, speed: Optional[float] = 1.0,
+                  concurrency: int = 1) -> Dict:
+    """
+    Replay each item of arg::corpus (WAV/raw paths, or arrays) once,
+    spread over arg::concurrency clients, at arg::speed times real time
+    (None or 0: as fast as the client and server allow).
+    """
+    items = list(corpus)
+    results, errors = [], []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not items:
+                    return
+                item = items.pop(0)
+            try:
+                results.append(replay_one(item, host, port, speed))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker, name=f'[replay worker {i}]')
+               for i in range(concurrency)]
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    wall = time.perf_counter() - start
+
+    audio_s = sum(r['audio_s'] for r in results)
+    latencies = sorted(r['latency'] for r in results)
+    ms = lambda v: None if v is None else round(v * 1e3, 1)
+    return dict(utterances=len(results),
+                errors=len(errors),
+                first_error=repr(errors[0]) if errors else None,
+                audio_s=round(audio_s, 2),
+                wall_s=round(wall, 2),
+                audio_s_per_s=round(audio_s / wall, 2) if wall else None,
+                latency_ms=dict(p50=ms(percentile(latencies, 50)),
+                                p95=ms(percentile(latencies, 95))))
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m src.bench.stt_replay', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', help='WAV (or raw 16 kHz PCM) files to replay')
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help='also replay this many synthetic utterances')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='times real time (0: unpaced)')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--standin', action='store_true',
+                        help='replay against a local stand-in transcriber instead of --host')
+    parser.add_argument('--transcribe-delay', type=float, default=0.0,
+                        help='seconds the stand-in transcriber sleeps per utterance')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    corpus = list(args.paths) + synthetic_corpus(args.synthetic)
+    host, port, server = args.host, args.port, None
+    if args.standin:
+        settings = {**DEFAULT_SETTINGS, 'concurrency': args.concurrency,
+                    'transcribe_delay': args.transcribe_delay}
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            server, port = start_server(standins.FakeTranscriberServer, settings)
+        host = 'localhost'
+    try:
+        result = replay_corpus(corpus, host, port, args.speed or None, args.concurrency)
+    finally:
+        if server is not None:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                server.shutdown()
+                stop_server_threads(server)
+    print(f"{result['utterances']} utterances ({result['audio_s']} s of audio) in {result['wall_s']} s: "
+          f"{result['audio_s_per_s']} s of audio per second, "
+          f"latency p50/p95 {result['latency_ms']['p50']}/{result['latency_ms']['p95']} ms")
+    if result['errors']:
+        print(f"{result['errors']} failed, e.g.: {result['first_error']}")
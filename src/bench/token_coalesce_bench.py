@@ -0,0 +1,172 @@
+"""
+Benchmark of token coalescing (network/coalesce.py) on the MISO send
+path: a stand-in token server streams a GPT-like response (short word
+tokens, with sentence ends) to `concurrency` clients, first one token per
+frame, then through a TokenCoalescer for each boundary mode. Reports send
+and recv calls per response (each one syscall, barring partial writes),
+frames per response, time to first token and latency.
+
+Examples:
+    python -m src.bench.token_coalesce_bench
+    python -m src.bench.token_coalesce_bench --n-tokens 400 --token-rate 0 --max-bytes 1024
+"""
+from typing import Dict, List
+import argparse
+import contextlib
+import threading
+import time
+from ..network import Client, MessageInSequenceOutServer, Transmit, TokenCoalescer
+from .network_bench import free_port, percentile, stop_server_threads
+
+WORDS = (b"The quick brown fox jumps over the lazy dog, and then it runs off into "
+         b"the woods. Nobody saw where it went! Did it come back the next day? "
+         b"It did not.").split(b' ')
+
+def text_tokens(n_tokens, token_rate):
+    """
+    Yield n_tokens word-sized tokens (leading space, as GPT tokens have),
+    token_rate per second (0: unthrottled).
+    """
+    interval = 1 / token_rate if token_rate else 0
+    start = time.perf_counter()
+    for i in range(n_tokens):
+        if interval:
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield b' ' + WORDS[i % len(WORDS)]
+
+
+class TextTokenServer(MessageInSequenceOutServer):
+    n_tokens = 400
+    token_rate = 0
+
+    def _process(self, message):
+        return text_tokens(self.n_tokens, self.token_rate)
+
+
+class CallCounter:
+    """
+    Counts calls of Transmit._send_buffers and Transmit._receive_into
+    while active.
+    """
+    def __init__(self):
+        self.sends = 0
+        self.recvs = 0
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def counting(self):
+        send_buffers, receive_into = Transmit.__dict__['_send_buffers'], Transmit.__dict__['_receive_into']
+        counter = self
+
+        def counted_send(cls, sock, buffers):
+            with counter.lock:
+                counter.sends += 1
+            return send_buffers.__func__(cls, sock, buffers)
+
+        def counted_receive(cls, sock, view):
+            with counter.lock:
+                counter.recvs += 1
+            return receive_into.__func__(cls, sock, view)
+
+        Transmit._send_buffers = classmethod(counted_send)
+        Transmit._receive_into = classmethod(counted_receive)
+        try:
+            yield self
+        finally:
+            Transmit._send_buffers = send_buffers
+            Transmit._receive_into = receive_into
+
+
+def drive(port: int, concurrency: int, requests: int) -> Dict:
+    """
+    `requests` responses on each of `concurrency` client threads.
+    """
+    latencies, first_tokens, frames, sizes = [], [], [], []
+
+    def client():
+        for _ in range(requests):
+            c = Client(host='localhost', port=port)
+            try:
+                start = time.perf_counter()
+                c.send(b'Tell me a story.')
+                first, n_frames, n_bytes = None, 0, 0
+                for payload in c.receive_stream(copy=False):
+                    if first is None:
+                        first = time.perf_counter() - start
+                    n_frames += 1
+                    n_bytes += len(payload)
+                latencies.append(time.perf_counter() - start)
+                first_tokens.append(first)
+                frames.append(n_frames)
+                sizes.append(n_bytes)
+            finally:
+                c.close()
+
+    threads = [threading.Thread(target=client, name=f'[bench client {i}]')
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    first_tokens.sort()
+    ms = lambda v: None if v is None else round(v * 1e3, 1)
+    return dict(responses=len(latencies),
+                frames=round(sum(frames) / len(frames), 1),
+                bytes=round(sum(sizes) / len(sizes)),
+                first_token_ms=dict(p50=ms(percentile(first_tokens, 50)),
+                                    p95=ms(percentile(first_tokens, 95))),
+                latency_ms=dict(p50=ms(percentile(latencies, 50)),
+                                p95=ms(percentile(latencies, 95))))
+
+def run(n_tokens: int, token_rate: float, concurrency: int, requests: int,
+        max_bytes: int, max_delay_ms: float, boundaries: List[str]) -> Dict:
+    modes = [('off', None)] + [(f'{b or "bytes"}', TokenCoalescer(max_bytes, max_delay_ms, b))
+                               for b in boundaries]
+    results = {}
+    for name, coalescer in modes:
+        port = free_port()
+        server = TextTokenServer(host='localhost', port=port, max_in_flight=concurrency,
+                                 max_queued=2 * concurrency)
+        server.n_tokens = n_tokens
+        server.token_rate = token_rate
+        server.coalescer = coalescer
+        server.serve()
+        time.sleep(0.05) # let the accept loop start
+        with CallCounter().counting() as counter:
+            result = drive(port, concurrency, requests)
+        server.shutdown()
+        stop_server_threads(server)
+        # the request frame and end of transmission are counted too
+        result['send_calls'] = round(counter.sends / result['responses'], 1)
+        result['recv_calls'] = round(counter.recvs / result['responses'], 1)
+        results[name] = result
+        print(f"  {name:<9} {result['send_calls']:>6} sends, {result['recv_calls']:>6} recvs, "
+              f"{result['frames']:>6} frames per response; first token p50 "
+              f"{result['first_token_ms']['p50']} ms, latency p50 {result['latency_ms']['p50']} ms")
+    return results
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m src.bench.token_coalesce_bench',
+                                     description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n-tokens', type=int, default=400, help='tokens per response')
+    parser.add_argument('--token-rate', type=float, default=200,
+                        help='tokens per second (0: unthrottled)')
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads')
+    parser.add_argument('--requests', type=int, default=2, help='responses per client')
+    parser.add_argument('--max-bytes', type=int, default=512)
+    parser.add_argument('--max-delay-ms', type=float, default=50)
+    parser.add_argument('--boundaries', nargs='+', default=['bytes', 'word', 'sentence'],
+                        choices=['bytes', 'word', 'sentence'],
+                        help="modes to compare ('bytes': no boundary)")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    print(f"{args.concurrency} clients, {args.n_tokens} tokens per response "
+          f"at {args.token_rate or 'unthrottled'} tokens/s:")
+    run(args.n_tokens, args.token_rate, args.concurrency, args.requests, args.max_bytes,
+        args.max_delay_ms, [None if b == 'bytes' else b for b in args.boundaries])
@@ -2,20 +2,89 @@
 HOST = ''
 PORT = 5000
 CHUNK_SIZE = 8192
+COALESCE_DELAY_US = 2000 # max time a coalesced frame may wait before sending
+TOKEN_COALESCE_BYTES = 512 # a streamed response's tokens sent together once this many are pending
+TOKEN_COALESCE_DELAY_MS = 50 # max time a token may be held back for coalescing
+TOKEN_COALESCE_BOUNDARY = 'word' # None, 'word' (frames end between words) or 'sentence' (also sent at each sentence end)
+SERVER_BACKLOG = 64 # pending connections the OS will hold before accept()
+SERVER_MAX_IN_FLIGHT = 4 # connections handled concurrently
+SERVER_MAX_QUEUED = 16 # connections waiting for a handler before rejecting
+SERVER_QUEUE_TIMEOUT = 10.0 # seconds a connection may wait for a handler
+SERVER_DRAIN_TIMEOUT = 5.0 # seconds a kept-alive connection may take to end an abandoned request
+MUX_HELLO_TIMEOUT = 2.0 # seconds to wait for a server to accept multiplexing
+MUX_IDLE_CHECK = 30.0 # ping pooled connections idle for longer than this
+MUX_PING_TIMEOUT = 1.0
+MUX_STREAM_QUEUE = 64 # frames buffered per stream before the server stops reading its connection
+MUX_MAX_FRAME = 64 * 1024**2 # larger multiplexed frames close the connection
+MUX_ENABLED = False # main.run(): multiplex requests over pooled connections (see network/mux.py)
+SHM_RING_SIZE = 4 * 1024 * 1024 # bytes per direction for ShmTransport connections
+SHM_HANDSHAKE_TIMEOUT = 2.0
+METRICS_EXPORT_INTERVAL = 10.0 # seconds between Prometheus file dumps
 
 # speech-to-text server
 WHISPER_HOST = '192.168.1.219'
 WHISPER_MODEL = 'base'
+STT_STREAMING = False # serve StreamingSpeechToTextServer (transcribes while audio arrives)
+STT_PARTIAL_INTERVAL = 1.0 # seconds of new audio between partial transcriptions
+STT_MAX_WINDOW = 20.0 # seconds of uncommitted audio before a partial is committed anyway
+STT_BATCHING = False # batch concurrent requests through one model (see stt/scheduler.py)
+STT_MAX_BATCH_SIZE = 8
+STT_MAX_BATCH_WAIT_MS = 20 # longest a request waits for others to join its batch
+STT_POOL_WORKERS = 0 # model worker processes (see stt/pool.py); 0: one model in the server process
+STT_POOL_THREADS = None # inference threads per worker process (None: an equal share of the cores)
+STT_CACHE = False # answer repeated utterances from a transcript cache (see stt/cache.py)
+STT_CACHE_BYTES = 16 * 1024**2 # in-memory tier
+STT_CACHE_DIR = None # on-disk tier (None: memory only)
+STT_CACHE_DISK_BYTES = 256 * 1024**2
+STT_CACHE_NEAR = False # also match near-duplicate audio by loudness fingerprint
+STT_CACHE_TOLERANCE_DB = 2.0 # mean dB difference per 50 ms frame still counted as a match
+STT_TRIM_SILENCE = True # trim silence and split long utterances before transcribing (see stt/preprocess.py)
+STT_TRIM_PAD_MS = 200 # silence kept either side of the speech
+STT_MAX_SEGMENT = 28.0 # seconds: longer utterances are split at pauses to fit Whisper's 30 s window
+STT_ARCHIVE_DIR = 'stt_archive' # where received audio is kept (None: not kept)
+STT_ARCHIVE_QUEUE = 32 # requests waiting to be written before archive copies are dropped
+STT_ARCHIVE_COMPRESS = None # None (WAV), 'gzip', or an encoder format: 'mp3', 'opus', 'ogg'
+STT_ARCHIVE_MAX_BYTES = 2 * 1024**3 # oldest files deleted beyond this (None: no limit)
+STT_ARCHIVE_MAX_AGE = 7 * 24 * 3600 # seconds files are kept (None: no limit)
 
 # GPT token generation server
 GPT_HOST = '192.168.1.176'
 GPT_PORT = 9000
 GPT_DEVICE = "nvidia"
+GPT_INSTANCES = 1 # model instances generating concurrently (each loads its own copy)
+GPT_SCHEDULING = 'fifo' # or 'priority': lowest 'priority' option first
+GPT_MAX_SESSIONS = 64 # conversations kept, least recently used dropped first
+GPT_SESSION_BYTES = 4 * 1024**2 # of conversation history kept, across sessions
+GPT_SESSION_IDLE = 30 * 60 # seconds before an unused conversation is dropped
+GPT_RECAP_CHARS = 6000 # earlier turns replayed when a conversation moves to another model context
+GPT_COALESCE_TOKENS = False # send several tokens per frame (see network/coalesce.py)
 
 # audio
 AUDIO_SAMPLE_RATE = 16000 # Sample rate that Whisper requires
 CHANNELS = 1
 AUDIO_CHUNK_SIZE = 4096
+AUDIO_RING_SECONDS = 10 # captured audio buffered for slow consumers before overruns
+AUDIO_DEVICE_RATE = None # mic capture rate (None: the device's native rate), resampled to AUDIO_SAMPLE_RATE
+AUDIO_CODEC = 'pcm16' # on-wire codec for streamed mic audio: pcm16, mulaw, alaw, ima-adpcm
+ENCODER_WORKERS = None # processes encoding recordings to mp3/opus (None: one per core)
+SENDER_QUEUE_CHUNKS = 32 # chunks of mic audio queued for the network before SENDER_FULL_POLICY applies
+SENDER_FULL_POLICY = 'block' # block, drop-oldest or spill (see AudioSender)
+SENDER_MAX_BATCH_BYTES = 64 * 1024 # largest frame of queued PCM sent in one go when catching up
+
+# voice activity detection (see utils/vad.py)
+VAD_FRAME_MS = 30
+VAD_THRESHOLD_DB = -45.0 # frames louder than this (dBFS) are speech
+VAD_ZCR_THRESHOLD = 0.3 # zero crossings per sample above which quieter frames count as fricatives
+VAD_FRICATIVE_MARGIN_DB = 10.0 # how far below VAD_THRESHOLD_DB a fricative may be
+VAD_MIN_SPEECH_MS = 90 # speech must last this long to start an utterance (ignores clicks)
+VAD_HANGOVER_MS = 300 # speech continues this long after the last speech frame
+VAD_PREROLL_MS = 300 # audio kept from before the detected start of speech
+VAD_END_SILENCE_MS = 800 # silence that ends a hands-free utterance
+HANDS_FREE = False # main.run(): VAD starts/ends utterances instead of holding a key
+
+# text-to-speech playback
+TTS_SAMPLE_RATE = 22050 # rate of the audio UnrealSpeech streams
+PLAYBACK_DEVICE_RATE = None # output device rate (None: the device's native rate)
 
 #unrealspeech api
 UNREALSPEECH_URL = "https://api.v6.unrealspeech.com/stream"
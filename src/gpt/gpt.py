@@ -2,8 +2,9 @@ from typing import Generator
 import time
 from gpt4all import GPT4All
 from .model_config import SYSTEM_PROMPT
-from ..config import GPT_PORT, GPT_DEVICE, CHUNK_SIZE
-from ..network import MessageInSequenceOutServer
+from .sessions import SessionManager, GenerationScheduler
+from ..config import GPT_PORT, GPT_DEVICE, CHUNK_SIZE, GPT_INSTANCES, GPT_COALESCE_TOKENS
+from ..network import MessageInSequenceOutServer, TokenCoalescer
 
 class GPT:
     settings = dict(temp = 0.7, 
@@ -32,14 +33,15 @@ class GPT:
                             device=self.device)
         print("finished loading model")
 
-    def start_session(self):
-        self.gen = self.start()
+    def start_session(self, ping=True):
+        self.gen = self.start(ping)
         next(self.gen)
 
-    def start(self):
+    def start(self, ping=True):
         with self.model.chat_session(SYSTEM_PROMPT) as session:
             print("chat session loaded")
-            self.ping_model()
+            if ping:
+                self.ping_model()
             yield
 
     def ping_model(self):
@@ -53,17 +55,93 @@ class GPT:
         yield from self.model.generate(prompt = prompt, **self.settings)
 
     def end_session(self):
-        next(self.gen)
+        next(self.gen, None)
 
 class GPTServer(MessageInSequenceOutServer):
+    """
+    Streams the tokens of each response. Requests are queued for
+    arg::instances model instances, and each conversation keeps its own
+    history (see sessions.py). Clients name their conversation with the
+    'session' option (else the conversation is keyed by their address),
+    and may pass a 'priority' option (lower first) for priority scheduling.
+    With arg::coalesce_tokens, several tokens are sent per frame (see
+    network/coalesce.py).
+    """
     def __init__(self, host='',
                        port=GPT_PORT,
-                       chunk_size=CHUNK_SIZE,):
+                       chunk_size=CHUNK_SIZE,
+                       transport=None,
+                       instances=GPT_INSTANCES,
+                       models=None,
+                       coalesce_tokens=GPT_COALESCE_TOKENS):
 
-        super().__init__(host='', port=GPT_PORT, chunk_size=CHUNK_SIZE)
-        self.gpt = GPT()
+        super().__init__(host='', port=GPT_PORT, chunk_size=CHUNK_SIZE,
+                         transport=transport)
+        self.models = models or [GPT() for _ in range(instances)]
+        self.gpt = self.models[0]
+        if coalesce_tokens:
+            self.coalescer = TokenCoalescer()
+        registry = self.metrics.registry
+        self.sessions = SessionManager()
+        self.scheduler = GenerationScheduler(self.models, registry=registry)
+        self.tokens_total = registry.counter('gpt_tokens_total', 'Tokens generated')
+        self.tokens_per_second = registry.histogram(
+            'gpt_tokens_per_second', 'Generation rate of each response',
+            buckets=(1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200))
+        self.time_to_first_token = registry.histogram(
+            'gpt_time_to_first_token_seconds', 'Time from prompt to first token')
         
+    def _negotiate(self, requested):
+        accepted = {}
+        if 'session' in requested:
+            accepted['session'] = str(requested['session'])
+        if 'priority' in requested:
+            accepted['priority'] = int(requested['priority'])
+        return accepted
+
+    def _handle_client(self, client_socket):
+        try:
+            peer = client_socket.getpeername()
+        except OSError:
+            peer = None
+        # an IP address; not a multiplexed stream's or a local socket's name
+        self._local.peer = peer[0] if isinstance(peer, tuple) else 'local'
+        return super()._handle_client(client_socket)
+
     def _process(self, message: bytes) -> Generator[bytes, None, None]:
-        return (token.encode('utf-8') for token in 
-                self.gpt.get_tokens(message.decode('utf-8')))
+        # Per-connection state is read here, on the handler thread: the
+        # generator may run on another (e.g. a TokenCoalescer's).
+        session = self.sessions.get(self.options.get('session', self._local.peer))
+        priority = self.options.get('priority', 0)
+        return self._count_tokens(token.encode('utf-8') for token in
+                                  self._generate(message.decode('utf-8'), session, priority))
+
+    def _generate(self, prompt: str, session, priority: int) -> Generator[str, None, None]:
+        with session.lock:
+            request = self.scheduler.submit(prompt, session, priority)
+            yield from request.tokens()
+        self.sessions.touch(session)
+        wait, ttft = request.queue_wait, request.time_to_first_token
+        print(f"session {session.id}: queued {wait or 0:.2f} s, first token after "
+              f"{ttft or 0:.2f} s on instance {request.instance} "
+              f"({self.scheduler.depth()} waiting)")
+
+    def _count_tokens(self, tokens: Generator[bytes, None, None]) -> Generator[bytes, None, None]:
+        """
+        Pass tokens through, recording time to first token and tokens/s
+        (as the client sees them: sending is included).
+        """
+        start = time.perf_counter()
+        n = 0
+        try:
+            for token in tokens:
+                if not n:
+                    self.time_to_first_token.observe(time.perf_counter() - start)
+                n += 1
+                yield token
+        finally:
+            elapsed = time.perf_counter() - start
+            self.tokens_total.inc(n)
+            if n and elapsed > 0:
+                self.tokens_per_second.observe(n / elapsed)
 
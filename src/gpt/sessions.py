@@ -0,0 +1,227 @@
+"""
+Conversations and generation scheduling for GPTServer.
+
+Each conversation (keyed by the 'session' option a client opens its
+request with, or else by the client's address) has its own Session: its
+turns so far. Sessions are kept in LRU order, and the least recently
+used are dropped beyond GPT_MAX_SESSIONS, beyond GPT_SESSION_BYTES of
+history in total, or after GPT_SESSION_IDLE seconds unused.
+
+Requests are queued for a GenerationScheduler, whose worker threads each
+own one model instance and generate for one request at a time: in order
+of arrival (fifo), or lowest 'priority' option first (priority), FIFO
+among equals. A model instance keeps the chat context of the session it
+last served, so a conversation that stays on one instance pays nothing
+extra. When a session moves to an instance holding another context, or
+one that has missed turns of it (served elsewhere since), or was never
+served yet, the instance starts a fresh chat session, and the session's
+recent turns (up to GPT_RECAP_CHARS) are replayed as context at the
+start of the prompt.
+
+Requests of the same session never run at the same time: the second
+waits for the first to finish before it is queued.
+
+Main public API usage:
+    scheduler = GenerationScheduler([GPT(), GPT()], policy='priority')
+    session = sessions.get('kiosk-3')
+    request = scheduler.submit(prompt, session, priority=0)
+    for token in request.tokens():  # str
+        ...
+    request.queue_wait, request.time_to_first_token
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+import collections
+import itertools
+import queue
+import threading
+import time
+from ..config import (GPT_SCHEDULING, GPT_MAX_SESSIONS, GPT_SESSION_BYTES, GPT_SESSION_IDLE,
+                      GPT_RECAP_CHARS)
+
+class Session:
+    def __init__(self, session_id):
+        self.id = session_id
+        self.turns = [] # (prompt, response)
+        self.n_bytes = 0
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock() # one request at a time
+
+    def add_turn(self, prompt: str, response: str) -> None:
+        self.turns.append((prompt, response))
+        self.n_bytes += len(prompt) + len(response)
+
+    def recap(self, max_chars=GPT_RECAP_CHARS) -> str:
+        """
+        The latest turns, as context for a model that has not seen them.
+        """
+        lines, n = [], 0
+        for prompt, response in reversed(self.turns):
+            turn = f"User: {prompt}\nYou: {response}\n"
+            if n + len(turn) > max_chars:
+                break
+            lines.append(turn)
+            n += len(turn)
+        if not lines:
+            return ''
+        return "Earlier in this conversation:\n" + ''.join(reversed(lines)) + "\nNow:\n"
+
+
+class SessionManager:
+    def __init__(self, max_sessions=GPT_MAX_SESSIONS,
+                       max_bytes=GPT_SESSION_BYTES,
+                       idle_timeout=GPT_SESSION_IDLE):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+        self.sessions: Dict[str, Session] = collections.OrderedDict() # LRU first
+        self.lock = threading.Lock()
+        self.evicted = 0
+
+    def get(self, session_id) -> Session:
+        """
+        The session for arg::session_id, created if new (or evicted).
+        """
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self.sessions[session_id] = Session(session_id)
+            else:
+                self.sessions.move_to_end(session_id)
+            session.last_used = time.monotonic()
+            self._evict(keep=session)
+            return session
+
+    def end(self, session_id) -> None:
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def touch(self, session: Session) -> None:
+        """
+        Re-check the budget after arg::session grew.
+        """
+        with self.lock:
+            session.last_used = time.monotonic()
+            self._evict(keep=session)
+
+    def stats(self):
+        with self.lock:
+            return dict(sessions=len(self.sessions), evicted=self.evicted,
+                        bytes=sum(s.n_bytes for s in self.sessions.values()))
+
+    def _evict(self, keep: Session) -> None:
+        n_bytes = sum(s.n_bytes for s in self.sessions.values())
+        cutoff = time.monotonic() - self.idle_timeout
+        for session in list(self.sessions.values()):
+            if session is keep or session.lock.locked(): # in use: evicted once idle
+                continue
+            if (len(self.sessions) <= self.max_sessions and n_bytes <= self.max_bytes
+                    and session.last_used >= cutoff):
+                break
+            del self.sessions[session.id]
+            n_bytes -= session.n_bytes
+            self.evicted += 1
+
+
+class GenerationRequest:
+    _done = object()
+
+    def __init__(self, prompt: str, session: Session, priority: int = 0):
+        self.prompt = prompt
+        self.session = session
+        self.priority = priority
+        self.q = queue.Queue() # tokens, then _done or an exception
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.first_token = None
+        self.instance = None
+        self.cancelled = False
+
+    @property
+    def queue_wait(self) -> Optional[float]:
+        return None if self.started is None else self.started - self.submitted
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        return None if self.first_token is None else self.first_token - self.submitted
+
+    def tokens(self) -> Iterator[str]:
+        """
+        Generated tokens, as the model produces them. Closing this
+        generator early cancels the rest of the generation.
+        """
+        try:
+            while (token := self.q.get()) is not self._done:
+                if isinstance(token, Exception):
+                    raise token
+                yield token
+        finally:
+            self.cancelled = True
+
+
+class GenerationScheduler:
+    """
+    One worker thread per model in arg::models. Each model needs
+    get_tokens(prompt), start_session(ping) and end_session(), as GPT
+    has. arg::policy is 'fifo' or 'priority'. If a registry (see
+    network/metrics.py) is given, queue waits are recorded in it.
+    """
+    def __init__(self, models: List, policy: str = GPT_SCHEDULING, registry=None):
+        if policy not in ('fifo', 'priority'):
+            raise ValueError(f"Unknown scheduling policy {policy!r}: use 'fifo' or 'priority'")
+        self.models = models
+        self.policy = policy
+        self.q = queue.PriorityQueue()
+        self.seq = itertools.count()
+        # (session, turns it has seen) each model's chat context holds
+        self.contexts: List[Optional[Tuple[Session, int]]] = [None] * len(models)
+        self.queue_wait = None
+        if registry is not None:
+            self.queue_wait = registry.histogram('gpt_queue_wait_seconds',
+                                                 'Time from prompt to a model starting on it')
+        for i, model in enumerate(models):
+            threading.Thread(target=self._work, args=(i, model), name=f'[gpt instance {i}]',
+                             daemon=True).start()
+
+    def submit(self, prompt: str, session: Session, priority: int = 0) -> GenerationRequest:
+        request = GenerationRequest(prompt, session, priority)
+        rank = priority if self.policy == 'priority' else 0
+        self.q.put((rank, next(self.seq), request))
+        return request
+
+    def depth(self) -> int:
+        return self.q.qsize()
+
+    def _work(self, i, model):
+        while True:
+            _, _, request = self.q.get()
+            if request.cancelled: # the client went away while queued
+                continue
+            request.started = time.perf_counter()
+            request.instance = i
+            if self.queue_wait is not None:
+                self.queue_wait.observe(request.queue_wait)
+            try:
+                self._generate(i, model, request)
+            except Exception as e:
+                self.contexts[i] = None # unknown state: start afresh next time
+                request.q.put(e)
+            request.q.put(GenerationRequest._done)
+
+    def _generate(self, i, model, request):
+        session = request.session
+        prompt = request.prompt
+        if self.contexts[i] != (session, len(session.turns)):
+            self.contexts[i] = None
+            model.end_session()
+            model.start_session(ping=False)
+            prompt = session.recap() + prompt
+        response = []
+        for token in model.get_tokens(prompt):
+            if request.first_token is None:
+                request.first_token = time.perf_counter()
+            response.append(token)
+            request.q.put(token)
+            if request.cancelled:
+                break
+        session.add_turn(request.prompt, ''.join(response))
+        self.contexts[i] = (session, len(session.turns))
@@ -1,23 +1,46 @@
-from .config import WHISPER_HOST, GPT_HOST, GPT_PORT
-from .network import Client
-from .audio_streaming import KeyedStreamingAudioRecorder
+import uuid
+from .config import WHISPER_HOST, GPT_HOST, GPT_PORT, HANDS_FREE, MUX_ENABLED
+from .network import Client, ClientPool
+from .audio_streaming import KeyedStreamingAudioRecorder, VADStreamingAudioRecorder
+from .audio_sender import SenderError
 from .utils import SentenceParser
 from .tts import SentencePlayer
 
-def run():
-    recorder = KeyedStreamingAudioRecorder(key='r', server_ip=WHISPER_HOST)
+def run(hands_free=HANDS_FREE, multiplex=MUX_ENABLED):
+    # With multiplex, keep one multiplexed connection per server open
+    # across turns; otherwise connect for each request.
+    pool = ClientPool() if multiplex else None
+    conversation_id = uuid.uuid4().hex # the GPT server keeps our history under it
+    if hands_free:
+        recorder = VADStreamingAudioRecorder(server_ip=WHISPER_HOST, pool=pool)
+    else:
+        recorder = KeyedStreamingAudioRecorder(key='r', server_ip=WHISPER_HOST, pool=pool)
     parser = SentenceParser()
     player = SentencePlayer()
 
-    recorder.standby(one_shot=False)
+    if hands_free:
+        recorder.standby()
+    else:
+        recorder.standby(one_shot=False)
 
     # Main prompt -> response loop, driven by user speech input.
     while True:
         # (1) Convert microphone-captured speech to text.
-        prompt = recorder.wait_for_input() 
+        try:
+            prompt = recorder.wait_for_input() 
+        except SenderError as e:
+            print(f"Could not stream the recording ({e}), try again.")
+            continue
+        except OSError as e: # ServerBusyError, connection reset, ...
+            print(f"Could not get a transcription ({e!r}), try again.")
+            continue
+        if not prompt.strip():
+            print("(no speech heard)")
+            continue
 
         # (2) Send prompt to GPT server, await response.
-        client = Client(GPT_HOST, GPT_PORT)
+        client = pool.stream(GPT_HOST, GPT_PORT) if pool is not None else Client(GPT_HOST, GPT_PORT)
+        client.negotiate(session=conversation_id)
         client.send(prompt) 
 
         # (3) Receive response tokens as GPT server produces them.
@@ -28,8 +51,13 @@ def run():
 
         # (5) Convert sentences to audio, and play each back in sequence.
         #       Blocks until all sentences finish playing
+        if hands_free:
+            recorder.pause() # don't transcribe our own reply
         player.play(sentence_seq) 
+        if hands_free:
+            recorder.resume()
+        client.close()
 
         # (6) Print number of tokens used in the response.
-        print(f"\n\n(token count: {parser.n_tokens})")
+        print(f"\n\n(frames received: {parser.n_frames})")
 
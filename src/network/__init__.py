@@ -1,3 +1,12 @@
 from .client import Client
-from .server import Server, MessageInSequenceOutServer, SequenceInMessageOutServer
-from .structures import Transmit
+from .server import (Server, MessageInSequenceOutServer, SequenceInMessageOutServer,
+                     SequenceInSequenceOutServer)
+from .structures import Transmit, ServerBusyError
+from .coalesce import TokenCoalescer
+from .mux import MuxConnection, ClientPool, MuxUnsupportedError
+from .transport import TcpTransport, UnixTransport, ShmTransport
+from .metrics import MetricsRegistry, MetricsExporter
+from .async_server import (AsyncTransmit, AsyncServer,
+                           AsyncMessageInSequenceOutServer,
+                           AsyncSequenceInMessageOutServer,
+                           AsyncSequenceInSequenceOutServer)
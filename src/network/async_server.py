@@ -0,0 +1,409 @@
+"""
+asyncio implementations of the Server family. These mirror the threaded
+servers in server.py, but handle every connection as a task on one event
+loop instead of one OS thread per connection.
+
+The wire format is identical (see Transmit), so AsyncServer variants work
+with the existing Client, and Client code cannot tell the two apart.
+
+Blocking _process implementations (Whisper, GPT4All, ...) are run on a
+configurable executor, so they never stall the event loop. A _process
+defined with `async def` (or returning an async iterator, for sequence
+output) is awaited on the loop directly instead.
+
+Of the control codes (see Transmit), options and metrics_request are
+answered as by the threaded servers. The rest are not: there is no
+admission limit (connections wait for the executor instead), so no busy
+frame is ever sent, and multiplexed connections (mux_hello) are refused.
+"""
+from typing import AsyncIterator, Dict, Iterable, Iterator, Optional, Union
+from concurrent.futures import Executor, ThreadPoolExecutor
+import asyncio
+import contextvars
+import inspect
+import json
+import threading
+import time
+from ..utils import teardown
+from ..config import PORT, CHUNK_SIZE
+from .structures import Transmit
+from .metrics import MetricsRegistry, ServerMetrics, MetricsExporter
+
+class AsyncTransmit:
+    """
+    asyncio counterpart of Transmit, for StreamReader / StreamWriter pairs.
+
+    Main public API usage:
+        await AsyncTransmit.send_over_stream(writer, payload)
+        payload = await AsyncTransmit.read_from_stream(reader)
+        await AsyncTransmit.end_transmission(writer)
+    When read_from_stream returns None, transmission is complete.
+    """
+    @classmethod
+    async def read_from_stream(cls, reader: asyncio.StreamReader) -> Optional[bytes]:
+        size = await cls.read_size(reader)
+        if size is None:
+            return None
+        return await reader.readexactly(size)
+
+    @classmethod
+    async def read_size(cls, reader: asyncio.StreamReader) -> Optional[int]:
+        """
+        Read the next size prefix. Returns None at end of transmission.
+        """
+        prefix = await reader.readexactly(Transmit.n_prefix_bytes)
+        size = Transmit._unpack_size(prefix)
+        if size == Transmit.end_of_transmission:
+            return None
+        return size
+
+    @classmethod
+    async def send_over_stream(cls, writer: asyncio.StreamWriter, payload: bytes):
+        writer.writelines([Transmit._pack_size(len(payload)), payload])
+        await writer.drain()
+
+    @classmethod
+    async def end_transmission(cls, writer: asyncio.StreamWriter):
+        writer.write(Transmit._pack_size(Transmit.end_of_transmission))
+        await writer.drain()
+
+    @classmethod
+    async def send_options(cls, writer: asyncio.StreamWriter, options: Dict):
+        payload = Transmit._encode_options(options)
+        writer.writelines([Transmit._pack_size(Transmit.options),
+                           Transmit._pack_size(len(payload)), payload])
+        await writer.drain()
+
+
+class AsyncServer:
+    """
+    Message In Message Out server, on asyncio. (See Server)
+
+    serve() runs the event loop in a new thread, like Server.serve(), so
+    the two are drop-in replacements for each other.
+    Pass executor to control where blocking _process calls run; by default
+    a ThreadPoolExecutor with max_workers threads is created.
+
+    self.metrics records connections, requests, errors, bytes received and
+    time spent in _receive / _process / _send (see metrics.py); publish
+    them with export_metrics().
+    """
+    def __init__(self, host='', # Empty string to listen on all network interfaces.
+                       port=PORT,
+                       chunk_size=CHUNK_SIZE,
+                       executor: Optional[Executor] = None,
+                       max_workers: Optional[int] = None,
+                       backlog: int = 100):
+
+        teardown.register(self.teardown)
+        self.host = host
+        self.port = port
+        self.name = self.__class__.__name__
+        self.chunk_size = chunk_size
+        self.backlog = backlog
+        self.executor = executor or ThreadPoolExecutor(max_workers,
+                                                       thread_name_prefix=self.name)
+        self._running = threading.Event()
+        self._loop = None
+        self._stopping = None
+        self.metrics = ServerMetrics(MetricsRegistry(const_labels=dict(server=self.name)))
+        self._exporters = []
+        self._options = contextvars.ContextVar(f'{self.name} options', default={})
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    @property
+    def options(self):
+        """
+        Options accepted for the request being handled (see Server.options).
+        Also set in blocking _process calls run on the executor.
+        """
+        return self._options.get()
+
+    def serve(self):
+        """
+        Start serving in a new thread. Returns once the socket is listening.
+        """
+        started = threading.Event()
+        threading.Thread(target=lambda: asyncio.run(self.serve_forever(started)),
+                         name=self.name).start()
+        started.wait()
+
+    async def serve_forever(self, started: Optional[threading.Event] = None):
+        """
+        Serve on the running event loop until shutdown() is called.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        try:
+            server = await asyncio.start_server(self._handle_client,
+                                                self.host, self.port,
+                                                reuse_address=True,
+                                                backlog=self.backlog)
+        finally:
+            if started is not None:
+                started.set()
+
+        print(f"\nServer is listening on {self.host}:{self.port}")
+        self._running.set()
+        async with server:
+            await self._stopping.wait()
+        print('Server has been shut down.')
+
+    def teardown(self):
+        if self.running:
+            print('Dirty exit: fallback teardown started...')
+            self.shutdown()
+
+    def export_metrics(self, path=None, http_port=None, host=''):
+        """
+        See Server.export_metrics.
+        """
+        exporter = MetricsExporter(self.metrics.registry, path=path,
+                                   http_port=http_port, host=host).start()
+        self._exporters.append(exporter)
+        return exporter
+
+    def shutdown(self):
+        self._running.clear()
+        for exporter in self._exporters:
+            exporter.stop()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    async def _handle_client(self, reader: asyncio.StreamReader,
+                                   writer: asyncio.StreamWriter):
+        client_address = writer.get_extra_info('peername')
+        print(f"Connection established with {client_address}")
+        metrics = self.metrics
+        metrics.connections_accepted.inc()
+        metrics.connections_active.inc()
+        try:
+            size = await AsyncTransmit.read_size(reader)
+            if size == Transmit.metrics_request:
+                return await self._send_metrics(writer)
+            if size == Transmit.mux_hello:
+                raise ConnectionError("Multiplexed connections are not supported")
+            if size == Transmit.options:
+                requested = Transmit._decode_options(await AsyncTransmit.read_from_stream(reader))
+                options = self._negotiate(requested)
+                await AsyncTransmit.send_options(writer, options)
+                self._options.set(options)
+                size = await AsyncTransmit.read_size(reader)
+            await self._handle_request(reader, writer, size)
+
+        except Exception as e:
+            print(f"Error handling client: {e}")
+            metrics.errors.inc(label_value=type(e).__name__)
+
+        finally:
+            metrics.requests.inc()
+            metrics.connections_active.dec()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _handle_request(self, reader: asyncio.StreamReader,
+                                    writer: asyncio.StreamWriter, size: Optional[int]):
+        """
+        arg::size: the request's first size prefix, already read (None
+        if it was end of transmission).
+        """
+        metrics = self.metrics
+        start = time.perf_counter()
+        message = await self._receive(reader, size)
+        metrics.receive_seconds.observe(time.perf_counter() - start)
+        if message:
+            print(f"Received message of length: {len(message)} bytes")
+            metrics.bytes_in.inc(len(message))
+            start = time.perf_counter()
+            response = await self._run_process(message)
+            metrics.process_seconds.observe(time.perf_counter() - start)
+            start = time.perf_counter()
+            await self._send(writer, response)
+            metrics.send_seconds.observe(time.perf_counter() - start)
+        else:
+            print('Message was nullish value')
+
+    async def _send_metrics(self, writer: asyncio.StreamWriter):
+        """
+        Answer a Transmit.metrics_request with a JSON snapshot.
+        """
+        snapshot = self.metrics.registry.snapshot()
+        await AsyncTransmit.send_over_stream(writer, json.dumps(snapshot).encode('utf-8'))
+
+    def _negotiate(self, requested):
+        """
+        See Server._negotiate.
+        """
+        return {}
+
+    def _is_async_process(self) -> bool:
+        return (asyncio.iscoroutinefunction(self._process)
+                or inspect.isasyncgenfunction(self._process))
+
+    async def _run_process(self, message):
+        if asyncio.iscoroutinefunction(self._process):
+            return await self._process(message)
+        if inspect.isasyncgenfunction(self._process):
+            return self._process(message)
+        loop = asyncio.get_running_loop()
+        # copy_context: self.options is visible on the executor thread too
+        return await loop.run_in_executor(self.executor, contextvars.copy_context().run,
+                                          self._process, message)
+
+    def _process(self, message):
+        return message
+
+    async def _receive(self, reader: asyncio.StreamReader, size: Optional[int]):
+        if size is None:
+            return None
+        return await reader.readexactly(size)
+
+    async def _send(self, writer: asyncio.StreamWriter, response):
+        await AsyncTransmit.send_over_stream(writer, response)
+
+
+class AsyncMessageInSequenceOutServer(AsyncServer):
+    """
+    Async counterpart of MessageInSequenceOutServer.
+
+    _process may return an async iterator, or a plain (blocking) iterator,
+    which is then advanced on the executor and handed back to the loop
+    through a small bounded queue.
+    """
+    max_pending = 64 # items buffered between executor and loop
+
+    def _process(self, message: bytes) -> Union[Iterable[bytes], AsyncIterator[bytes]]:
+        raise NotImplementedError()
+
+    async def _send(self, writer: asyncio.StreamWriter, sequence) -> None:
+        async for message in self._iterate(sequence):
+            await AsyncTransmit.send_over_stream(writer, message)
+        await AsyncTransmit.end_transmission(writer)
+
+    async def _iterate(self, sequence) -> AsyncIterator[bytes]:
+        if hasattr(sequence, '__aiter__'):
+            async for item in sequence:
+                yield item
+            return
+
+        loop = asyncio.get_running_loop()
+        q = asyncio.Queue(self.max_pending)
+        cancelled = threading.Event()
+        done = object()
+
+        def pump():
+            try:
+                for item in sequence:
+                    if cancelled.is_set():
+                        break
+                    # blocks this executor thread while the queue is full
+                    asyncio.run_coroutine_threadsafe(q.put(item), loop).result()
+            except BaseException as e:
+                asyncio.run_coroutine_threadsafe(q.put(e), loop).result()
+            finally:
+                asyncio.run_coroutine_threadsafe(q.put(done), loop).result()
+
+        loop.run_in_executor(self.executor, contextvars.copy_context().run, pump)
+        try:
+            while (item := await q.get()) is not done:
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # If we stopped early (e.g. client went away), make room so a
+            # pump blocked on a full queue can see it was cancelled and exit.
+            cancelled.set()
+            while not q.empty():
+                q.get_nowait()
+
+
+class AsyncSequenceInMessageOutServer(AsyncServer):
+    """
+    Async counterpart of SequenceInMessageOutServer.
+    """
+    async def _receive(self, reader: asyncio.StreamReader, size: Optional[int]):
+        """
+        Receive stream chunks in a loop until end of transmission signal.
+        """
+        message = bytearray()
+        while size is not None:
+            message += await reader.readexactly(size)
+            size = await AsyncTransmit.read_size(reader)
+        return message
+
+
+class AsyncSequenceInSequenceOutServer(AsyncMessageInSequenceOutServer):
+    """
+    Async counterpart of SequenceInSequenceOutServer.
+
+    _process receives the incoming frames and returns the outgoing ones:
+    async iterators for an `async def` _process, else plain iterators,
+    advanced on the executor. Incoming frames are read by their own task
+    into a queue of at most max_pending frames, so reading and writing
+    run concurrently.
+    """
+    max_pending = 64 # incoming frames buffered ahead of _process
+    _done = object()
+
+    def _process(self, sequence: Iterator[bytes]) -> Iterator[bytes]:
+        raise NotImplementedError()
+
+    async def _handle_request(self, reader: asyncio.StreamReader,
+                                    writer: asyncio.StreamWriter, size: Optional[int]):
+        """
+        Receiving overlaps processing here, so no receive time is recorded.
+        """
+        q = asyncio.Queue(self.max_pending)
+        receiving = asyncio.create_task(self._read_frames(reader, size, q))
+        try:
+            if self._is_async_process():
+                frames = self._async_frames(q)
+            else:
+                frames = self._blocking_frames(q, asyncio.get_running_loop())
+            start = time.perf_counter()
+            sequence = await self._run_process(frames)
+            self.metrics.process_seconds.observe(time.perf_counter() - start)
+            start = time.perf_counter()
+            await self._send(writer, sequence)
+            self.metrics.send_seconds.observe(time.perf_counter() - start)
+        finally:
+            # _process may stop before the client does: drop the rest, and
+            # wake a blocking _process still waiting for a frame.
+            receiving.cancel()
+            while not q.empty():
+                q.get_nowait()
+            q.put_nowait(self._done)
+
+    async def _read_frames(self, reader, size, q):
+        try:
+            while size is not None:
+                frame = await reader.readexactly(size)
+                self.metrics.bytes_in.inc(len(frame))
+                self.metrics.frames_in.inc()
+                await q.put(frame)
+                size = await AsyncTransmit.read_size(reader)
+            item = self._done
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            item = e
+        await q.put(item)
+
+    async def _async_frames(self, q) -> AsyncIterator[bytes]:
+        while (item := await q.get()) is not self._done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def _blocking_frames(self, q, loop) -> Iterator[bytes]:
+        """
+        Runs on the executor.
+        """
+        while (item := asyncio.run_coroutine_threadsafe(q.get(), loop).result()) is not self._done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
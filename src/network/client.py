@@ -1,40 +1,149 @@
-from typing import Iterable
+from typing import Dict, Iterable
+import json
 import socket
+import threading
 from ..config import HOST, PORT, CHUNK_SIZE
-from .structures import Transmit
+from .structures import Transmit, FrameReader, FrameWriter, ServerBusyError
+from .transport import TcpTransport
 
 class Client:
+    """
+    If the server is saturated it turns the request away with a busy
+    frame: receive(), receive_stream(), send() and end_transmission()
+    then raise ServerBusyError, so the caller can retry (elsewhere).
+    """
     def __init__(self, host: str=HOST,
                        port: int=PORT,
-                       chunk_size: int=CHUNK_SIZE):
-
+                       chunk_size: int=CHUNK_SIZE,
+                       coalesce_bytes: int=0,
+                       transport=None):
+        """
+        With coalesce_bytes > 0, small consecutive sends are batched into
+        one write (see FrameWriter); end_transmission() flushes them.
+        arg::transport overrides host and port, e.g. UnixTransport(path)
+        for a server on the same machine (see transport.py).
+        """
         self.host = host
         self.port = port
+        self.transport = transport or TcpTransport(host, port)
         self.chunk_size = chunk_size
+        self.coalesce_bytes = coalesce_bytes
         self._connect()
 
     def _connect(self) -> None:
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.connect((self.host, self.port))
+        self.sock = self.transport.connect()
+        self.reader = FrameReader(self.sock, self.chunk_size)
+        self.writer = FrameWriter(self.sock, self.coalesce_bytes)
 
     def send(self, data: bytes) -> None:
         try:
-            Transmit.send_over_socket(self.sock, data)
-        except Exception as e:
-            print(f"Client encountered error sending data: {e}")
+            self._send_frame(data)
+        except OSError:
+            self._raise_if_busy()
+            raise
+
+    def _send_frame(self, data: bytes) -> None:
+        self.writer.send(data)
 
     def receive(self) -> bytes:
-        return Transmit.read_from_socket(self.sock)
+        return self.reader.read()
 
-    def receive_stream(self) -> Iterable[bytes]:
+    def receive_stream(self, copy: bool = True) -> Iterable[bytes]:
+        """
+        Yield payloads until end of transmission. With copy=False, each
+        payload is a memoryview into the reader's arena, which is only
+        valid until the next item is requested. A server coalescing its
+        tokens (see coalesce.py) sends several per payload: join payloads,
+        rather than count them as tokens.
+        """
         while True:
-            data = self.receive()
+            data = self.reader.read_view()
             if data is None:
                 break
-            yield data
+            yield bytes(data) if copy else data
+
+    def negotiate(self, **options) -> Dict:
+        """
+        Open a request with options (e.g. codecs=['mulaw', 'pcm16']), and
+        return the options the server accepted. Servers ignore options
+        they do not understand, so the reply may be a subset.
+        """
+        Transmit.send_options(self.sock, options)
+        return Transmit.read_options(self.sock)
+
+    def metrics(self) -> Dict:
+        """
+        Ask the server for a JSON snapshot of its metrics (see metrics.py),
+        instead of making a request. Ends the exchange, like a request.
+        """
+        Transmit._send_buffers(self.sock, [Transmit._pack_size(Transmit.metrics_request)])
+        return json.loads(bytes(self.receive()))
+
+    def duplex(self, frames: Iterable[bytes], copy: bool = True) -> Iterable[bytes]:
+        """
+        Full-duplex session, for a SequenceInSequenceOutServer: see duplex().
+        """
+        return duplex(self, frames, copy)
 
     def end_transmission(self) -> None:
-        Transmit.end_transmission(self.sock)
+        try:
+            self.writer.end_transmission()
+        except OSError:
+            self._raise_if_busy()
+            raise
+
+    def _raise_if_busy(self) -> None:
+        """
+        Call after a failed write. The server may have rejected us and hung
+        up before we finished sending: if its busy frame is waiting to be
+        read, raise ServerBusyError instead of a generic socket error.
+        """
+        timeout = self.sock.gettimeout()
+        try:
+            self.sock.settimeout(0)
+            prefix = self.sock.recv(Transmit.n_prefix_bytes, socket.MSG_PEEK)
+        except OSError:
+            return
+        finally:
+            if self.sock.fileno() != -1:
+                self.sock.settimeout(timeout)
+
+        if (len(prefix) == Transmit.n_prefix_bytes
+                and Transmit._unpack_size(prefix) == Transmit.server_busy):
+            raise ServerBusyError("Server is busy and rejected the request")
 
     def close(self) -> None:
-        self.sock.close()
\ No newline at end of file
+        try:
+            self.writer.close()
+        finally:
+            self.sock.close()
+
+
+def duplex(client, frames: Iterable[bytes], copy: bool = True) -> Iterable[bytes]:
+    """
+    Send arg::frames (followed by end of transmission) from a background
+    thread, while yielding the server's frames as they arrive, until the
+    server's end of transmission. arg::frames may block between items
+    (e.g. a queue fed by a microphone). If sending failed, the error is
+    raised once the server's response has ended.
+    Works with Client and with a pooled MuxStream.
+    """
+    error = []
+
+    def send_all():
+        try:
+            for frame in frames:
+                client._send_frame(frame)
+            client.end_transmission()
+        except Exception as e:
+            error.append(e)
+
+    sender = threading.Thread(target=send_all, name='[duplex sender]', daemon=True)
+    sender.start()
+
+    yield from client.receive_stream(copy)
+
+    # The server may end the session before all our frames are sent;
+    # only report failures of a sender that has already finished.
+    if not sender.is_alive() and error:
+        raise error[0]
@@ -0,0 +1,127 @@
+"""
+Token coalescing for MessageInSequenceOutServer: merges the small frames
+of a streamed response (e.g. one per GPT token) into fewer, larger ones,
+so a 400-token reply takes tens of send and recv calls instead of
+hundreds.
+
+The first token is always sent on its own, at once, so time to first
+token is unchanged. After that, tokens are held and sent together when:
+    max_bytes are pending,
+    the oldest pending token has waited max_delay_ms,
+    or (boundary='sentence') a token ends a sentence.
+With boundary='word' or 'sentence', a frame sent because of max_bytes or
+max_delay_ms stops at the last word boundary pending, so frames do not
+end mid-word (unless a single word exceeds max_bytes).
+
+Receivers see frames holding several tokens' text: consumers must
+concatenate payloads rather than treat each as one token (see
+SentenceParser).
+
+Main public API usage:
+    coalescer = TokenCoalescer(max_bytes=512, max_delay_ms=50, boundary='sentence')
+    for frame in coalescer.frames(tokens):   # tokens: iterable of bytes
+        writer.send(frame)
+"""
+from typing import Iterable, Iterator, List, Optional
+import queue
+import re
+import threading
+import time
+from ..config import TOKEN_COALESCE_BYTES, TOKEN_COALESCE_DELAY_MS, TOKEN_COALESCE_BOUNDARY
+
+_sentence_end = re.compile(rb'[.?!]["\')\]]*\s*$|\n\s*$')
+
+class TokenCoalescer:
+    BOUNDARIES = (None, 'word', 'sentence')
+    _end = object()
+
+    def __init__(self, max_bytes: int = TOKEN_COALESCE_BYTES,
+                       max_delay_ms: float = TOKEN_COALESCE_DELAY_MS,
+                       boundary: Optional[str] = TOKEN_COALESCE_BOUNDARY):
+        if boundary not in self.BOUNDARIES:
+            raise ValueError(f"Unknown boundary {boundary!r}: use one of {self.BOUNDARIES}")
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay_ms / 1000
+        self.boundary = boundary
+
+    def frames(self, tokens: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Coalesced payloads of arg::tokens, as they become due. The tokens
+        are pulled on a helper thread, so a held frame goes out on time
+        even while the next token is slow to come. Closing this generator
+        closes arg::tokens.
+        """
+        q = queue.Queue()
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(tokens, q, stop),
+                                    name=f'{threading.current_thread().name} [tokens]',
+                                    daemon=True)
+        producer.start()
+        try:
+            item = q.get()
+            if item is self._end:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item # the first token, alone and at once
+
+            pending: List[bytes] = []
+            n_pending = 0
+            deadline = None
+            while True:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                try:
+                    item = q.get(timeout=timeout)
+                except queue.Empty: # max_delay_ms is up
+                    frame, pending = self._split(pending)
+                    n_pending = sum(len(t) for t in pending)
+                    deadline = time.monotonic() + self.max_delay if pending else None
+                    yield frame
+                    continue
+                if item is self._end:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                pending.append(item)
+                n_pending += len(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.max_delay
+                if self.boundary == 'sentence' and _sentence_end.search(item):
+                    frame, pending = b''.join(pending), []
+                elif n_pending >= self.max_bytes:
+                    frame, pending = self._split(pending)
+                else:
+                    continue
+                n_pending = sum(len(t) for t in pending)
+                deadline = time.monotonic() + self.max_delay if pending else None
+                yield frame
+            if pending:
+                yield b''.join(pending)
+        finally:
+            stop.set()
+
+    def _split(self, pending: List[bytes]):
+        """
+        (frame, tokens still held): with a boundary, the frame ends before
+        the last token that starts a word, which stays pending. Without
+        one, or if no split is possible, everything goes.
+        """
+        if self.boundary is not None:
+            for i in range(len(pending) - 1, 0, -1):
+                if pending[i][:1].isspace():
+                    return b''.join(pending[:i]), pending[i:]
+        return b''.join(pending), []
+
+    def _produce(self, tokens, q, stop):
+        try:
+            for token in tokens:
+                q.put(bytes(token))
+                if stop.is_set(): # the consumer went away
+                    break
+        except BaseException as e:
+            q.put(e)
+        finally:
+            close = getattr(tokens, 'close', None)
+            if close is not None:
+                close()
+            q.put(self._end)
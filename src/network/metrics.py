@@ -0,0 +1,371 @@
+"""
+Metrics for servers: counters, gauges and histograms in a registry that
+can be read as a JSON snapshot (see Client.metrics, which uses the
+reserved Transmit.metrics_request control code), or in the Prometheus
+text format (see MetricsExporter, for a local file or an HTTP endpoint).
+
+Recording is cheap enough for hot paths: an add under an uncontended
+lock, plus a bisect for histograms. Per-frame byte counts are kept in a
+plain per-request FrameStats (see structures.py), and folded into the
+registry once per request.
+
+Usage:
+    registry = MetricsRegistry(const_labels=dict(server='GPTServer'))
+    tokens = registry.counter('gpt_tokens_total', 'Tokens generated')
+    tokens.inc(n)
+    registry.snapshot()         # JSON-able dict
+    registry.to_prometheus()    # text exposition format
+"""
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, Optional, Tuple
+import math
+import os
+import threading
+import time
+from ..config import METRICS_EXPORT_INTERVAL
+
+# seconds: from a loopback round trip up to a long transcription
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Counter:
+    """
+    Monotonic count, optionally split by the value of one label
+    (e.g. errors_total by exception type).
+    """
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, label: Optional[str] = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values: Dict[Optional[str], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1, label_value: Optional[str] = None) -> None:
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + n
+
+    def value(self, label_value: Optional[str] = None) -> float:
+        with self._lock:
+            return self._values.get(label_value, 0)
+
+    def snapshot(self):
+        with self._lock:
+            if self.label is None:
+                return self._values.get(None, 0)
+            return dict(self._values)
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = dict(self._values)
+        if self.label is None:
+            yield self.name, {}, values.get(None, 0)
+            return
+        for label_value, value in sorted(values.items()):
+            yield self.name, {self.label: label_value}, value
+
+
+class Gauge(Counter):
+    """
+    Value that goes up and down (e.g. active connections).
+    """
+    kind = 'gauge'
+
+    def dec(self, n: float = 1, label_value: Optional[str] = None) -> None:
+        self.inc(-n, label_value)
+
+    def set(self, value: float, label_value: Optional[str] = None) -> None:
+        with self._lock:
+            self._values[label_value] = value
+
+
+class Histogram:
+    """
+    Distribution of observations over fixed buckets (upper bounds).
+    Quantiles in snapshots are estimated from the buckets.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1) # last: above every bucket
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        ix = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[ix] += 1
+            self._sum += value
+            self._count += 1
+
+    def _state(self):
+        with self._lock:
+            return list(self._counts), self._sum, self._count
+
+    def quantile(self, q: float, counts=None, count=None) -> Optional[float]:
+        """
+        Estimate the arg::q quantile (0..1) by interpolating linearly
+        inside the bucket it falls in, as Prometheus' histogram_quantile.
+        """
+        if counts is None:
+            counts, _, count = self._state()
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        for ix, n in enumerate(counts):
+            if cumulative + n >= rank and n:
+                if ix == len(self.buckets):
+                    return self.buckets[-1] # above the top bucket
+                lower = self.buckets[ix - 1] if ix else 0.0
+                upper = self.buckets[ix]
+                return lower + (upper - lower) * (rank - cumulative) / n
+            cumulative += n
+        return self.buckets[-1]
+
+    def snapshot(self) -> Dict:
+        counts, total, count = self._state()
+        return dict(count=count,
+                    sum=total,
+                    p50=self.quantile(0.50, counts, count),
+                    p95=self.quantile(0.95, counts, count),
+                    p99=self.quantile(0.99, counts, count))
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        counts, total, count = self._state()
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            yield f'{self.name}_bucket', {'le': _format_value(bound)}, cumulative
+        yield f'{self.name}_bucket', {'le': '+Inf'}, count
+        yield f'{self.name}_sum', {}, total
+        yield f'{self.name}_count', {}, count
+
+
+class MetricsRegistry:
+    """
+    Named metrics, created on first use (asking again for a name returns
+    the same metric). const_labels are added to every exported sample.
+    """
+    def __init__(self, prefix: str = 'audio_stream',
+                       const_labels: Optional[Dict[str, str]] = None):
+        self.prefix = prefix
+        self.const_labels = const_labels or {}
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, label: Optional[str] = None) -> Counter:
+        return self._get(Counter, name, help, label=label)
+
+    def gauge(self, name: str, help: str, label: Optional[str] = None) -> Gauge:
+        return self._get(Gauge, name, help, label=label)
+
+    def histogram(self, name: str, help: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def _get(self, cls, name: str, help: str, **kwargs):
+        full_name = f'{self.prefix}_{name}' if self.prefix else name
+        with self._lock:
+            metric = self._metrics.get(full_name)
+            if metric is None:
+                metric = self._metrics[full_name] = cls(full_name, help, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {full_name} already registered as a {metric.kind}")
+            return metric
+
+    def snapshot(self) -> Dict:
+        """
+        JSON-able view: each metric's value (a number, a dict by label
+        value, or a histogram summary), keyed by name without the prefix.
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        skip = len(self.prefix) + 1 if self.prefix else 0
+        return dict(labels=self.const_labels,
+                    time=time.time(),
+                    metrics={name[skip:]: metric.snapshot()
+                             for name, metric in metrics.items()})
+
+    def to_prometheus(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        lines = []
+        for name, metric in sorted(metrics.items()):
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for sample_name, labels, value in metric.samples():
+                labels = {**self.const_labels, **labels}
+                if labels:
+                    rendered = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                    sample_name = f'{sample_name}{{{rendered}}}'
+                lines.append(f'{sample_name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class ServerMetrics:
+    """
+    The metrics every Server records. Subclasses add their own to
+    self.registry (e.g. GPTServer's tokens per second).
+    """
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        r = self.registry = registry or MetricsRegistry()
+        self.connections_accepted = r.counter('connections_accepted_total',
+                                              'Connections accepted (mux streams included)')
+        self.connections_active = r.gauge('connections_active',
+                                          'Connections being handled')
+        self.rejected = r.counter('rejected_total',
+                                  'Connections turned away with a busy frame')
+        self.requests = r.counter('requests_total', 'Requests handled')
+        self.errors = r.counter('errors_total', 'Errors while handling a request',
+                                label='type')
+        self.bytes_in = r.counter('bytes_in_total', 'Payload bytes received')
+        self.bytes_out = r.counter('bytes_out_total', 'Payload bytes sent')
+        self.frames_in = r.counter('frames_in_total', 'Frames received')
+        self.frames_out = r.counter('frames_out_total', 'Frames sent')
+        self.receive_seconds = r.histogram('receive_seconds', 'Time spent in _receive')
+        self.process_seconds = r.histogram('process_seconds',
+                                           'Time spent in _process (and in its output iterator)')
+        self.send_seconds = r.histogram('send_seconds', 'Time spent in _send, excluding _process')
+        self.queue_wait_seconds = r.histogram('queue_wait_seconds',
+                                              'Time connections waited for a handler')
+
+    def record_frames(self, stats) -> None:
+        """
+        Fold one request's FrameStats into the totals.
+        """
+        self.requests.inc()
+        if stats.frames_in:
+            self.frames_in.inc(stats.frames_in)
+            self.bytes_in.inc(stats.bytes_in)
+        if stats.frames_out:
+            self.frames_out.inc(stats.frames_out)
+            self.bytes_out.inc(stats.bytes_out)
+
+
+class TimedIterator:
+    """
+    Wraps an iterator, adding up the time spent producing its items
+    (e.g. generating tokens), as opposed to the time spent sending them.
+    arg::on_done gets the total once the iterator is exhausted or closed.
+    """
+    def __init__(self, iterable, on_done: Callable[[float], None]):
+        self._iterator = iter(iterable)
+        self._on_done = on_done
+        self.elapsed = 0.0
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            self._finish()
+            raise
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def close(self) -> None:
+        close = getattr(self._iterator, 'close', None)
+        if close is not None:
+            close()
+        self._finish()
+
+    def _finish(self) -> None:
+        if not self._done:
+            self._done = True
+            self._on_done(self.elapsed)
+
+
+class MetricsExporter:
+    """
+    Publishes a registry in the Prometheus text format: rewritten to
+    arg::path every interval seconds, and/or served over HTTP (any GET,
+    conventionally /metrics) on arg::http_port.
+    """
+    def __init__(self, registry: MetricsRegistry,
+                       path: Optional[str] = None,
+                       http_port: Optional[int] = None,
+                       host: str = '',
+                       interval: float = METRICS_EXPORT_INTERVAL):
+        self.registry = registry
+        self.path = path
+        self.http_port = http_port
+        self.host = host
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._http = None
+
+    def start(self) -> 'MetricsExporter':
+        if self.path:
+            threading.Thread(target=self._dump_loop, name='[metrics file]',
+                             daemon=True).start()
+        if self.http_port is not None:
+            self._http = ThreadingHTTPServer((self.host, self.http_port),
+                                             self._handler_class())
+            self._http.daemon_threads = True
+            self.http_port = self._http.server_address[1] # if 0 was passed
+            threading.Thread(target=self._http.serve_forever, name='[metrics http]',
+                             daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._http is not None:
+            self._http.shutdown()
+            self._http.server_close()
+        if self.path:
+            self.dump() # final values
+
+    def dump(self) -> None:
+        """
+        Write the file atomically, so scrapers never read a partial one.
+        """
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.registry.to_prometheus())
+        os.replace(tmp_path, self.path)
+
+    def _dump_loop(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.dump()
+            except OSError as e:
+                print(f"Could not write metrics to {self.path}: {e}")
+
+    def _handler_class(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass # one line per scrape is just noise
+
+        return Handler
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int) or (math.isfinite(value) and value == int(value)):
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,484 @@
+"""
+Opt-in multiplexing extension to the Transmit protocol: one long-lived
+connection carries many concurrent request/response streams.
+
+A client opts in by sending the reserved Transmit.mux_hello prefix as the
+first 4 bytes on a connection; an upgraded server answers with the same
+prefix. From then on, every frame in either direction is:
+    [payload size (!I)] [stream id (!I)] [frame type (!B)] [payload]
+
+Clients that never send mux_hello see the plain Transmit protocol, so old
+single-stream clients keep working against upgraded servers.
+
+On the server, each stream is bridged onto a local socketpair whose far
+end is handed to the server's normal handler pool, so every Server
+variant (and its admission control) works on streams unchanged. Each
+stream buffers at most MUX_STREAM_QUEUE incoming frames for its handler;
+beyond that, the server stops reading the connection until the handler
+catches up (or the stream ends), so a client that sends faster than a
+handler reads is slowed down rather than growing server memory.
+"""
+from typing import Dict, Iterable, Optional, Tuple
+import itertools
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from ..config import (HOST, PORT, CHUNK_SIZE,
+                      MUX_HELLO_TIMEOUT, MUX_IDLE_CHECK, MUX_PING_TIMEOUT, MUX_STREAM_QUEUE,
+                      MUX_MAX_FRAME)
+from .structures import Transmit, ServerBusyError
+from .client import Client, duplex
+from .transport import TcpTransport
+
+class MuxUnsupportedError(ConnectionError):
+    """
+    Raised when a server does not acknowledge the mux hello: it does not
+    speak the extension, and a plain Client should be used instead.
+    """
+
+class Mux:
+    """
+    Static class: frame types and codec for multiplexed frames.
+    """
+    header_type = '!IIB' # payload size, stream id, frame type
+    n_header_bytes = struct.calcsize(header_type)
+
+    DATA = 0  # one payload of the stream
+    END = 1   # end of transmission, for this direction of the stream
+    BUSY = 2  # server rejected the stream (see Transmit.server_busy)
+    RESET = 3 # abandon the stream
+    PING = 4  # health check (stream id 0), answered with PONG
+    PONG = 5
+    OPTIONS = 6 # payload is a Transmit options object (JSON)
+
+    @classmethod
+    def send_hello(cls, sock: socket.socket) -> None:
+        Transmit._send_buffers(sock, [Transmit._pack_size(Transmit.mux_hello)])
+
+    @classmethod
+    def write_frame(cls, sock: socket.socket, stream_id: int,
+                         frame_type: int, payload: bytes = b'') -> None:
+        header = struct.pack(cls.header_type, len(payload), stream_id, frame_type)
+        Transmit._send_buffers(sock, [header, payload])
+
+    @classmethod
+    def read_frame(cls, sock: socket.socket,
+                        header: bytearray) -> Tuple[int, int, bytearray]:
+        """
+        Returns (stream_id, frame_type, payload). Pass a reusable header
+        buffer of n_header_bytes. Raises ConnectionError for a frame over
+        MUX_MAX_FRAME bytes, before allocating anything for it.
+        """
+        Transmit._receive_into(sock, memoryview(header))
+        size, stream_id, frame_type = struct.unpack(cls.header_type, header)
+        if size > MUX_MAX_FRAME:
+            raise ConnectionError(f"Multiplexed frame of {size} bytes exceeds "
+                                  f"MUX_MAX_FRAME ({MUX_MAX_FRAME})")
+        payload = Transmit._receive(sock, size)
+        return stream_id, frame_type, payload
+
+
+def is_mux_hello(sock: socket.socket) -> bool:
+    """
+    Peek (without consuming) at the first prefix on a fresh connection.
+    """
+    return Transmit.peek_size(sock) == Transmit.mux_hello
+
+
+class MuxServerSession:
+    """
+    Server side of one multiplexed connection.
+
+    A reader thread demultiplexes incoming frames. Each new stream gets a
+    socketpair: its far end is passed to arg::submit (e.g. HandlerPool.submit)
+    and handled like a plain connection, while two small threads copy
+    frames between the near end and the shared connection.
+    """
+    def __init__(self, sock: socket.socket, submit, name: str = 'mux'):
+        self.sock = sock
+        self.submit = submit
+        self.name = name
+        self._write_lock = threading.Lock()
+        self._streams: Dict[int, Tuple[socket.socket, queue.Queue]] = {}
+        self._last_stream_id = 0
+
+    def start(self) -> None:
+        # consume the hello the client opened with, and acknowledge it
+        Transmit._receive(self.sock, Transmit.n_prefix_bytes)
+        Mux.send_hello(self.sock)
+        threading.Thread(target=self._read_loop, name=self.name, daemon=True).start()
+
+    def _write(self, stream_id: int, frame_type: int, payload: bytes = b'') -> None:
+        with self._write_lock:
+            Mux.write_frame(self.sock, stream_id, frame_type, payload)
+
+    def _read_loop(self) -> None:
+        header = bytearray(Mux.n_header_bytes)
+        try:
+            while True:
+                stream_id, frame_type, payload = Mux.read_frame(self.sock, header)
+                if frame_type == Mux.PING:
+                    self._write(stream_id, Mux.PONG, payload)
+                    continue
+
+                stream = self._streams.get(stream_id)
+                if stream is None:
+                    if stream_id <= self._last_stream_id:
+                        continue # late frame for a finished stream
+                    stream = self._open_stream(stream_id)
+
+                _, inbox = stream
+                if frame_type == Mux.RESET:
+                    self._close_stream(stream_id)
+                else:
+                    self._deliver(stream_id, inbox, (frame_type, payload))
+
+        except (ConnectionError, OSError):
+            pass # client went away, or sent an oversized frame
+        finally:
+            for stream_id in list(self._streams):
+                self._close_stream(stream_id)
+            self.sock.close()
+
+    def _open_stream(self, stream_id: int):
+        self._last_stream_id = stream_id
+        near, far = socket.socketpair()
+        inbox = queue.Queue(MUX_STREAM_QUEUE)
+        stream = self._streams[stream_id] = (near, inbox)
+        name = f'{self.name} <stream {stream_id}>'
+        threading.Thread(target=self._feed, args=(near, inbox),
+                         name=name + ' [in]', daemon=True).start()
+        threading.Thread(target=self._pump, args=(stream_id, near),
+                         name=name + ' [out]', daemon=True).start()
+        self.submit(far) # may reject (and finish the stream) straight away
+        return stream
+
+    def _deliver(self, stream_id: int, inbox: queue.Queue, item) -> None:
+        """
+        Queue arg::item for the stream's handler. While its inbox is full,
+        nothing more is read from the connection; if the stream ends
+        meanwhile, arg::item is dropped.
+        """
+        while True:
+            try:
+                return inbox.put(item, timeout=0.1)
+            except queue.Full:
+                if stream_id not in self._streams:
+                    return
+
+    def _close_stream(self, stream_id: int) -> None:
+        stream = self._streams.pop(stream_id, None)
+        if stream is not None:
+            near, inbox = stream
+            try:
+                near.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                inbox.put_nowait(None) # wake _feed if it waits for a frame
+            except queue.Full:
+                pass # _feed is busy, and fails on the closed socket
+
+    def _feed(self, near: socket.socket, inbox: queue.Queue) -> None:
+        """
+        Client -> handler. Queued so one slow handler cannot stall the
+        connection reader (and with it, every other stream).
+        """
+        try:
+            while (item := inbox.get()) is not None:
+                frame_type, payload = item
+                if frame_type == Mux.DATA:
+                    Transmit.send_over_socket(near, payload)
+                elif frame_type == Mux.END:
+                    Transmit.end_transmission(near)
+                elif frame_type == Mux.OPTIONS:
+                    Transmit.send_options(near, Transmit._decode_options(payload))
+        except OSError:
+            pass # handler finished, or stream reset
+
+    def _pump(self, stream_id: int, near: socket.socket) -> None:
+        """
+        Handler -> client. The stream ends when the handler sends end of
+        transmission or closes its end (e.g. a MIMO server after replying).
+        """
+        frame_type = Mux.END
+        try:
+            while True:
+                size = Transmit.read_size(near)
+                if size == Transmit.end_of_transmission:
+                    break
+                if size == Transmit.options:
+                    options = Transmit._receive(near, Transmit.read_size(near))
+                    self._write(stream_id, Mux.OPTIONS, options)
+                    continue
+                self._write(stream_id, Mux.DATA, Transmit._receive(near, size))
+        except ServerBusyError:
+            frame_type = Mux.BUSY
+        except (ConnectionError, OSError):
+            pass # handler closed its end
+        try:
+            self._write(stream_id, frame_type)
+        except OSError:
+            pass
+        self._close_stream(stream_id)
+        near.close()
+
+
+class MuxStream:
+    """
+    One request/response stream on a MuxConnection. Same API as Client.
+    """
+    def __init__(self, connection: 'MuxConnection'):
+        self.connection = connection
+        self.stream_id = None # assigned when the first frame is written
+        self.inbox = queue.Queue()
+        self.finished = False
+
+    def send(self, data: bytes) -> None:
+        self._send_frame(data)
+
+    def _send_frame(self, data: bytes) -> None:
+        self.connection._write_stream(self, Mux.DATA, data)
+
+    def duplex(self, frames: Iterable[bytes], copy: bool = True) -> Iterable[bytes]:
+        return duplex(self, frames, copy)
+
+    def end_transmission(self) -> None:
+        self.connection._write_stream(self, Mux.END)
+
+    def negotiate(self, **options) -> Dict:
+        """
+        See Client.negotiate.
+        """
+        self.connection._write_stream(self, Mux.OPTIONS,
+                                      Transmit._encode_options(options))
+        frame_type, payload = self.inbox.get()
+        if frame_type == Mux.OPTIONS:
+            return Transmit._decode_options(payload)
+        self.finished = True
+        if frame_type == Mux.BUSY:
+            raise ServerBusyError("Server is busy and rejected the request")
+        raise ConnectionError("Stream ended during option negotiation")
+
+    def receive(self) -> Optional[bytes]:
+        if self.finished:
+            return None
+        frame_type, payload = self.inbox.get()
+        if frame_type == Mux.DATA:
+            return payload
+        self.finished = True
+        if frame_type == Mux.BUSY:
+            raise ServerBusyError("Server is busy and rejected the request")
+        if isinstance(payload, Exception):
+            raise payload
+        return None
+
+    def receive_stream(self, copy: bool = True) -> Iterable[bytes]:
+        while True:
+            data = self.receive()
+            if data is None:
+                break
+            yield bytes(data) if copy else data
+
+    def close(self) -> None:
+        """
+        Release the stream; the connection stays open for reuse.
+        """
+        if not self.finished and self.stream_id is not None:
+            try:
+                self.connection._write(self.stream_id, Mux.RESET)
+            except OSError:
+                pass
+        self.finished = True
+        self.connection._streams.pop(self.stream_id, None)
+
+
+class MuxConnection:
+    """
+    Client side of one multiplexed connection.
+
+    Usage:
+        conn = MuxConnection(host, port)
+        stream = conn.open_stream()     # Client-like: send / receive / ...
+    arg::transport overrides host and port, as for Client (see
+    transport.py). Raises MuxUnsupportedError if the server does not
+    speak the mux extension (it did not acknowledge the hello in time),
+    and the usual connection errors if the server cannot be reached.
+    """
+    def __init__(self, host: str = HOST, port: int = PORT,
+                       hello_timeout: float = MUX_HELLO_TIMEOUT,
+                       transport=None):
+        self.host = host
+        self.port = port
+        self.transport = transport or TcpTransport(host, port)
+        self.sock = self.transport.connect()
+        Transmit.set_nodelay(self.sock)
+        self._write_lock = threading.Lock()
+        self._streams: Dict[int, MuxStream] = {}
+        self._stream_ids = itertools.count(1)
+        self._pongs: Dict[bytes, threading.Event] = {}
+        self.alive = False
+        self.last_used = time.monotonic()
+
+        self._handshake(hello_timeout)
+        self.alive = True
+        threading.Thread(target=self._read_loop,
+                         name=f'[mux {self.transport}]', daemon=True).start()
+
+    def _handshake(self, timeout: float) -> None:
+        Mux.send_hello(self.sock)
+        self.sock.settimeout(timeout)
+        try:
+            ack = Transmit.read_size(self.sock)
+        except ServerBusyError:
+            self.sock.close()
+            raise
+        except (socket.timeout, ConnectionError) as e:
+            self.sock.close()
+            raise MuxUnsupportedError(
+                f"{self.transport} does not support multiplexing") from e
+        finally:
+            if self.sock.fileno() != -1:
+                self.sock.settimeout(None)
+        if ack != Transmit.mux_hello:
+            self.sock.close()
+            raise MuxUnsupportedError(f"Unexpected mux handshake reply: {ack:#x}")
+
+    def open_stream(self) -> MuxStream:
+        if not self.alive:
+            raise ConnectionError("Multiplexed connection is closed")
+        self.last_used = time.monotonic()
+        return MuxStream(self)
+
+    def ping(self, timeout: float = MUX_PING_TIMEOUT) -> bool:
+        """
+        Round-trip a PING frame. False if the connection is unusable.
+        """
+        if not self.alive:
+            return False
+        token = os.urandom(8)
+        event = self._pongs[token] = threading.Event()
+        try:
+            self._write(0, Mux.PING, token)
+            return event.wait(timeout)
+        except OSError:
+            return False
+        finally:
+            self._pongs.pop(token, None)
+
+    def close(self) -> None:
+        self.alive = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _write(self, stream_id: int, frame_type: int, payload: bytes = b'') -> None:
+        with self._write_lock:
+            Mux.write_frame(self.sock, stream_id, frame_type, payload)
+        self.last_used = time.monotonic()
+
+    def _write_stream(self, stream: MuxStream, frame_type: int, payload: bytes = b'') -> None:
+        """
+        The server treats a frame for an id below the newest one it has
+        seen as late, so ids are handed out under the write lock, in the
+        order streams first reach the wire.
+        """
+        with self._write_lock:
+            if stream.stream_id is None:
+                if not self.alive:
+                    raise ConnectionError("Multiplexed connection is closed")
+                stream.stream_id = next(self._stream_ids)
+                self._streams[stream.stream_id] = stream
+            Mux.write_frame(self.sock, stream.stream_id, frame_type, payload)
+        self.last_used = time.monotonic()
+
+    def _read_loop(self) -> None:
+        header = bytearray(Mux.n_header_bytes)
+        error = ConnectionError("Multiplexed connection lost")
+        try:
+            while True:
+                stream_id, frame_type, payload = Mux.read_frame(self.sock, header)
+                if frame_type == Mux.PONG:
+                    event = self._pongs.get(bytes(payload))
+                    if event is not None:
+                        event.set()
+                    continue
+                stream = self._streams.get(stream_id)
+                if stream is not None:
+                    stream.inbox.put((frame_type, payload))
+                    if frame_type in (Mux.END, Mux.BUSY, Mux.RESET):
+                        self._streams.pop(stream_id, None)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.alive = False
+            for stream in list(self._streams.values()):
+                stream.inbox.put((Mux.RESET, error))
+            self._streams.clear()
+
+
+class ClientPool:
+    """
+    Long-lived multiplexed connections, keyed by address (host and port,
+    or a transport's, see transport.py).
+
+    stream() returns a Client-compatible stream on a pooled connection,
+    reconnecting if the connection has died, and pinging it first if it
+    has been idle for more than idle_check seconds. Hosts that do not
+    support multiplexing get a plain (single-use) Client instead. If a
+    host cannot be reached, the error is raised, and the next call tries
+    again.
+
+    Usage:
+        pool = ClientPool()
+        client = pool.stream(GPT_HOST, GPT_PORT)
+        client.send(prompt)
+        for token in client.receive_stream(): ...
+        client.close()
+    """
+    def __init__(self, idle_check: float = MUX_IDLE_CHECK,
+                       chunk_size: int = CHUNK_SIZE):
+        self.idle_check = idle_check
+        self.chunk_size = chunk_size
+        self._connections: Dict[str, MuxConnection] = {}
+        self._unsupported = set()
+        self._lock = threading.Lock()
+
+    def stream(self, host: str = HOST, port: int = PORT, transport=None):
+        transport = transport or TcpTransport(host, port)
+        key = str(transport)
+        if key in self._unsupported:
+            return Client(host, port, self.chunk_size, transport=transport)
+
+        with self._lock:
+            conn = self._connections.get(key)
+            if conn is not None and not self._healthy(conn):
+                conn.close()
+                conn = None
+            if conn is None:
+                try:
+                    conn = MuxConnection(host, port, transport=transport)
+                except MuxUnsupportedError as e:
+                    print(f"{e}: falling back to single-stream connections.")
+                    self._unsupported.add(key)
+                    return Client(host, port, self.chunk_size, transport=transport)
+                self._connections[key] = conn
+        return conn.open_stream()
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+
+    def _healthy(self, conn: MuxConnection) -> bool:
+        if not conn.alive:
+            return False
+        if time.monotonic() - conn.last_used > self.idle_check:
+            return conn.ping()
+        return True
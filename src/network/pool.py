@@ -0,0 +1,154 @@
+from typing import Callable, Dict, Optional
+import collections
+import socket
+import threading
+import time
+
+class HandlerPool:
+    """
+    Fixed set of worker threads that handle accepted client sockets.
+
+    At most max_in_flight sockets are handled at once. Up to max_queued
+    more wait in a bounded queue; a socket is rejected (via arg::reject)
+    when the queue is full, or as soon as it has waited queue_timeout
+    seconds without a worker coming free (a reaper thread expires them).
+
+    Main public API usage:
+        pool = HandlerPool(handle, reject, max_in_flight=4, max_queued=16)
+        pool.submit(client_socket)  # False if rejected immediately
+        pool.counters()             # snapshot of queue / latency counters
+        pool.shutdown()
+    """
+    def __init__(self, handler: Callable[[socket.socket], None],
+                       reject: Callable[[socket.socket], None],
+                       max_in_flight: int,
+                       max_queued: int,
+                       queue_timeout: float,
+                       name: str = 'pool',
+                       observe_wait: Optional[Callable[[float], None]] = None):
+        """
+        arg::observe_wait, if given, is called with each socket's queue
+        wait in seconds (e.g. a metrics Histogram.observe).
+        """
+
+        self.handler = handler
+        self.reject = reject
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.name = name
+        self.observe_wait = observe_wait
+        self.waiting = collections.deque() # (socket, queued_at), oldest first
+        self.stopping = False
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._counters = dict(accepted=0,
+                              completed=0,
+                              in_flight=0,
+                              queue_depth=0,
+                              max_queue_depth=0,
+                              rejected_queue_full=0,
+                              rejected_queue_timeout=0,
+                              queue_wait_total=0.0,
+                              queue_wait_max=0.0)
+
+        self.workers = [threading.Thread(target=self._work,
+                                         name=f'{name} [worker {i}]',
+                                         daemon=True)
+                        for i in range(max_in_flight)]
+        for worker in self.workers:
+            worker.start()
+        threading.Thread(target=self._reap, name=f'{name} [reaper]', daemon=True).start()
+
+    def submit(self, client_socket: socket.socket) -> bool:
+        """
+        Queue arg::client_socket for a worker. Rejects it straight away,
+        and returns False, if the wait queue is full.
+        """
+        with self._lock:
+            c = self._counters
+            full = self.stopping or len(self.waiting) >= self.max_queued
+            if full:
+                c['rejected_queue_full'] += 1
+            else:
+                self.waiting.append((client_socket, time.monotonic()))
+                self._changed.notify_all()
+                c['accepted'] += 1
+                c['queue_depth'] += 1
+                c['max_queue_depth'] = max(c['max_queue_depth'], c['queue_depth'])
+
+        if full:
+            self.reject(client_socket)
+        return not full
+
+    def counters(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._counters)
+
+    def shutdown(self) -> None:
+        """
+        Stop workers once they finish their current socket. Sockets still
+        waiting in the queue are rejected.
+        """
+        with self._lock:
+            self.stopping = True
+            waiting = list(self.waiting)
+            self.waiting.clear()
+            self._counters['queue_depth'] -= len(waiting)
+            self._changed.notify_all()
+        for client_socket, _ in waiting:
+            self.reject(client_socket)
+
+    def _work(self) -> None:
+        while True:
+            with self._lock:
+                while not self.waiting and not self.stopping:
+                    self._changed.wait()
+                if not self.waiting: # stopping
+                    break
+                client_socket, queued_at = self.waiting.popleft()
+                wait = time.monotonic() - queued_at
+                c = self._counters
+                c['queue_depth'] -= 1
+                c['queue_wait_total'] += wait
+                c['queue_wait_max'] = max(c['queue_wait_max'], wait)
+                c['in_flight'] += 1
+            if self.observe_wait is not None:
+                self.observe_wait(wait)
+
+            try:
+                self.handler(client_socket)
+            except Exception as e:
+                print(f"{self.name}: handler raised: {e}")
+            finally:
+                with self._lock:
+                    self._counters['in_flight'] -= 1
+                    self._counters['completed'] += 1
+
+    def _reap(self) -> None:
+        """
+        Reject queued sockets once they have waited queue_timeout seconds.
+        The queue is FIFO, so only the oldest needs watching.
+        """
+        while True:
+            expired = []
+            with self._lock:
+                if self.stopping:
+                    break
+                now = time.monotonic()
+                while self.waiting and now - self.waiting[0][1] >= self.queue_timeout:
+                    expired.append(self.waiting.popleft())
+                c = self._counters
+                c['queue_depth'] -= len(expired)
+                c['rejected_queue_timeout'] += len(expired)
+                for _, queued_at in expired:
+                    c['queue_wait_total'] += now - queued_at
+                    c['queue_wait_max'] = max(c['queue_wait_max'], now - queued_at)
+                if not expired:
+                    timeout = self.waiting[0][1] + self.queue_timeout - now if self.waiting else None
+                    self._changed.wait(timeout)
+            for client_socket, queued_at in expired:
+                if self.observe_wait is not None:
+                    self.observe_wait(now - queued_at)
+                self.reject(client_socket)
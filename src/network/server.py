@@ -8,13 +8,20 @@ Servers come in four varieties:
     The normal server class, Server, is MIMO. The other varieties are
     subclasses of Server, found below.
 """
-from typing import Generator
-import random
+from typing import Generator, Iterator
+import json
 import socket
 import threading
+import time
 from ..utils import teardown
-from ..config import PORT, CHUNK_SIZE
-from .structures import Transmit
+from ..config import (PORT, CHUNK_SIZE, SERVER_BACKLOG, SERVER_MAX_IN_FLIGHT,
+                      SERVER_MAX_QUEUED, SERVER_QUEUE_TIMEOUT, SERVER_DRAIN_TIMEOUT)
+from .structures import (Transmit, FrameReader, FrameWriter, BufferedFrameReader,
+                         FrameStats)
+from .pool import HandlerPool
+from .mux import MuxServerSession
+from .metrics import MetricsRegistry, ServerMetrics, MetricsExporter, TimedIterator
+from .transport import TcpTransport
 
 class Server:
     """
@@ -23,34 +30,55 @@ class Server:
     Example Use Case:
         client sends a text request ->
         returns a text response, and ends the connection.
+
+    Connections are handled by a pool of max_in_flight worker threads.
+    Up to max_queued more connections wait (for at most queue_timeout
+    seconds) for a free worker; beyond that, clients are sent a
+    Transmit.server_busy frame and disconnected. See counters().
+
+    Every server records self.metrics (see metrics.py): connections,
+    bytes and frames, time spent in _receive / _process / _send, errors
+    and queue wait. Clients read them with Client.metrics(); see also
+    export_metrics() for Prometheus.
     """
     def __init__(self, host='', # Empty string to listen on all network interfaces.
                        port=PORT,
-                       chunk_size=CHUNK_SIZE):
+                       chunk_size=CHUNK_SIZE,
+                       max_in_flight=SERVER_MAX_IN_FLIGHT,
+                       max_queued=SERVER_MAX_QUEUED,
+                       queue_timeout=SERVER_QUEUE_TIMEOUT,
+                       backlog=SERVER_BACKLOG,
+                       keep_alive=False,
+                       transport=None):
 
         teardown.register(self.teardown)
         self.host = host
         self.port = port
         self.name = self.__class__.__name__
         self.chunk_size = chunk_size
-        self.keep_alive = False # maybe make True
+        self.keep_alive = keep_alive # serve further requests on a connection
         self._running = threading.Event()
+        self._local = threading.local() # per-connection state, e.g. options
         self.sentinel_message = b'x_end_x'
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-        # Avoid the error when restarting server by setting SO_REUSEADDR flag: 
-        #   OSError: [Errno 48] Address already in use
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # TCP by default; see transport.py for AF_UNIX and shared memory
+        self.transport = transport or TcpTransport(host, port)
+        self.server_socket = self.transport.listen(backlog)
+        self.metrics = ServerMetrics(MetricsRegistry(const_labels=dict(server=self.name)))
+        self._exporters = []
 
-        self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)  # Listen for up to 5 connections
+        self.pool = HandlerPool(self._serve_connection, self._reject,
+                                max_in_flight=max_in_flight,
+                                max_queued=max_queued,
+                                queue_timeout=queue_timeout,
+                                name=self.name,
+                                observe_wait=self.metrics.queue_wait_seconds.observe)
 
     @property
     def running(self):
         return self._running.is_set()
 
     def serve(self):
-        print(f"\nServer is listening on {self.host}:{self.port}")
+        print(f"\nServer is listening on {self.transport}")
         self._running.set()
         threading.Thread(target=self._serve, name=self.name).start()
 
@@ -61,46 +89,188 @@ class Server:
 
     def shutdown(self):
         self._running.clear()
-        sentinel_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        for exporter in self._exporters:
+            exporter.stop()
         try:
-            sentinel_socket.connect(('localhost', self.port))
-            self._send(sentinel_socket, self.sentinel_message)
-            #sentinel_socket.sendall(self.sentinel_message)
+            sentinel_socket = self.transport.local().connect()
+            # not self._send: subclasses may send sequences, not messages
+            Transmit.send_over_socket(sentinel_socket, self.sentinel_message)
+        except ConnectionError:
+            pass # connecting already woke accept(); the server hung up first
         except Exception as e:
             print(f"Error sending shutdown sentinel: {e}")
             raise
 
+    def counters(self):
+        """
+        Snapshot of handler pool counters: queue depth, time spent
+        waiting for a worker, in-flight and rejected connections.
+        """
+        return self.pool.counters()
+
+    def export_metrics(self, path=None, http_port=None, host=''):
+        """
+        Publish self.metrics in the Prometheus text format: periodically
+        written to arg::path, and/or served over HTTP on arg::http_port
+        (which, unlike the metrics control message, still answers when
+        every handler is busy). Stopped by shutdown().
+        """
+        exporter = MetricsExporter(self.metrics.registry, path=path,
+                                   http_port=http_port, host=host).start()
+        self._exporters.append(exporter)
+        return exporter
+
     def _serve(self):
         while self.running:
             client_socket, client_address = self.server_socket.accept()
+            Transmit.set_nodelay(client_socket)
             print(f"Connection established with {client_address}")
-            name = f'{self.name} [{client_address}] <{random.getrandbits(20)}>'
-            client_thread = threading.Thread(target=self._handle_client,
-                                             args=(client_socket,),
-                                             name=name)
-            client_thread.start()
+            self.metrics.connections_accepted.inc()
+            self.pool.submit(client_socket)
+        self.pool.shutdown()
+        self.server_socket.close()
+        self.transport.cleanup()
         print('Server has been shut down.')
 
+    def _reject(self, client_socket):
+        """
+        Turn a client away because the server is saturated.
+        """
+        print('Server busy: rejecting connection.')
+        self.metrics.rejected.inc()
+        try:
+            Transmit.send_busy(client_socket)
+            client_socket.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        finally:
+            client_socket.close()
+
+    def _serve_connection(self, client_socket):
+        """
+        Entry point for each accepted connection (run by a pool worker).
+        Multiplexed connections are handed to a MuxServerSession, which
+        submits each of their streams back to the pool as a connection of
+        its own. With keep_alive, plain connections are served request
+        after request until the client hangs up.
+        """
+        prefix = Transmit.peek_size(client_socket)
+        if prefix == Transmit.mux_hello:
+            name = f'{self.name} [mux {client_socket.fileno()}]'
+            return MuxServerSession(client_socket, self.pool.submit, name).start()
+
+        self.metrics.connections_active.inc()
+        try:
+            while prefix is not None:
+                if prefix == Transmit.metrics_request:
+                    self._send_metrics(client_socket)
+                else:
+                    self._handle_client(client_socket)
+                if not self.keep_alive:
+                    break
+                # block until the client sends another request, or hangs up
+                prefix = Transmit.peek_size(client_socket)
+        finally:
+            self.metrics.connections_active.dec()
+
+    def _send_metrics(self, client_socket):
+        """
+        Answer a Transmit.metrics_request with a JSON snapshot.
+        """
+        try:
+            Transmit._receive(client_socket, Transmit.n_prefix_bytes)
+            snapshot = dict(self.metrics.registry.snapshot(), pool=self.counters())
+            Transmit.send_over_socket(client_socket, json.dumps(snapshot).encode('utf-8'))
+        except OSError as e:
+            print(f"Error sending metrics: {e}")
+        finally:
+            if not self.keep_alive:
+                client_socket.close()
+
+    @property
+    def _stats(self):
+        """
+        FrameStats of the request being handled on this thread.
+        """
+        stats = getattr(self._local, 'stats', None)
+        if stats is None:
+            stats = self._local.stats = FrameStats()
+        return stats
+
+    def _timed_process(self, message):
+        """
+        Run _process, recording its duration. A streamed result (e.g. a
+        generator of tokens) is wrapped so the time spent producing its
+        items counts as processing, not sending.
+        """
+        start = time.perf_counter()
+        result = self._process(message)
+        elapsed = time.perf_counter() - start
+        if result is None or isinstance(result, (bytes, bytearray, memoryview, str)):
+            self.metrics.process_seconds.observe(elapsed)
+            return result
+        observe = self.metrics.process_seconds.observe
+        return TimedIterator(result, lambda produced: observe(elapsed + produced))
+
+    def _timed_send(self, client_socket, response):
+        start = time.perf_counter()
+        try:
+            self._send(client_socket, response)
+        finally:
+            elapsed = time.perf_counter() - start - getattr(response, 'elapsed', 0.0)
+            self.metrics.send_seconds.observe(max(elapsed, 0.0))
+
+    @property
+    def options(self):
+        """
+        Options accepted for the request being handled on this thread.
+        """
+        return getattr(self._local, 'options', {})
+
+    def _negotiate(self, requested):
+        """
+        Given the options a client opened its request with, return those
+        this server accepts (sent back to the client, and then available
+        as self.options). Override to support options.
+        """
+        return {}
+
+    def _receive_options(self, client_socket):
+        """
+        If the request opens with an options frame, answer it.
+        """
+        options = {}
+        if Transmit.peek_size(client_socket) == Transmit.options:
+            options = self._negotiate(Transmit.read_options(client_socket))
+            Transmit.send_options(client_socket, options)
+        self._local.options = options
+
     def _handle_client(self, client_socket):
+        self._local.stats = stats = FrameStats()
         try:
+            self._receive_options(client_socket)
+            start = time.perf_counter()
             message = self._receive(client_socket)
+            self.metrics.receive_seconds.observe(time.perf_counter() - start)
             if message:
-                print(f"Received message of length: {len(message)} bytes")
+                print(f"Received message of length: {getattr(message, 'nbytes', len(message))} bytes")
                 if message == self.sentinel_message:
                     print('Server got sentinel shutdown signal.')
                     return client_socket.close()
 
-                message = self._process(message)
-                self._send(client_socket, message)
+                message = self._timed_process(message)
+                self._timed_send(client_socket, message)
             else:
                 print('Message was nullish value')
 
         except Exception as e:
             print(f"Error handling client: {e}")
+            self.metrics.errors.inc(label_value=type(e).__name__)
             client_socket.close() 
             raise
 
         finally:
+            self.metrics.record_frames(stats)
             if not self.keep_alive:
                 client_socket.close() # maybe don't close on server
 
@@ -108,24 +278,34 @@ class Server:
         return message
 
     def _receive(self, client_socket):
-        return Transmit.read_from_socket(client_socket)
+        return FrameReader(client_socket, initial_size=0, stats=self._stats).read()
 
     def _send(self, client_socket, response):
         Transmit.send_over_socket(client_socket, response)
+        self._stats.frames_out += 1
+        self._stats.bytes_out += len(response)
 
 class MessageInSequenceOutServer(Server):
     """
     Example Use Case:
         Receive as input a text prompt, and run through a GPT,
         respond with a stream of GPT-generated tokens.
+
+    Set self.coalescer to a TokenCoalescer (see coalesce.py) to send
+    several tokens per frame.
     """
+    coalescer = None
+
     def _process(self, message: bytes) -> Generator[bytes, None, None]:
         raise NotImplementedError()
 
     def _send(self, client_socket, sequence: Generator[bytes, None, None]) -> None:
+        writer = FrameWriter(client_socket, stats=self._stats)
+        if self.coalescer is not None:
+            sequence = self.coalescer.frames(sequence)
         for message in sequence:
-            super()._send(client_socket, message)
-        Transmit.end_transmission(client_socket)
+            writer.send(message)
+        writer.end_transmission()
 
 
 class SequenceInMessageOutServer(Server):
@@ -137,13 +317,79 @@ class SequenceInMessageOutServer(Server):
     def _receive(self, client_socket):
         """
         Receive stream chunks in a loop until end of transmission signal.
+        Each chunk is read straight into the tail of a single growing
+        buffer, so the complete message is never re-assembled or copied.
         """
-        chunks = []
+        reader = FrameReader(client_socket, initial_size=0, stats=self._stats)
+        message = bytearray(self.chunk_size)
+        n_bytes = 0
         while True:
-            chunk = super()._receive(client_socket)
-            if chunk is None: # got end of transmission
-                return b''.join(chunks)
-            chunks.append(chunk)
+            size = reader.read_size()
+            if size is None: # got end of transmission
+                del message[n_bytes:]
+                return message
+            if n_bytes + size > len(message):
+                message.extend(bytes(max(size, len(message))))
+            reader.read_payload_into(memoryview(message)[n_bytes:n_bytes+size])
+            n_bytes += size
 
 class SequenceInSequenceOutServer(Server):
-    pass
+    """
+    Example Use Case:
+        Receive as input an audio stream, and respond with partial
+        transcripts while the audio is still arriving.
+
+    _process receives an iterator of incoming frames, and returns an
+    iterator of outgoing frames. Incoming frames are read on a separate
+    thread into a buffer of at most max_pending frames, so reading and
+    writing run concurrently. The input iterator ends at the client's end
+    of transmission; the server sends its own once _process's output ends.
+    (See Client.duplex for the matching client side.)
+    """
+    max_pending = 64 # incoming frames buffered ahead of _process
+    drain_timeout = SERVER_DRAIN_TIMEOUT # seconds, with keep_alive, for the client to end a request
+
+    def _process(self, sequence: Iterator[bytes]) -> Iterator[bytes]:
+        raise NotImplementedError()
+
+    def _receive(self, client_socket) -> BufferedFrameReader:
+        name = f'{threading.current_thread().name} [in]'
+        return BufferedFrameReader(client_socket, self.max_pending, name,
+                                   stats=self._stats)
+
+    def _send(self, client_socket, sequence: Iterator[bytes]) -> None:
+        writer = FrameWriter(client_socket, stats=self._stats)
+        for message in sequence:
+            writer.send(message)
+        writer.end_transmission()
+
+    def _handle_client(self, client_socket):
+        """
+        Receiving overlaps processing here, so no receive time is recorded.
+        """
+        self._local.stats = stats = FrameStats()
+        frames = None
+        try:
+            self._receive_options(client_socket)
+            frames = self._receive(client_socket)
+            self._timed_send(client_socket, self._timed_process(iter(frames)))
+
+        except Exception as e:
+            print(f"Error handling client: {e}")
+            self.metrics.errors.inc(label_value=type(e).__name__)
+            raise
+
+        finally:
+            # _process may stop before the client does: drop the rest.
+            if frames is not None:
+                frames.close()
+            # The next request starts after this one's end; a client that
+            # does not send it in time is hung up on.
+            if not (self.keep_alive and frames is not None
+                    and frames.join(self.drain_timeout)):
+                try:
+                    client_socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                client_socket.close()
+            self.metrics.record_frames(stats)
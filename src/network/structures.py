@@ -1,6 +1,18 @@
-from typing import Union
+from typing import Union, Optional, List, Dict
+import json
+import queue
 import struct
 import socket
+import threading
+import time
+from ..config import CHUNK_SIZE, COALESCE_DELAY_US
+
+class ServerBusyError(ConnectionError):
+    """
+    Raised on the client side when a server rejects the connection
+    because it is saturated. Safe to retry, possibly on another host.
+    """
+
 
 class Transmit:
     """
@@ -12,68 +24,176 @@ class Transmit:
             Transmit.send_over_socket(sock, payload) 
             payload = Transmit.read_from_socket(sock)
         When read_from_socket returns None, transmission is complete.
+
+    Size prefixes of 0xffffff00 and above are reserved as control codes:
+        end_of_transmission : no more frames follow in this transmission.
+        server_busy         : server is saturated and dropped the request;
+                              readers raise ServerBusyError.
+        mux_hello           : opens (and acknowledges) a multiplexed
+                              connection; see mux.py.
+        options             : the next frame is a JSON object of per-request
+                              options (e.g. an audio codec). A client may
+                              open a request with one; the server answers
+                              with one holding the options it accepted.
+        metrics_request     : sent instead of a request; the server answers
+                              with one frame, a JSON snapshot of its metrics.
     """
     size_prefix_type = '!I'  # 32-bit unsigned integer, big-endian
     n_prefix_bytes = struct.calcsize(size_prefix_type)
     end_of_transmission = 0xffffffff # sentinel: 32 bits, all set
+    server_busy = 0xfffffffe
+    mux_hello = 0xfffffffd
+    options = 0xfffffffc
+    metrics_request = 0xfffffffb
+    max_iov = 1024 # buffers per sendmsg call (IOV_MAX on Linux)
 
     @classmethod
     def send_over_socket(cls, sock: socket.socket, payload: bytes):
-        sock.sendall(cls._prepend_size(payload))
+        cls._send_buffers(sock, [cls._pack_size(len(payload)), payload])
 
     @classmethod
-    def read_from_socket(cls, sock: socket.socket) -> Union[bytes, None]:
+    def read_from_socket(cls, sock: socket.socket) -> Union[bytearray, None]:
+        """
+        Returns the payload as a freshly allocated bytearray, filled
+        directly from the socket (no intermediate chunk list / join).
+        For repeated reads on one socket, prefer a FrameReader.
+        """
         try:
-            #prefix_bytes = sock.recv(cls.n_prefix_bytes)
-            #maybe this fixes common error here
-            prefix_bytes = Transmit._receive(sock, cls.n_prefix_bytes)
-
-
-            if len(prefix_bytes) < cls.n_prefix_bytes:
-                raise ConnectionError(
-                    f"Incomplete size data received, "
-                    f"only read {len(prefix_bytes)} bytes.")
-
-            size = cls._unpack_size(prefix_bytes)
+            size = cls.read_size(sock)
             if size == cls.end_of_transmission:
                 return None
 
-            payload = cls._receive(sock, size)
-
-            return payload
+            return cls._receive(sock, size)
 
         except Exception as e:
-            print(f"Error: {e}")
-            sock.close()
-            print('socket closed by exception in Transmit.read_from_socket')
+            cls._close_on_error(sock, e)
             raise
 
+    @classmethod
+    def read_size(cls, sock: socket.socket, prefix: Optional[bytearray] = None) -> int:
+        """
+        Read just the size prefix of the next frame.
+        Pass in a (reusable) prefix buffer to avoid allocating one per frame.
+        """
+        if prefix is None:
+            prefix = bytearray(cls.n_prefix_bytes)
+        cls._receive_into(sock, memoryview(prefix))
+        size = cls._unpack_size(prefix)
+        if size == cls.server_busy:
+            raise ServerBusyError("Server is busy and rejected the request")
+        return size
+
     @classmethod
     def end_transmission(cls, sock: socket.socket):
-        sentinel = struct.pack(cls.size_prefix_type, cls.end_of_transmission)
-        sock.sendall(sentinel) 
+        cls._send_buffers(sock, [cls._pack_size(cls.end_of_transmission)])
+
+    @classmethod
+    def send_busy(cls, sock: socket.socket):
+        """
+        Tell the peer this request was rejected because we are saturated.
+        """
+        cls._send_buffers(sock, [cls._pack_size(cls.server_busy)])
+
+    @classmethod
+    def send_options(cls, sock: socket.socket, options: Dict) -> None:
+        payload = cls._encode_options(options)
+        cls._send_buffers(sock, [cls._pack_size(cls.options),
+                                 cls._pack_size(len(payload)), payload])
+
+    @classmethod
+    def read_options(cls, sock: socket.socket) -> Dict:
+        """
+        Read an options frame (control prefix included).
+        """
+        size = cls.read_size(sock)
+        if size != cls.options:
+            raise ConnectionError(f"Expected an options frame, got prefix {size:#x}")
+        return cls._decode_options(cls._receive(sock, cls.read_size(sock)))
+
+    @classmethod
+    def peek_size(cls, sock: socket.socket) -> Optional[int]:
+        """
+        Return the next size prefix without consuming it (None if the
+        peer hung up), e.g. to look for a control code opening a request.
+        """
+        n = cls.n_prefix_bytes
+        try:
+            prefix = sock.recv(n, socket.MSG_PEEK | getattr(socket, 'MSG_WAITALL', 0))
+        except OSError:
+            return None
+        if len(prefix) < n:
+            return None
+        return cls._unpack_size(prefix)
+
+    @staticmethod
+    def _encode_options(options: Dict) -> bytes:
+        return json.dumps(options).encode('utf-8')
+
+    @staticmethod
+    def _decode_options(payload: bytes) -> Dict:
+        return json.loads(bytes(payload).decode('utf-8'))
+
+    @staticmethod
+    def set_nodelay(sock: socket.socket) -> None:
+        """
+        Disable Nagle's algorithm, so small frames (tokens, mic chunks)
+        are not held back waiting for an ACK. No-op for non-TCP sockets.
+        """
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
 
     @classmethod
-    def _receive(cls, sock: socket.socket, size: int):
+    def _send_buffers(cls, sock: socket.socket, buffers: List[bytes]) -> None:
+        """
+        Write every buffer in order with scatter/gather I/O (sendmsg),
+        so a size prefix and its payload go out without being joined.
+        """
+        if not hasattr(sock, 'sendmsg'): # e.g. Windows
+            sock.sendall(b''.join(buffers))
+            return
+
+        views = [memoryview(b).cast('B') for b in buffers]
+        ix = 0
+        while ix < len(views):
+            n = sock.sendmsg(views[ix:ix+cls.max_iov])
+            # advance past fully-sent buffers, then trim a partial one
+            while ix < len(views) and n >= len(views[ix]):
+                n -= len(views[ix])
+                ix += 1
+            if n:
+                views[ix] = views[ix][n:]
+
+    @classmethod
+    def _receive(cls, sock: socket.socket, size: int) -> bytearray:
         """
         Read arg::size bytes from arg::sock to receive complete payload.
         """
-        chunks = []
+        payload = bytearray(size)
+        cls._receive_into(sock, memoryview(payload))
+        return payload
+
+    @classmethod
+    def _receive_into(cls, sock: socket.socket, view: memoryview) -> None:
+        """
+        Fill arg::view completely from arg::sock, using recv_into so the
+        kernel copies straight into the destination buffer.
+        """
+        size = len(view)
         bytes_read = 0
 
         while bytes_read < size:
-            bytes_remaining = size - bytes_read
-            if bytes_remaining == 0:
-                break
-
-            chunk = sock.recv(min(4096, bytes_remaining))
-            if not chunk:
+            n = sock.recv_into(view[bytes_read:])
+            if not n:
                 raise ConnectionError("Connection closed before receiving full payload")
+            bytes_read += n
 
-            bytes_read += len(chunk)
-            chunks.append(chunk)
-
-        return b''.join(chunks) 
+    @classmethod
+    def _close_on_error(cls, sock: socket.socket, e: Exception) -> None:
+        print(f"Error: {e}")
+        sock.close()
+        print('socket closed by exception in Transmit.read_from_socket')
 
     @classmethod
     def _unpack_size(cls, size_prefix: bytes) -> int:
@@ -84,10 +204,304 @@ class Transmit:
         return struct.unpack(cls.size_prefix_type, size_prefix)[0]
 
     @classmethod
-    def _prepend_size(cls, payload: bytes) -> bytes:
+    def _pack_size(cls, size: int) -> bytes:
         """
         Use prior to sending over network socket.
-        Return the payoad with its size (in number of bytes) prepended.
+        Return the size prefix to be sent ahead of a payload of arg::size bytes.
+        """
+        return struct.pack(cls.size_prefix_type, size)
+
+
+class FrameStats:
+    """
+    Frame and payload byte counts for one request. Plain attributes, as
+    each is updated by a single thread; see metrics.ServerMetrics.
+    """
+    __slots__ = ('frames_in', 'bytes_in', 'frames_out', 'bytes_out')
+
+    def __init__(self):
+        self.frames_in = 0
+        self.bytes_in = 0
+        self.frames_out = 0
+        self.bytes_out = 0
+
+
+class FrameReader:
+    """
+    Receive engine for Transmit frames on a single socket.
+
+    Payloads are read with recv_into into a reusable arena (a bytearray
+    that only ever grows), so steady-state reads allocate nothing.
+
+    Usage:
+        reader = FrameReader(sock)
+        view = reader.read_view()       # memoryview into the arena, valid
+                                        #   until the next read on reader
+        n = reader.read_into(buffer)    # fill a caller-supplied buffer
+        data = reader.read()            # an owned bytearray copy
+    Each returns None at end of transmission.
+    Pass a FrameStats to count the frames and bytes read.
+    """
+    def __init__(self, sock: socket.socket, initial_size: int = CHUNK_SIZE,
+                       stats: Optional[FrameStats] = None):
+        self.sock = sock
+        self.stats = stats
+        self._prefix = bytearray(Transmit.n_prefix_bytes)
+        self._arena = bytearray(initial_size)
+
+    def read_size(self) -> Optional[int]:
+        """
+        Read the next size prefix. Returns None at end of transmission.
+        """
+        try:
+            size = Transmit.read_size(self.sock, self._prefix)
+        except Exception as e:
+            Transmit._close_on_error(self.sock, e)
+            raise
+        if size == Transmit.end_of_transmission:
+            return None
+        if self.stats is not None:
+            self.stats.frames_in += 1
+            self.stats.bytes_in += size
+        return size
+
+    def read_payload_into(self, view: memoryview) -> None:
+        """
+        Fill arg::view with the payload of a frame whose size was just read.
+        """
+        try:
+            Transmit._receive_into(self.sock, view)
+        except Exception as e:
+            Transmit._close_on_error(self.sock, e)
+            raise
+
+    def read_view(self) -> Optional[memoryview]:
+        size = self.read_size()
+        if size is None:
+            return None
+        if size > len(self._arena):
+            # Replace rather than resize: views handed out earlier keep
+            # the old arena alive, and resizing an exported buffer fails.
+            self._arena = bytearray(max(size, 2 * len(self._arena)))
+        view = memoryview(self._arena)[:size]
+        self.read_payload_into(view)
+        return view
+
+    def read_into(self, buffer) -> Optional[int]:
+        """
+        Read the next payload into the start of arg::buffer (any writable
+        bytes-like object). Returns the number of bytes written.
+        """
+        size = self.read_size()
+        if size is None:
+            return None
+        view = memoryview(buffer).cast('B')
+        if size > len(view):
+            raise ValueError(f"Frame of {size} bytes does not fit in "
+                             f"buffer of {len(view)} bytes")
+        self.read_payload_into(view[:size])
+        return size
+
+    def read(self) -> Optional[bytearray]:
+        size = self.read_size()
+        if size is None:
+            return None
+        payload = bytearray(size)
+        self.read_payload_into(memoryview(payload))
+        return payload
+
+
+class FrameWriter:
+    """
+    Send engine for Transmit frames on a single socket.
+
+    Each frame is written as [size prefix, payload] with sendmsg, so the
+    payload is never copied just to prepend its size. TCP_NODELAY is set.
+
+    With coalesce_bytes > 0, small frames are held and written together
+    in one syscall once either coalesce_bytes are pending, or the oldest
+    pending frame has waited coalesce_delay_us microseconds. Payloads must
+    not be mutated by the caller until they have been flushed.
+
+    Usage:
+        writer = FrameWriter(sock, coalesce_bytes=16384)
+        writer.send(payload)
+        writer.end_transmission()   # flushes anything pending
+    Pass a FrameStats to count the frames and bytes sent.
+    """
+    def __init__(self, sock: socket.socket,
+                       coalesce_bytes: int = 0,
+                       coalesce_delay_us: int = COALESCE_DELAY_US,
+                       stats: Optional[FrameStats] = None):
+        self.sock = sock
+        self.stats = stats
+        self.coalesce_bytes = coalesce_bytes
+        self.coalesce_delay = coalesce_delay_us / 1e6
+        Transmit.set_nodelay(sock)
+
+        self._lock = threading.Condition()
+        self._pending = []
+        self._pending_bytes = 0
+        self._deadline = None
+        self._error = None
+        self._closed = False
+        self._flusher = None
+
+    @property
+    def coalescing(self) -> bool:
+        return self.coalesce_bytes > 0
+
+    def send(self, payload: bytes) -> None:
+        prefix = Transmit._pack_size(len(payload))
+        if self.stats is not None:
+            self.stats.frames_out += 1
+            self.stats.bytes_out += len(payload)
+        if not self.coalescing:
+            Transmit._send_buffers(self.sock, [prefix, payload])
+            return
+
+        with self._lock:
+            self._raise_pending_error()
+            self._pending.append(prefix)
+            self._pending.append(payload)
+            self._pending_bytes += len(prefix) + len(payload)
+            if self._pending_bytes >= self.coalesce_bytes:
+                self._flush()
+            elif self._deadline is None:
+                self._deadline = time.monotonic() + self.coalesce_delay
+                self._start_flusher()
+                self._lock.notify()
+
+    def end_transmission(self) -> None:
+        prefix = Transmit._pack_size(Transmit.end_of_transmission)
+        if not self.coalescing:
+            Transmit._send_buffers(self.sock, [prefix])
+            return
+
+        with self._lock:
+            self._raise_pending_error()
+            self._pending.append(prefix)
+            self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._raise_pending_error()
+            self._flush()
+
+    def close(self) -> None:
+        """
+        Flush pending frames and stop the background flusher.
+        Does not close the socket.
+        """
+        with self._lock:
+            if self._pending and self._error is None:
+                self._flush()
+            self._closed = True
+            self._lock.notify()
+
+    def _flush(self) -> None:
+        """
+        Write all pending frames in one vectored send. Caller holds the lock.
+        """
+        buffers, self._pending = self._pending, []
+        self._pending_bytes = 0
+        self._deadline = None
+        if buffers:
+            Transmit._send_buffers(self.sock, buffers)
+
+    def _raise_pending_error(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def _start_flusher(self) -> None:
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop,
+                                             name='[frame-writer-flush]',
+                                             daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self) -> None:
+        """
+        Background thread: flush frames whose delay budget has run out.
+        """
+        with self._lock:
+            while not self._closed:
+                if self._deadline is None:
+                    self._lock.wait()
+                    continue
+                remaining = self._deadline - time.monotonic()
+                if remaining > 0:
+                    self._lock.wait(remaining)
+                    continue
+                try:
+                    self._flush()
+                except Exception as e:
+                    # surface the error on the sender's next call
+                    self._error = e
+                    return
+
+
+class BufferedFrameReader:
+    """
+    Reads Transmit frames on a background thread into a bounded queue,
+    so that frames can be consumed (iterated) while the consumer's own
+    thread is busy writing. Iteration ends at end of transmission, and
+    re-raises any error the reader thread hit.
+
+    When max_pending frames are buffered, the reader thread stops reading,
+    which in turn pushes back on the sender through TCP flow control.
+    """
+    _end = object()
+
+    def __init__(self, sock: socket.socket, max_pending: int = 64, name: str = 'reader',
+                       stats: Optional[FrameStats] = None):
+        self.reader = FrameReader(sock, stats=stats)
+        self.q = queue.Queue(maxsize=max_pending)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._read_loop, name=name, daemon=True)
+        self._thread.start()
+
+    def __iter__(self):
+        while True:
+            item = self.q.get()
+            if item is self._end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self) -> None:
         """
-        return struct.pack(cls.size_prefix_type, len(payload)) + payload
-        
+        Stop buffering. Frames still arriving are discarded, up to end of
+        transmission.
+        """
+        self._closed.set()
+        while True: # unblock the reader if it is waiting on a full queue
+            try:
+                self.q.get_nowait()
+            except queue.Empty:
+                break
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the reader to reach end of transmission (or an error).
+        False if arg::timeout expired first.
+        """
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def _read_loop(self) -> None:
+        try:
+            while (frame := self.reader.read()) is not None:
+                self._put(frame)
+            self._put(self._end)
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item) -> None:
+        while not self._closed.is_set():
+            try:
+                self.q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
@@ -0,0 +1,477 @@
+"""
+Transports: how Client and Server sockets are created.
+
+    TcpTransport(host, port)  : AF_INET stream sockets (the default).
+    UnixTransport(path)       : AF_UNIX stream sockets, for services on
+                                the same host as the orchestrator.
+    ShmTransport(path)        : a shared-memory ring buffer per direction,
+                                with an AF_UNIX control channel.
+
+Every transport yields socket-like objects that speak the same byte
+stream, so Transmit, FrameReader/FrameWriter and every Server variant
+work on them unchanged.
+
+Usage:
+    server = SpeechToTextServer(transport=UnixTransport('/tmp/stt.sock'))
+    client = Client(transport=UnixTransport('/tmp/stt.sock'))
+"""
+from typing import Optional, Tuple
+import json
+import os
+import queue
+import socket
+import stat
+import struct
+import threading
+import time
+from multiprocessing import shared_memory, resource_tracker
+from ..config import HOST, PORT, SHM_RING_SIZE, SHM_HANDSHAKE_TIMEOUT
+from .structures import Transmit
+
+# plain ints: bitwise ops on the socket.MsgFlag enum are slow per frame
+_MSG_PEEK = int(socket.MSG_PEEK)
+_MSG_WAITALL = int(getattr(socket, 'MSG_WAITALL', 0))
+
+class TcpTransport:
+    def __init__(self, host: str = HOST, port: int = PORT):
+        self.host = host
+        self.port = port
+
+    def __str__(self):
+        return f"{self.host}:{self.port}"
+
+    def listen(self, backlog: int):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+        # Avoid the error when restarting server by setting SO_REUSEADDR flag:
+        #   OSError: [Errno 48] Address already in use
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        server_socket.bind((self.host, self.port))
+        server_socket.listen(backlog)
+        return server_socket
+
+    def connect(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect((self.host, self.port))
+        return sock
+
+    def local(self) -> 'TcpTransport':
+        """
+        Transport for connecting to our own listener (e.g. a shutdown
+        sentinel), which may be bound to all interfaces.
+        """
+        return TcpTransport('localhost', self.port)
+
+    def cleanup(self) -> None:
+        """
+        Called once the listener is no longer accepting.
+        """
+
+
+class UnixTransport:
+    def __init__(self, path: str):
+        self.path = path
+
+    def __str__(self):
+        return f"unix:{self.path}"
+
+    def listen(self, backlog: int):
+        self._remove_stale_socket()
+        server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server_socket.bind(self.path)
+        server_socket.listen(backlog)
+        return server_socket
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock
+
+    def local(self) -> 'UnixTransport':
+        return self
+
+    def cleanup(self) -> None:
+        self._remove_stale_socket()
+
+    def _remove_stale_socket(self) -> None:
+        """
+        A socket file left behind by a previous run makes bind() fail.
+        """
+        try:
+            if stat.S_ISSOCK(os.stat(self.path).st_mode):
+                os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class ShmTransport(UnixTransport):
+    """
+    Frames are copied through a shared-memory ring (one per direction)
+    instead of the kernel's socket buffers; the AF_UNIX control channel
+    only carries small "bytes written" / "bytes consumed" counters.
+    Worth it for large payloads (e.g. whole utterances of audio).
+
+    The connecting side creates the rings (ring_size bytes each) and
+    sends their names to the server, then unlinks them once the server
+    has attached: nothing is left behind in /dev/shm, even after a crash.
+    """
+    def __init__(self, path: str, ring_size: int = SHM_RING_SIZE):
+        super().__init__(path)
+        self.ring_size = ring_size
+
+    def __str__(self):
+        return f"shm:{self.path}"
+
+    def listen(self, backlog: int) -> 'ShmListener':
+        return ShmListener(super().listen(backlog))
+
+    def connect(self) -> 'ShmSocket':
+        return ShmSocket.connect(super().connect(), self.ring_size)
+
+
+class ShmListener:
+    """
+    Listening end of an ShmTransport: a background thread accepts control
+    connections, and attaches to the rings each client announces on its
+    own short-lived thread, so a slow or silent client only holds up its
+    own handshake. accept() returns the connections that completed one.
+    """
+    def __init__(self, server_socket: socket.socket):
+        self.server_socket = server_socket
+        self._ready = queue.Queue()
+        threading.Thread(target=self._accept_loop, name='[ShmListener]', daemon=True).start()
+
+    def accept(self) -> Tuple['ShmSocket', str]:
+        connection = self._ready.get()
+        if connection is None:
+            raise OSError("ShmListener is closed")
+        return connection
+
+    def close(self) -> None:
+        try:
+            self.server_socket.shutdown(socket.SHUT_RDWR) # wakes _accept_loop
+        except OSError:
+            pass
+        self.server_socket.close()
+        self._ready.put(None)
+
+    def _accept_loop(self) -> None:
+        try:
+            while True:
+                control, address = self.server_socket.accept()
+                threading.Thread(target=self._handshake, args=(control, address or 'shm'),
+                                 name='[ShmListener handshake]', daemon=True).start()
+        except OSError:
+            pass # closed
+        finally:
+            self._ready.put(None)
+
+    def _handshake(self, control: socket.socket, address: str) -> None:
+        try:
+            self._ready.put((ShmSocket.accept(control), address))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Shared-memory handshake failed: {e}")
+            control.close()
+
+
+class ShmSocket:
+    """
+    Socket-like byte stream over two shared-memory rings.
+
+    Implements the subset of the socket API that Transmit, FrameReader,
+    FrameWriter and the servers use: sendmsg/sendall, recv/recv_into
+    (including MSG_PEEK), timeouts, shutdown and close.
+
+    Positions are running byte counts. After writing into its tx ring, a
+    side sends its new "written" count over the control channel; after
+    reading, it periodically sends its "consumed" count, which frees
+    space in the peer's ring. There is no reader thread: whichever
+    thread is waiting for progress reads the control channel itself
+    (others wait for it), which saves a thread wake-up per frame.
+    """
+    control_type = '!BQ' # message kind, running byte count
+    n_control_bytes = struct.calcsize(control_type)
+    WRITTEN = 0
+    CONSUMED = 1
+
+    def __init__(self, control: socket.socket,
+                       tx: shared_memory.SharedMemory,
+                       rx: shared_memory.SharedMemory,
+                       ring_size: int):
+        self.control = control
+        self.ring_size = ring_size
+        self._tx = tx
+        self._rx = rx
+        self._timeout = None
+
+        self._cond = threading.Condition() # guards counters and ring copies
+        self._send_lock = threading.Lock()
+        self._control_lock = threading.Lock()
+        self._written = 0     # into tx, by us
+        self._tx_consumed = 0 # from tx, by the peer
+        self._rx_written = 0  # into rx, by the peer
+        self._consumed = 0    # from rx, by us
+        self._acked = 0       # last consumed count sent to the peer
+        self._polling = False # a thread is reading the control channel
+        self._control_buffer = bytearray(64 * self.n_control_bytes)
+        self._control_pending = 0 # bytes of a partial control message
+        self._peer_closed = False
+        self._closed = False
+
+    @classmethod
+    def connect(cls, control: socket.socket, ring_size: int) -> 'ShmSocket':
+        """
+        Client side of the handshake, on a freshly connected control socket.
+        """
+        c2s = shared_memory.SharedMemory(create=True, size=ring_size)
+        s2c = shared_memory.SharedMemory(create=True, size=ring_size)
+        try:
+            control.settimeout(SHM_HANDSHAKE_TIMEOUT)
+            hello = dict(c2s=c2s.name, s2c=s2c.name, ring_size=ring_size,
+                         pid=os.getpid())
+            Transmit.send_over_socket(control, json.dumps(hello).encode('utf-8'))
+            ack = Transmit._receive(control, Transmit.read_size(control))
+            if ack != b'ok':
+                raise ConnectionError(f"Shared-memory handshake refused: {bytes(ack)!r}")
+            control.settimeout(None)
+        except BaseException:
+            control.close()
+            cls._release(c2s, unlink=True)
+            cls._release(s2c, unlink=True)
+            raise
+        # Both sides are mapped: drop the names (mappings stay valid).
+        c2s.unlink()
+        s2c.unlink()
+        return cls(control, tx=c2s, rx=s2c, ring_size=ring_size)
+
+    @classmethod
+    def accept(cls, control: socket.socket) -> 'ShmSocket':
+        """
+        Server side of the handshake, on a freshly accepted control socket.
+        """
+        control.settimeout(SHM_HANDSHAKE_TIMEOUT)
+        hello = json.loads(bytes(Transmit._receive(control, Transmit.read_size(control))))
+        untrack = hello.get('pid') != os.getpid()
+        c2s = cls._attach(hello['c2s'], untrack)
+        s2c = cls._attach(hello['s2c'], untrack)
+        Transmit.send_over_socket(control, b'ok')
+        control.settimeout(None)
+        return cls(control, tx=s2c, rx=c2s, ring_size=hello['ring_size'])
+
+    @staticmethod
+    def _attach(name: str, untrack: bool) -> shared_memory.SharedMemory:
+        shm = shared_memory.SharedMemory(name=name)
+        # The creator owns the segment; don't let this process's resource
+        # tracker unlink it (or warn about it) at exit. Within a single
+        # process the tracker registration is the creator's own.
+        if untrack:
+            try:
+                resource_tracker.unregister(shm._name, 'shared_memory')
+            except Exception:
+                pass
+        return shm
+
+    @staticmethod
+    def _release(shm: shared_memory.SharedMemory, unlink: bool = False) -> None:
+        try:
+            shm.close()
+        except BufferError:
+            pass # a view is still exported; the mapping goes with it
+        if unlink:
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    # -- socket API --
+
+    def fileno(self) -> int:
+        return self.control.fileno()
+
+    def gettimeout(self) -> Optional[float]:
+        return self._timeout
+
+    def settimeout(self, timeout: Optional[float]) -> None:
+        self._timeout = timeout
+        self.control.settimeout(timeout)
+
+    def setsockopt(self, *args) -> None:
+        raise OSError("ShmSocket has no socket options")
+
+    def sendall(self, data) -> None:
+        self.sendmsg([data])
+
+    def send(self, data) -> int:
+        return self.sendmsg([data])
+
+    def sendmsg(self, buffers) -> int:
+        """
+        Copy every buffer into the tx ring, waiting for the peer to free
+        space as needed. Unlike a socket, never returns a partial count.
+        """
+        total = 0
+        with self._send_lock:
+            for buffer in buffers:
+                view = memoryview(buffer).cast('B')
+                while len(view):
+                    with self._cond:
+                        self._wait(lambda: self._written - self._tx_consumed < self.ring_size,
+                                   writing=True)
+                        free = self.ring_size - (self._written - self._tx_consumed)
+                        # publish large writes in pieces, so the peer can
+                        # start copying out while we copy in
+                        n = min(free, len(view), self.ring_size // 4)
+                        self._copy_in(view[:n])
+                        self._written += n
+                    view = view[n:]
+                    total += n
+                    if len(view):
+                        self._send_control(self.WRITTEN, self._written)
+            self._send_control(self.WRITTEN, self._written)
+        return total
+
+    def recv_into(self, buffer, nbytes: int = 0, flags: int = 0) -> int:
+        view = memoryview(buffer).cast('B')
+        if nbytes:
+            view = view[:nbytes]
+        if not len(view):
+            return 0
+        with self._cond:
+            self._wait(lambda: self._rx_written > self._consumed)
+            n = min(len(view), self._rx_written - self._consumed)
+            if not n:
+                return 0 # peer closed and everything has been read
+            self._copy_out(view[:n])
+            if flags & _MSG_PEEK:
+                return n
+            self._consumed += n
+            ack = self._consumed - self._acked >= self.ring_size // 4
+            if ack:
+                self._acked = self._consumed
+        if ack:
+            try:
+                self._send_control(self.CONSUMED, self._acked)
+            except OSError:
+                pass # peer is gone, and needs no more space
+        return n
+
+    def recv(self, bufsize: int, flags: int = 0) -> bytes:
+        if flags & _MSG_PEEK and flags & _MSG_WAITALL:
+            with self._cond:
+                self._wait(lambda: self._rx_written - self._consumed >= bufsize)
+        buffer = bytearray(bufsize)
+        n = self.recv_into(buffer, bufsize, flags)
+        return bytes(buffer[:n])
+
+    def shutdown(self, how: int) -> None:
+        if how in (socket.SHUT_WR, socket.SHUT_RDWR):
+            self._ack_all()
+        self.control.shutdown(how)
+
+    def close(self) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._ack_all()
+        try:
+            self.control.shutdown(socket.SHUT_RDWR) # wakes a polling thread
+        except OSError:
+            pass
+        self.control.close()
+        self._release(self._tx)
+        self._release(self._rx)
+
+    # -- internals --
+
+    def _wait(self, ready, writing: bool = False) -> None:
+        """
+        Wait (holding self._cond) until ready() or the stream is over.
+        """
+        done = lambda: ready() or self._closed or self._peer_closed
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        while not done():
+            if not self._polling:
+                self._poll()
+                if self._timeout == 0 and not done():
+                    raise BlockingIOError("Resource temporarily unavailable")
+                continue
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise socket.timeout("timed out")
+            self._cond.wait(remaining)
+        if self._closed:
+            raise OSError("ShmSocket is closed")
+        if writing and not ready():
+            raise BrokenPipeError("Peer closed the shared-memory stream")
+
+    def _copy_in(self, view: memoryview) -> None:
+        start = self._written % self.ring_size
+        first = min(len(view), self.ring_size - start)
+        self._tx.buf[start:start+first] = view[:first]
+        if first < len(view):
+            self._tx.buf[:len(view)-first] = view[first:]
+
+    def _copy_out(self, view: memoryview) -> None:
+        start = self._consumed % self.ring_size
+        first = min(len(view), self.ring_size - start)
+        view[:first] = self._rx.buf[start:start+first]
+        if first < len(view):
+            view[first:] = self._rx.buf[:len(view)-first]
+
+    def _send_control(self, kind: int, count: int) -> None:
+        with self._control_lock:
+            self.control.sendall(struct.pack(self.control_type, kind, count))
+
+    def _ack_all(self) -> None:
+        """
+        Report everything consumed so far, so a blocked peer can finish.
+        """
+        with self._cond:
+            pending = self._consumed > self._acked
+            self._acked = self._consumed
+        if pending:
+            try:
+                self._send_control(self.CONSUMED, self._acked)
+            except OSError:
+                pass
+
+    def _poll(self) -> None:
+        """
+        Read whatever control messages arrive next, and apply them. Called
+        holding self._cond, which is released while blocked on the socket.
+        """
+        self._polling = True
+        self._cond.release()
+        try:
+            buffer = memoryview(self._control_buffer)
+            n = self.control.recv_into(buffer[self._control_pending:])
+        except (BlockingIOError, socket.timeout):
+            n = None # nothing yet: the caller checks its timeout
+        except OSError:
+            n = 0
+        finally:
+            self._cond.acquire()
+            self._polling = False
+            self._cond.notify_all()
+
+        if n is None:
+            if self._timeout:
+                raise socket.timeout("timed out")
+            return
+        if n == 0:
+            self._peer_closed = True
+            return
+
+        n += self._control_pending
+        n_complete = n - n % self.n_control_bytes
+        for kind, count in struct.iter_unpack(self.control_type,
+                                              self._control_buffer[:n_complete]):
+            if kind == self.WRITTEN:
+                self._rx_written = max(self._rx_written, count)
+            else:
+                self._tx_consumed = max(self._tx_consumed, count)
+        self._control_pending = n - n_complete
+        self._control_buffer[:self._control_pending] = self._control_buffer[n_complete:n]
@@ -1,6 +1,8 @@
 from .speech_to_text import SpeechToTextServer
-from ..config import PORT
+from .streaming import StreamingSpeechToTextServer
+from ..config import PORT, STT_STREAMING
 
 if __name__ == "__main__":
-    server = SpeechToTextServer(host='', port=PORT)
+    server_cls = StreamingSpeechToTextServer if STT_STREAMING else SpeechToTextServer
+    server = server_cls(host='', port=PORT)
     server.serve()
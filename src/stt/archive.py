@@ -0,0 +1,229 @@
+"""
+Archive of the audio a speech-to-text server receives, written to disk in
+the background so that no request ever waits on the disk.
+
+archive() only puts the request's bytes on a bounded queue, and returns
+at once. If the queue is full (the disk is slow, or failing), the copy is
+dropped and counted instead. A writer thread decodes each request to
+16-bit PCM and saves it under a unique name, optionally compressed:
+
+    compress=None    : name.wav
+    compress='gzip'  : name.wav.gz, in the writer thread
+    compress='mp3'   : name.mp3 (or any encoding.FORMATS key), encoded by
+                       the shared EncoderPool; the WAV is removed once done
+
+Retention: after each write (and at least every minute), the oldest files
+are deleted while the archive holds more than max_bytes, or files older
+than max_age_s. Files already in the directory at start-up count.
+
+Main public API usage:
+    archive = AudioArchive('stt_archive', compress='gzip', max_bytes=1 << 30)
+    archive.archive(audio) # float32 array, or encoded bytes and codec name; never blocks
+    archive.stats()
+    archive.close()
+"""
+from typing import Optional
+import collections
+import gzip
+import itertools
+import os
+import queue
+import threading
+import time
+import numpy as np
+from ..config import (STT_ARCHIVE_DIR, STT_ARCHIVE_QUEUE, STT_ARCHIVE_COMPRESS,
+                      STT_ARCHIVE_MAX_BYTES, STT_ARCHIVE_MAX_AGE)
+from ..utils import save_wav, get_codec
+from ..utils.encoding import FORMATS, get_encoder_pool
+
+SUFFIXES = ('.wav', '.wav.gz') + tuple('.' + fmt for fmt in FORMATS)
+_ids = itertools.count() # shared, so archives in one directory never collide
+
+class AudioArchive:
+    """
+    See the module docstring. arg::max_queue is in requests; arg::max_bytes
+    and arg::max_age_s may be None for no limit. If a registry (see
+    network/metrics.py) is given, archived, dropped and evicted requests
+    and write errors are counted in it.
+    """
+    _stop = object()
+
+    def __init__(self, directory=STT_ARCHIVE_DIR,
+                       max_queue=STT_ARCHIVE_QUEUE,
+                       compress: Optional[str] = STT_ARCHIVE_COMPRESS,
+                       max_bytes: Optional[int] = STT_ARCHIVE_MAX_BYTES,
+                       max_age_s: Optional[float] = STT_ARCHIVE_MAX_AGE,
+                       prefix='utterance',
+                       registry=None):
+        if compress not in (None, 'gzip') and compress not in FORMATS:
+            raise ValueError(f"Unsupported compression {compress!r}: "
+                             f"use None, 'gzip' or one of {tuple(FORMATS)}")
+        self.directory = directory
+        self.compress = compress
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.prefix = prefix
+        os.makedirs(directory, exist_ok=True)
+
+        self.q = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()  # self.files, self.total_bytes
+        self.files = collections.OrderedDict() # path -> (mtime, size), oldest first
+        self.total_bytes = 0
+        self.written = self.dropped = self.evicted = self.errors = 0
+        self._scan()
+
+        self.counters = None
+        if registry is not None:
+            self.counters = {name: registry.counter(f'stt_archive_{name}_total', help)
+                             for name, help in (('written', 'Requests archived'),
+                                                ('dropped', 'Archive copies dropped: queue full'),
+                                                ('evicted', 'Archived files deleted by retention'),
+                                                ('errors', 'Archive write errors'))}
+        self._thread = threading.Thread(target=self._work, name='[stt archive]', daemon=True)
+        self._thread.start()
+
+    def archive(self, message, codec_name='pcm16') -> bool:
+        """
+        Queue arg::message for writing: normalized float32 samples, or
+        bytes encoded with arg::codec_name. False if it was dropped.
+        """
+        try:
+            self.q.put_nowait((message, codec_name, time.time()))
+            return True
+        except queue.Full:
+            self._count('dropped')
+            return False
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Write what is queued, then stop, waiting at most arg::timeout
+        seconds in all (None: for as long as it takes). What is not
+        written by then is lost with the (daemon) writer thread.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            self.q.put(self._stop, timeout=timeout)
+        except queue.Full:
+            print(f"Audio archive still busy after {timeout} s: "
+                  f"not waiting for {self.q.qsize()} queued recordings")
+            return
+        self._thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def stats(self):
+        with self._lock:
+            return dict(queued=self.q.qsize(), written=self.written, dropped=self.dropped,
+                        evicted=self.evicted, errors=self.errors,
+                        files=len(self.files), bytes=self.total_bytes)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+        if self.counters is not None:
+            self.counters[name].inc(n)
+
+    def _work(self):
+        while True:
+            try:
+                item = self.q.get(timeout=60)
+            except queue.Empty:
+                self._evict()
+                continue
+            if item is self._stop:
+                return
+            try:
+                self._write(*item)
+            except Exception as e: # e.g. disk full: the copy is lost, requests are not
+                self._count('errors')
+                print(f"Error archiving audio: {e!r}")
+            self._evict()
+
+    def _write(self, message, codec_name, received):
+        if isinstance(message, np.ndarray):
+            # clip first: a float just over full scale would wrap around
+            full_scale = np.iinfo(np.int16).max
+            pcm = np.rint(np.clip(message, -1, 1) * full_scale).astype(np.int16)
+        else:
+            codec = get_codec(codec_name)
+            pcm = message if codec.name == 'pcm16' else codec.decode_int16(message)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(received))
+        path = os.path.join(self.directory, f'{self.prefix}-{stamp}-{os.getpid()}-{next(_ids):06d}.wav')
+        if self.compress == 'gzip':
+            path += '.gz'
+        tmp = path + '.part' # so a failed write never leaves a partial file behind
+        try:
+            with open(tmp, 'wb') as f:
+                if self.compress == 'gzip':
+                    with gzip.GzipFile(os.path.basename(path[:-3]), 'wb', 1, f) as gz:
+                        save_wav(pcm, gz)
+                else:
+                    save_wav(pcm, f)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self._add(path)
+        self._count('written')
+        if self.compress in FORMATS:
+            job = get_encoder_pool().submit(path, self.compress)
+            job.add_done_callback(lambda job, wav=path: self._encoded(wav, job))
+
+    def _encoded(self, wav_path, job):
+        try:
+            out_path = job.result()
+        except Exception as e:
+            self._count('errors')
+            print(f"Error encoding archived audio (kept {wav_path}): {e!r}")
+            return
+        self._add(out_path)
+        self._remove(wav_path)
+
+    def _add(self, path):
+        st = os.stat(path)
+        with self._lock:
+            self.files[path] = (st.st_mtime, st.st_size)
+            self.total_bytes += st.st_size
+
+    def _remove(self, path) -> bool:
+        with self._lock:
+            entry = self.files.pop(path, None)
+            if entry is not None:
+                self.total_bytes -= entry[1]
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error removing archived audio {path}: {e!r}")
+            return False
+        return entry is not None
+
+    def _evict(self):
+        cutoff = None if self.max_age_s is None else time.time() - self.max_age_s
+        while True:
+            with self._lock:
+                if not self.files:
+                    return
+                path, (mtime, _) = next(iter(self.files.items()))
+                over_size = self.max_bytes is not None and self.total_bytes > self.max_bytes
+                too_old = cutoff is not None and mtime < cutoff
+            if not (over_size or too_old):
+                return
+            if not self._remove(path):
+                return # retry at the next write
+            self._count('evicted')
+
+    def _scan(self):
+        """
+        Pick up files archived by earlier runs, oldest first.
+        """
+        existing = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(SUFFIXES):
+                st = entry.stat()
+                existing.append((st.st_mtime, entry.path, st.st_size))
+        for mtime, path, size in sorted(existing):
+            self.files[path] = (mtime, size)
+            self.total_bytes += size
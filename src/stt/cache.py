@@ -0,0 +1,236 @@
+"""
+Transcript cache, for deployments that hear the same few utterances over
+and over (e.g. a kiosk replaying a prompt).
+
+Exact mode: entries are keyed by a BLAKE2 hash of the normalized float32
+samples, the model name and the request's options, so only bit-identical
+audio hits (hashing costs well under 1 ms per second of audio).
+
+Near-duplicate mode (near=True) additionally matches audio that sounds
+the same without being identical (a re-recorded or re-encoded prompt):
+each utterance gets a coarse fingerprint, its loudness in dB per 50 ms
+frame (silence at either end trimmed, quantized to 1 dB), and a miss on
+the exact key looks for an earlier fingerprint of the same length (to
+within a frame) whose mean difference is within tolerance_db.
+
+Tiers:
+    memory : LRU, up to max_bytes (transcripts, keys and fingerprints)
+    disk   : optional, one small file per key in arg::directory, oldest
+             deleted beyond disk_max_bytes; survives restarts, and is
+             looked up by exact key only
+
+Main public API usage:
+    cache = TranscriptCache(max_bytes=16 << 20, directory='stt_cache', near=True)
+    text = cache.get(audio, context)   # None on a miss
+    cache.put(audio, context, text)
+    cache.stats()
+"""
+from typing import Optional, Tuple
+import collections
+import hashlib
+import os
+import threading
+import numpy as np
+from ..config import (AUDIO_SAMPLE_RATE, STT_CACHE_BYTES, STT_CACHE_DIR, STT_CACHE_DISK_BYTES,
+                      STT_CACHE_NEAR, STT_CACHE_TOLERANCE_DB)
+
+ENTRY_OVERHEAD = 200 # bytes of bookkeeping per entry, roughly
+
+def audio_key(audio: np.ndarray, context: str = '') -> str:
+    h = hashlib.blake2b(context.encode('utf-8'), digest_size=16)
+    h.update(np.ascontiguousarray(audio, dtype=np.float32).data)
+    return h.hexdigest()
+
+def fingerprint(audio: np.ndarray, rate=AUDIO_SAMPLE_RATE, frame_ms=50,
+                floor_db=-50.0) -> np.ndarray:
+    """
+    Loudness per frame in whole dB, with quieter frames at either end
+    trimmed (and the rest clamped to arg::floor_db). int8.
+    """
+    n = int(rate * frame_ms / 1000)
+    frames = np.asarray(audio, dtype=np.float32)[:len(audio) // n * n].reshape(-1, n)
+    power = np.einsum('ij,ij->i', frames, frames) / n
+    db = np.maximum(10 * np.log10(power + 1e-12), floor_db)
+    loud = np.flatnonzero(db > floor_db)
+    if not len(loud):
+        return np.empty(0, dtype=np.int8)
+    return np.rint(db[loud[0]:loud[-1] + 1]).astype(np.int8)
+
+
+class TranscriptCache:
+    """
+    See the module docstring. arg::context distinguishes entries that
+    must not match each other (model name, options). Thread-safe. If a
+    registry (see network/metrics.py) is given, hits (by tier) and misses
+    are counted in it.
+    """
+    def __init__(self, max_bytes: int = STT_CACHE_BYTES,
+                       directory: Optional[str] = STT_CACHE_DIR,
+                       disk_max_bytes: int = STT_CACHE_DISK_BYTES,
+                       near: bool = STT_CACHE_NEAR,
+                       tolerance_db: float = STT_CACHE_TOLERANCE_DB,
+                       registry=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.near = near
+        self.tolerance_db = tolerance_db
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict() # key -> (text, context, fingerprint, size); LRU first
+        self.n_bytes = 0
+        self.by_length = collections.defaultdict(set) # (context, n_frames) -> keys, for near matches
+        self.hits = collections.Counter() # by tier: memory, near, disk
+        self.misses = 0
+        self.disk_files = collections.OrderedDict() # path -> size, oldest first
+        self.disk_bytes = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._scan()
+        self.hit_counter = self.miss_counter = None
+        if registry is not None:
+            self.hit_counter = registry.counter('stt_cache_hits_total', 'Transcript cache hits',
+                                                label='tier')
+            self.miss_counter = registry.counter('stt_cache_misses_total', 'Transcript cache misses')
+
+    def get(self, audio: np.ndarray, context: str = '') -> Optional[str]:
+        key = audio_key(audio, context)
+        text, tier = self._lookup(key, audio, context)
+        with self.lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits[tier] += 1
+        if self.miss_counter is not None:
+            if text is None:
+                self.miss_counter.inc()
+            else:
+                self.hit_counter.inc(label_value=tier)
+        return text
+
+    def put(self, audio: np.ndarray, context: str, text: str) -> None:
+        key = audio_key(audio, context)
+        self._remember(key, context, text, fingerprint(audio) if self.near else None)
+        if self.directory is not None:
+            self._write(key, text)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.misses + sum(self.hits.values())
+            return dict(entries=len(self.entries), bytes=self.n_bytes,
+                        hits=dict(self.hits), misses=self.misses,
+                        hit_rate=round(sum(self.hits.values()) / lookups, 3) if lookups else None,
+                        disk_files=len(self.disk_files), disk_bytes=self.disk_bytes)
+
+    def _lookup(self, key, audio, context) -> Tuple[Optional[str], Optional[str]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry[0], 'memory'
+        fp = None
+        if self.near:
+            fp = fingerprint(audio)
+            text = self._near_match(fp, context)
+            if text is not None:
+                return text, 'near'
+        if self.directory is not None:
+            text = self._read(key)
+            if text is not None:
+                self._remember(key, context, text, fp)
+                return text, 'disk'
+        return None, None
+
+    def _near_match(self, fp, context) -> Optional[str]:
+        """
+        Transcript of the closest fingerprint within tolerance, if any.
+        """
+        if not len(fp):
+            return None
+        best, best_key = self.tolerance_db, None
+        with self.lock:
+            for n in (len(fp) - 1, len(fp), len(fp) + 1):
+                for key in self.by_length.get((context, n), ()):
+                    other = self.entries[key][2]
+                    m = min(len(fp), n)
+                    diff = np.abs(fp[:m].astype(np.int16) - other[:m]).mean()
+                    if diff <= best:
+                        best, best_key = diff, key
+            if best_key is None:
+                return None
+            self.entries.move_to_end(best_key)
+            return self.entries[best_key][0]
+
+    def _remember(self, key, context, text, fp) -> None:
+        size = len(text.encode('utf-8')) + (fp.nbytes if fp is not None else 0) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._forget(key)
+            self.entries[key] = (text, context, fp, size)
+            self.n_bytes += size
+            if fp is not None and len(fp):
+                self.by_length[context, len(fp)].add(key)
+            while self.n_bytes > self.max_bytes:
+                self._forget(next(iter(self.entries)))
+
+    def _forget(self, key) -> None:
+        """
+        Called with self.lock held.
+        """
+        text, context, fp, size = self.entries.pop(key)
+        self.n_bytes -= size
+        if fp is not None and len(fp):
+            keys = self.by_length[context, len(fp)]
+            keys.discard(key)
+            if not keys:
+                del self.by_length[context, len(fp)]
+
+    def _path(self, key) -> str:
+        return os.path.join(self.directory, key + '.txt')
+
+    def _read(self, key) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+            os.utime(path) # recently used: evicted last
+        except OSError:
+            return None
+        with self.lock:
+            if path in self.disk_files:
+                self.disk_files.move_to_end(path)
+        return text
+
+    def _write(self, key, text) -> None:
+        path = self._path(key)
+        data = text.encode('utf-8')
+        try:
+            with open(path + '.part', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.part', path)
+        except OSError as e:
+            print(f"Error writing transcript cache entry {path}: {e!r}")
+            return
+        evict = []
+        with self.lock:
+            self.disk_bytes -= self.disk_files.pop(path, 0)
+            self.disk_files[path] = len(data)
+            self.disk_bytes += len(data)
+            while self.disk_bytes > self.disk_max_bytes and len(self.disk_files) > 1:
+                old_path, old_size = self.disk_files.popitem(last=False)
+                self.disk_bytes -= old_size
+                evict.append(old_path)
+        for old_path in evict:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    def _scan(self):
+        existing = sorted((entry.stat().st_mtime, entry.path, entry.stat().st_size)
+                          for entry in os.scandir(self.directory)
+                          if entry.is_file() and entry.name.endswith('.txt'))
+        for _, path, size in existing:
+            self.disk_files[path] = size
+            self.disk_bytes += size
@@ -0,0 +1,301 @@
+"""
+A pool of speech-to-text worker processes, each with its own model, for
+machines with many cores: one process per model sidesteps the GIL, and
+each worker's inference threads are limited (and pinned to their own
+cores, where the OS allows) so the workers do not fight over them.
+
+Audio is handed to workers through shared memory, one segment per job:
+the parent copies the samples in once, and the worker reads them in
+place, instead of pickling them through a pipe. Only job ids, segment
+names and results go through the pipes.
+
+Each utterance goes to the worker with the least outstanding work (in
+samples queued). A worker that dies is restarted, and the jobs it held
+are sent to the other workers, once; if they crash a worker again, they
+fail with WorkerCrashedError. So do the jobs of a worker that cannot load
+its model again (it is not restarted), and, once no worker is left, every
+pending and new job.
+
+Main public API usage (same methods as Whisper):
+    pool = WhisperPool('base', workers=8)
+    text = pool.transcribe(audio)           # float32 array; thread-safe
+    pool.close()
+"""
+from typing import Callable, Dict, List, Optional
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import threading
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from ..config import WHISPER_MODEL, STT_POOL_WORKERS, STT_POOL_THREADS
+
+class WorkerCrashedError(RuntimeError):
+    pass
+
+
+def load_whisper(model_name):
+    from .speech_to_text import Whisper
+    return Whisper(model_name)
+
+def _limit_threads(cpus: List[int]) -> None:
+    """
+    Confine this (worker) process to arg::cpus, with one inference
+    thread per core. Runs before the model is imported.
+    """
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(len(cpus))
+    if hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError as e:
+            print(f"Could not pin worker to cores {cpus}: {e}")
+    try:
+        import torch
+        torch.set_num_threads(len(cpus))
+    except ImportError:
+        pass
+
+def _untrack_shared_memory() -> None:
+    """
+    Segments are created, and unlinked, by the parent: attaching to one
+    here must not register it with the resource tracker (shared with the
+    parent under spawn), or unregistering it would drop the parent's
+    registration and warn when the parent unlinks it. Workers create
+    no segments, so no shared memory is tracked from them at all.
+    """
+    register = resource_tracker.register
+    def register_others(name, rtype):
+        if rtype != 'shared_memory':
+            register(name, rtype)
+    resource_tracker.register = register_others
+
+def _worker_main(conn, model_factory, model_name, cpus):
+    _untrack_shared_memory()
+    _limit_threads(cpus)
+    model = model_factory(model_name)
+    conn.send(('ready', None, None))
+    while (job := conn.recv()) is not None:
+        job_id, method, shm_name, lengths, args = job
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            reply = ('done', job_id, _run(model, method, shm, lengths, args))
+        except Exception as e:
+            reply = ('error', job_id, e)
+        shm.close() # only once no array uses its buffer
+        try:
+            conn.send(reply)
+        except Exception as e: # e.g. an exception that cannot be pickled
+            conn.send(('error', job_id, RuntimeError(repr(reply[2]))))
+
+def _run(model, method, shm, lengths, args):
+    samples = np.ndarray((sum(lengths),), dtype=np.float32, buffer=shm.buf)
+    audios = np.split(samples, np.cumsum(lengths)[:-1])
+    return getattr(model, method)(audios if method == 'transcribe_batch' else audios[0], *args)
+
+
+class _Job:
+    __slots__ = ('id', 'method', 'shm', 'lengths', 'args', 'future', 'attempts')
+
+    def __init__(self, job_id, method, audios, args):
+        self.id = job_id
+        self.method = method
+        self.lengths = [len(a) for a in audios]
+        self.shm = shared_memory.SharedMemory(create=True, size=max(4 * sum(self.lengths), 1))
+        samples = np.ndarray((sum(self.lengths),), dtype=np.float32, buffer=self.shm.buf)
+        np.concatenate(audios, out=samples, casting='same_kind')
+        del samples
+        self.args = args
+        self.future = concurrent.futures.Future()
+        self.attempts = 0
+
+    @property
+    def work(self):
+        return sum(self.lengths)
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class _Worker:
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.jobs: Dict[int, _Job] = {}
+        self.work = 0          # samples in self.jobs
+        self.alive = False     # taking jobs
+        self.failed = False    # could not load its model: not restarted
+        self.send_lock = threading.Lock()
+
+
+class WhisperPool:
+    """
+    arg::workers processes (default: STT_POOL_WORKERS, or 1), each loading
+    arg::model_factory(arg::model_name) (default: a Whisper model) and
+    using arg::threads cores (default: an equal share of this machine's).
+    The constructor returns once every model is loaded.
+    """
+    def __init__(self, model_name=WHISPER_MODEL,
+                       workers: Optional[int] = None,
+                       threads: Optional[int] = STT_POOL_THREADS,
+                       model_factory: Callable = load_whisper):
+        self.model_name = model_name
+        self.model_factory = model_factory
+        workers = workers or STT_POOL_WORKERS or 1
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') \
+                else list(range(os.cpu_count() or 1))
+        threads = threads or max(len(cores) // workers, 1)
+        self.cpus = [[cores[(i * threads + j) % len(cores)] for j in range(threads)]
+                     for i in range(workers)]
+        self.ctx = multiprocessing.get_context('spawn') # no forking the server's threads
+        self.lock = threading.Lock()  # routing state: workers' jobs and work
+        self.ids = itertools.count()
+        self.restarts = 0
+        self.pending: List[_Job] = [] # while no worker is alive
+        self.closed = False
+        self.workers = [_Worker(i) for i in range(workers)]
+        print(f'starting {workers} speech-to-text workers ({threads} threads each)...')
+        ready = [self._start(worker) for worker in self.workers]
+        for event in ready:
+            event.wait()
+        if not all(worker.alive for worker in self.workers):
+            self.close()
+            raise RuntimeError("speech-to-text workers failed to load their models")
+        print('workers ready.')
+
+    def transcribe(self, audio_data) -> str:
+        return self.submit('transcribe', [audio_data]).result()
+
+    def transcribe_words(self, audio_data, prompt=''):
+        return self.submit('transcribe_words', [audio_data], prompt).result()
+
+    def transcribe_batch(self, audios):
+        """
+        The whole batch goes to one worker, as one model pass.
+        """
+        return self.submit('transcribe_batch', list(audios)).result()
+
+    def submit(self, method, audios, *args) -> concurrent.futures.Future:
+        job = _Job(next(self.ids), method, audios, args)
+        job.future.add_done_callback(lambda _: job.release())
+        self._dispatch(job)
+        return job.future
+
+    def outstanding(self) -> List[int]:
+        """
+        Samples queued at each worker.
+        """
+        with self.lock:
+            return [worker.work for worker in self.workers]
+
+    def close(self):
+        self.closed = True
+        for worker in self.workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send(None)
+            except OSError:
+                pass # already dead
+        for worker in self.workers:
+            worker.process.join(timeout=10)
+            if worker.process.is_alive():
+                worker.process.kill()
+
+    def _start(self, worker) -> threading.Event:
+        parent_conn, child_conn = self.ctx.Pipe()
+        worker.process = self.ctx.Process(target=_worker_main,
+                                          args=(child_conn, self.model_factory,
+                                                self.model_name, self.cpus[worker.index]),
+                                          name=f'stt-worker-{worker.index}', daemon=True)
+        worker.process.start()
+        child_conn.close()
+        with self.lock:
+            worker.conn = parent_conn
+            worker.alive = True
+            pending, self.pending = self.pending, []
+        for job in pending:
+            self._dispatch(job)
+        ready = threading.Event()
+        threading.Thread(target=self._read_results, args=(worker, parent_conn, ready),
+                         name=f'[stt worker {worker.index} results]', daemon=True).start()
+        return ready
+
+    def _dispatch(self, job):
+        with self.lock:
+            alive = [w for w in self.workers if w.alive]
+            if not alive and all(w.failed for w in self.workers):
+                job.future.set_exception(WorkerCrashedError("no speech-to-text worker is running"))
+                return
+            if not alive: # one is restarting
+                self.pending.append(job)
+                return
+            worker = min(alive, key=lambda w: w.work)
+            worker.jobs[job.id] = job
+            worker.work += job.work
+            conn = worker.conn
+        job.attempts += 1
+        try:
+            with worker.send_lock:
+                conn.send((job.id, job.method, job.shm.name, job.lengths, job.args))
+        except OSError:
+            pass # the worker died: _restart() re-routes its jobs
+
+    def _read_results(self, worker, conn, ready):
+        try:
+            while True:
+                status, job_id, result = conn.recv()
+                if status == 'ready':
+                    ready.set()
+                    continue
+                with self.lock:
+                    job = worker.jobs.pop(job_id)
+                    worker.work -= job.work
+                if status == 'done':
+                    job.future.set_result(result)
+                else:
+                    job.future.set_exception(result)
+        except (EOFError, OSError):
+            pass
+        conn.close()
+        if self.closed:
+            return
+        if not ready.is_set(): # died loading the model: restarting would not help
+            worker.process.join(timeout=1)
+            print(f"speech-to-text worker {worker.index} failed to start "
+                  f"(exit code {worker.process.exitcode}).")
+            with self.lock:
+                worker.alive = False
+                worker.failed = True
+                jobs = list(worker.jobs.values()) # re-routed here by _restart()
+                worker.jobs.clear()
+                worker.work = 0
+                if all(w.failed for w in self.workers):
+                    jobs += self.pending
+                    self.pending = []
+            ready.set()
+            for job in jobs:
+                job.future.set_exception(WorkerCrashedError(
+                    f"speech-to-text worker {worker.index} failed to restart"))
+            return
+        self._restart(worker)
+
+    def _restart(self, worker):
+        worker.process.join(timeout=1)
+        print(f"speech-to-text worker {worker.index} died "
+              f"(exit code {worker.process.exitcode}): restarting.")
+        with self.lock:
+            worker.alive = False
+            jobs = list(worker.jobs.values())
+            worker.jobs.clear()
+            worker.work = 0
+            self.restarts += 1
+        self._start(worker)
+        for job in jobs:
+            if job.attempts > 1:
+                job.future.set_exception(WorkerCrashedError(
+                    f"{job.method} crashed a speech-to-text worker twice"))
+            else:
+                self._dispatch(job)
@@ -0,0 +1,92 @@
+"""
+Pre-inference stage for whole utterances: Whisper pads whatever it gets
+to 30 s windows, so the encoder costs the same for 1 s of speech held
+between 4 s of push-to-talk silence as for a full window. Before
+transcription, the utterance is:
+
+    trimmed : leading and trailing silence cut (keeping pad_ms of it),
+              with the same voice activity detector the clients use
+    split   : if still longer than max_segment seconds, cut in the
+              middle of the latest pause in the second half of each
+              window (or at its quietest frame, if there is no pause),
+              so segments fit in one Whisper window
+    skipped : if there is no speech at all: no segments
+
+All of it is frame-level NumPy, a few ms per minute of audio.
+
+Main public API usage:
+    segmenter = SpeechSegmenter()
+    segments, stats = segmenter.segments(audio)   # float32 views into audio; what was done
+"""
+from typing import Dict, List, Tuple
+import numpy as np
+from ..config import AUDIO_SAMPLE_RATE, STT_MAX_SEGMENT, STT_TRIM_PAD_MS
+from ..utils import VoiceActivityDetector
+from ..utils.vad import frame_features
+
+class SpeechSegmenter:
+    def __init__(self, rate=AUDIO_SAMPLE_RATE,
+                       max_segment=STT_MAX_SEGMENT,
+                       pad_ms=STT_TRIM_PAD_MS,
+                       vad=None):
+        """
+        arg::vad: a VoiceActivityDetector to copy settings from (by
+        default, the VAD_* settings). It is never run itself, so one
+        segmenter can serve many threads.
+        """
+        self.rate = rate
+        self.max_segment = max_segment
+        self.pad_ms = pad_ms
+        self.vad = vad or VoiceActivityDetector(rate)
+
+    def segments(self, audio: np.ndarray) -> Tuple[List[np.ndarray], Dict]:
+        """
+        (segments, stats): stats has the seconds of input and of speech
+        kept, and the number of segments.
+        """
+        v = self.vad
+        vad = VoiceActivityDetector(v.rate, v.frame_ms, v.threshold_db,
+                                    v.zcr_threshold, v.fricative_margin_db,
+                                    v.min_speech_frames * v.frame_ms,
+                                    v.hangover_frames * v.frame_ms)
+        speech = vad.process(audio)
+        n = vad.frame_size
+        found = np.flatnonzero(speech)
+        stats = dict(input_s=len(audio) / self.rate, speech_s=0.0, segments=0)
+        if not len(found):
+            return [], stats
+
+        # confirmed speech starts min_speech_frames - 1 frames late
+        pad = round(self.pad_ms / vad.frame_ms)
+        first = max(0, found[0] - (vad.min_speech_frames - 1) - pad)
+        last = min(len(speech), found[-1] + 1 + pad) # frame indices, exclusive
+        if last == len(speech):
+            end = len(audio) # keep the partial frame at the end
+        else:
+            end = last * n
+
+        max_frames = int(self.max_segment * self.rate) // n - 1 # room for a partial last frame
+        cuts = [first]
+        if last - first > max_frames:
+            energy_db = None
+            start = first
+            while last - start > max_frames:
+                lo = start + max_frames // 2
+                hi = start + max_frames
+                pauses = np.flatnonzero(~speech[lo:hi])
+                if len(pauses):
+                    # the middle of the latest pause: fewest, longest segments
+                    breaks = np.flatnonzero(np.diff(pauses) != 1)
+                    run_start = pauses[breaks[-1] + 1] if len(breaks) else pauses[0]
+                    cut = lo + (run_start + pauses[-1]) // 2
+                else: # no pause: the quietest frame
+                    if energy_db is None:
+                        energy_db, _ = frame_features(audio[:len(speech) * n].reshape(-1, n))
+                    cut = lo + int(np.argmin(energy_db[lo:hi]))
+                cuts.append(cut)
+                start = cut
+        bounds = [c * n for c in cuts] + [end]
+        segments = [audio[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+        stats.update(speech_s=round(float(end - first * n) / self.rate, 2),
+                     segments=len(segments))
+        return segments, stats
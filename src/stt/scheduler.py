@@ -0,0 +1,121 @@
+"""
+Cross-request batching for a speech-to-text model.
+
+Connection handler threads submit utterances and wait on a future; one
+worker thread per model instance takes them off a shared queue in
+batches. A batch is closed when it holds max_batch_size utterances, or
+max_wait_ms after its first utterance arrived, whichever comes first, so
+a lone request waits at most max_wait_ms longer than it would have.
+
+Main public API usage:
+    scheduler = BatchScheduler(whisper.transcribe_batch)
+    future = scheduler.submit(audio)  # float32 array
+    text = future.result()
+    scheduler.shutdown()
+"""
+from typing import Callable, List, Optional
+import concurrent.futures
+import queue
+import threading
+import time
+import numpy as np
+from ..config import STT_MAX_BATCH_SIZE, STT_MAX_BATCH_WAIT_MS
+
+class _Request:
+    __slots__ = ('audio', 'future', 'submitted')
+
+    def __init__(self, audio):
+        self.audio = audio
+        self.future = concurrent.futures.Future()
+        self.submitted = time.perf_counter()
+
+
+class BatchScheduler:
+    """
+    arg::transcribe_batch takes a list of float32 arrays and returns a
+    list of transcripts, in the same order. With several arguments in
+    arg::models (e.g. one per GPU), each gets its own worker.
+
+    If a registry (see network/metrics.py) is given, batch sizes and
+    queue waits are recorded in it.
+    """
+    _stop = object()
+
+    def __init__(self, transcribe_batch: Callable[[List[np.ndarray]], List[str]],
+                       max_batch_size: int = STT_MAX_BATCH_SIZE,
+                       max_wait_ms: float = STT_MAX_BATCH_WAIT_MS,
+                       models: Optional[List[Callable]] = None,
+                       registry=None):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.q = queue.Queue()
+        self.batches = 0
+        self.requests = 0
+        self.batch_size = self.queue_wait = None
+        if registry is not None:
+            self.batch_size = registry.histogram('stt_batch_size', 'Utterances per model batch',
+                                                 buckets=(1, 2, 4, 8, 16, 32))
+            self.queue_wait = registry.histogram('stt_batch_queue_wait_seconds',
+                                                 'Time from submit() to the start of its batch')
+        self.workers = []
+        for i, model in enumerate(models or [transcribe_batch]):
+            worker = threading.Thread(target=self._work, args=(model,),
+                                      name=f'[stt batch worker {i}]', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, audio: np.ndarray) -> concurrent.futures.Future:
+        request = _Request(audio)
+        self.q.put(request)
+        return request.future
+
+    def transcribe(self, audio: np.ndarray) -> str:
+        """
+        Blocking convenience: submit and wait.
+        """
+        return self.submit(audio).result()
+
+    def shutdown(self) -> None:
+        for _ in self.workers:
+            self.q.put(self._stop)
+        for worker in self.workers:
+            worker.join()
+
+    def _next_batch(self) -> Optional[List[_Request]]:
+        first = self.q.get()
+        if first is self._stop:
+            return None
+        batch = [first]
+        deadline = first.submitted + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                request = self.q.get(timeout=timeout) if timeout > 0 else self.q.get_nowait()
+            except queue.Empty:
+                break
+            if request is self._stop:
+                self.q.put(request) # for after this batch
+                break
+            batch.append(request)
+        return batch
+
+    def _work(self, transcribe_batch) -> None:
+        while (batch := self._next_batch()) is not None:
+            start = time.perf_counter()
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            if self.batch_size is not None:
+                self.batch_size.observe(len(batch))
+                for request in batch:
+                    self.queue_wait.observe(start - request.submitted)
+            try:
+                results = transcribe_batch([r.audio for r in batch])
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
@@ -1,11 +1,20 @@
 print('importing numpy...', end=' ')
 import numpy as np
 print('loaded.')
+import json
 import queue
 import threading
-from ..config import PORT, CHUNK_SIZE, WHISPER_MODEL
+import time
+from ..config import (PORT, CHUNK_SIZE, WHISPER_MODEL, AUDIO_SAMPLE_RATE, STT_BATCHING,
+                      STT_ARCHIVE_DIR, STT_POOL_WORKERS, STT_CACHE, STT_TRIM_SILENCE)
 from ..network import SequenceInMessageOutServer
-from ..utils import save_wav, buffer_to_array, normalize
+from ..network.structures import FrameReader
+from ..utils import get_codec, CODEC_NAMES, AudioAccumulator
+from .scheduler import BatchScheduler
+from .archive import AudioArchive
+from .pool import WhisperPool
+from .cache import TranscriptCache
+from .preprocess import SpeechSegmenter
 
 class Whisper:
     def __init__(self, model_name=WHISPER_MODEL):
@@ -15,6 +24,7 @@ class Whisper:
     def _init_model(self, model_name):
         print('importing whisper...', end=' ')
         import whisper
+        self.whisper = whisper
         print('loaded.')
         print('whisper model loading...', end=' ')
         self.model = whisper.load_model(model_name)
@@ -28,30 +38,204 @@ class Whisper:
                                             language='en')
         return self.result['text']
 
-class SpeechToTextServer(SequenceInMessageOutServer):
-    def __init__(self, model_name=WHISPER_MODEL,
-                        host='',
-                        port=PORT,
-                        chunk_size=CHUNK_SIZE):
+    def transcribe_words(self, audio_data, prompt=''):
+        """
+        Transcribe, returning (start, end, word) tuples, with times in
+        seconds from the start of arg::audio_data. arg::prompt is text
+        that came before, for context.
+        """
+        result = self.model.transcribe(audio_data,
+                                       fp16=False,
+                                       language='en',
+                                       word_timestamps=True,
+                                       initial_prompt=prompt or None,
+                                       condition_on_previous_text=False)
+        return [(w['start'], w['end'], w['word'])
+                for segment in result['segments'] for w in segment.get('words', [])]
 
-        super().__init__(host, port, chunk_size)
-        self.stt = Whisper(model_name)
+    def transcribe_batch(self, audios):
+        """
+        Transcribe several utterances with one batched pass of the model
+        (see stt/scheduler.py). Each is padded to Whisper's 30 s window;
+        longer utterances are transcribed one at a time instead.
+        """
+        import torch
+        whisper = self.whisper
+        results = [None] * len(audios)
+        short = [i for i, audio in enumerate(audios) if len(audio) <= whisper.audio.N_SAMPLES]
+        if short:
+            print(f'converting speech to text (batch of {len(short)})...')
+            mels = [whisper.log_mel_spectrogram(whisper.pad_or_trim(audios[i]),
+                                                self.model.dims.n_mels)
+                    for i in short]
+            batch = torch.stack(mels).to(self.model.device)
+            options = whisper.DecodingOptions(language='en', fp16=False)
+            for i, decoded in zip(short, whisper.decode(self.model, batch, options)):
+                results[i] = decoded.text
+        for i, audio in enumerate(audios):
+            if results[i] is None:
+                results[i] = self.transcribe(audio)
+        return results
+
+class TranscriberMixin:
+    """
+    Model, metrics and option handling shared by the speech-to-text
+    servers. Call _init_stt() from __init__, after the server's.
+    """
+    def _init_stt(self, model_name=WHISPER_MODEL, stt=None, batching=STT_BATCHING,
+                        workers=STT_POOL_WORKERS, cache=STT_CACHE):
+        """
+        With arg::workers, models run in that many worker processes (see
+        WhisperPool) instead of in the server process. With arg::batching,
+        concurrent requests share batched passes of the model through a
+        BatchScheduler (one batch in flight per worker). With arg::cache,
+        repeated utterances are answered from a TranscriptCache.
+        """
+        self.model_name = model_name
+        if stt is None:
+            stt = WhisperPool(model_name, workers) if workers else Whisper(model_name)
+        self.stt = stt
+        registry = self.metrics.registry
+        self.cache = TranscriptCache(registry=registry) if cache else None
+        self.scheduler = None
+        if batching:
+            n_models = len(getattr(stt, 'workers', [None]))
+            self.scheduler = BatchScheduler(stt.transcribe_batch, registry=registry,
+                                            models=[stt.transcribe_batch] * n_models)
+        self.audio_seconds = registry.counter('stt_audio_seconds_total',
+                                              'Seconds of audio transcribed')
+        self.transcribe_seconds = registry.counter('stt_transcribe_seconds_total',
+                                                   'Wall-clock seconds spent transcribing')
+        self.speed = registry.histogram('stt_speed',
+                                        'Audio seconds transcribed per wall-clock second, per request',
+                                        buckets=(0.5, 1, 2, 5, 10, 20, 50, 100, 200))
+
+    def shutdown(self):
+        super().shutdown()
+        if self.scheduler is not None:
+            self.scheduler.shutdown()
+        if isinstance(self.stt, WhisperPool):
+            self.stt.close()
 
     def speech_to_text(self, audio_array):
+        if self.cache is None:
+            return self._transcribe(audio_array)
+        # the codec only matters through the audio it decodes to
+        options = {k: v for k, v in self.options.items() if k != 'codec'}
+        context = f'{self.model_name} {json.dumps(options, sort_keys=True)}'
+        transcript = self.cache.get(audio_array, context)
+        if transcript is None:
+            transcript = self._transcribe(audio_array)
+            self.cache.put(audio_array, context, transcript)
+        return transcript
+
+    def _transcribe(self, audio_array):
+        if self.scheduler is not None:
+            return self.scheduler.transcribe(audio_array)
         transcript = self.stt.transcribe(audio_array)
         return transcript
 
-    def _process(self, message: bytes) -> bytes:
+    def _negotiate(self, requested):
         """
-        Message will be a completed bytes object (buffer),
-        streamed by client (perhaps via live microphone recording).
+        Clients may ask for a compressed audio codec, listing codecs in
+        order of preference (see utils.audio_codecs). Without one, audio
+        is raw 16-bit PCM.
         """
-        print('saving wav file...', end=' ')
-        save_wav(message, 'test_1ch_16000hz.wav')
-        print('saved.')
+        accepted = {}
+        codecs = requested.get('codecs')
+        if codecs:
+            accepted['codec'] = next((c for c in codecs if c in CODEC_NAMES), 'pcm16')
+        return accepted
+
+    def _record_speed(self, audio_seconds: float, elapsed: float) -> None:
+        self.audio_seconds.inc(audio_seconds)
+        self.transcribe_seconds.inc(elapsed)
+        if elapsed > 0:
+            self.speed.observe(audio_seconds / elapsed)
+
+class SpeechToTextServer(TranscriberMixin, SequenceInMessageOutServer):
+    """
+    Transcribes each utterance once it has been received in full.
+    (See StreamingSpeechToTextServer, in streaming.py, to transcribe while
+    audio is still arriving.)
+
+    Received audio is kept in arg::archive_dir (see archive.py), written
+    in the background; None keeps nothing. With arg::trim_silence, only
+    the speech is transcribed (see preprocess.py), and utterances with no
+    speech at all get an empty transcript at once.
+    """
+    def __init__(self, model_name=WHISPER_MODEL,
+                        host='',
+                        port=PORT,
+                        chunk_size=CHUNK_SIZE,
+                        transport=None,
+                        stt=None,
+                        archive_dir=STT_ARCHIVE_DIR,
+                        trim_silence=STT_TRIM_SILENCE):
+
+        super().__init__(host, port, chunk_size, transport=transport)
+        self._init_stt(model_name, stt)
+        self.segmenter = SpeechSegmenter() if trim_silence else None
+        self.archive = None
+        if archive_dir is not None:
+            self.archive = AudioArchive(archive_dir, registry=self.metrics.registry)
+
+    def shutdown(self):
+        super().shutdown()
+        if self.archive is not None:
+            self.archive.close()
+
+    def _receive(self, client_socket) -> AudioAccumulator:
+        """
+        Decode each frame to normalized float32 as it arrives (with the
+        codec negotiated for this request), so the utterance is ready
+        for the model as soon as end of transmission is received.
+        """
+        codec = get_codec(self.options.get('codec', 'pcm16'))
+        reader = FrameReader(client_socket, initial_size=self.chunk_size, stats=self._stats)
+        audio = AudioAccumulator()
+        odd_byte = b'' # a sample split across frames
+        while (view := reader.read_view()) is not None:
+            if codec.name != 'pcm16':
+                audio.extend(codec.decode(view))
+                continue
+            if odd_byte:
+                view, odd_byte = memoryview(odd_byte + view), b''
+            if len(view) % 2:
+                view, odd_byte = view[:-1], bytes(view[-1:])
+            audio.extend_int16(view)
+        return audio
+
+    def _process(self, audio: AudioAccumulator) -> bytes:
+        """
+        Audio is the complete utterance, streamed by client (perhaps via
+        live microphone recording), already decoded by _receive.
+        """
+        audio_array = audio.array
+        if self.archive is not None and not self.archive.archive(audio_array):
+            print('archive queue full: audio not archived.')
+
+        if self.segmenter is None:
+            start = time.perf_counter()
+            transcript = self.speech_to_text(audio_array)
+            self._record_speed(len(audio_array) / AUDIO_SAMPLE_RATE,
+                               time.perf_counter() - start)
+            return transcript.encode('utf-8')
 
-        audio_array = normalize(buffer_to_array(message))
-        transcript = self.speech_to_text(audio_array)
+        start = time.perf_counter()
+        segments, stats = self.segmenter.segments(audio_array)
+        prep = time.perf_counter() - start
+        if not segments:
+            print(f"No speech in {stats['input_s']:.1f} s of audio "
+                  f"(checked in {prep * 1e3:.1f} ms): not transcribed.")
+            return b''
+        start = time.perf_counter()
+        transcript = ' '.join(self.speech_to_text(segment).strip() for segment in segments)
+        inference = time.perf_counter() - start
+        print(f"Trimmed {stats['input_s']:.1f} s of audio to {stats['speech_s']:.1f} s "
+              f"in {stats['segments']} segment(s) in {prep * 1e3:.1f} ms; "
+              f"transcribed in {inference:.2f} s.")
+        self._record_speed(stats['input_s'], prep + inference)
         return transcript.encode('utf-8')
 
 class QueuedSpeechToTextServer(SpeechToTextServer):
@@ -0,0 +1,198 @@
+"""
+Streaming speech-to-text: transcribe while audio is still arriving.
+
+IncrementalTranscriber re-transcribes the audio not yet committed every
+STT_PARTIAL_INTERVAL seconds of new audio. Words on which two successive
+hypotheses agree are committed, and the audio they cover is dropped from
+the window, so each pass stays short however long the utterance gets. At
+end of stream only the uncommitted tail is transcribed again.
+
+StreamingSpeechToTextServer runs one per request. Clients that open the
+request with the 'partials' option get each hypothesis as an interim
+frame while still sending, then the final transcript as the last frame
+before end of transmission. Other clients get just the final transcript,
+exactly as from SpeechToTextServer.
+"""
+from typing import Iterator, List, Tuple
+import re
+import time
+import numpy as np
+from ..config import (PORT, CHUNK_SIZE, WHISPER_MODEL, AUDIO_SAMPLE_RATE,
+                      STT_PARTIAL_INTERVAL, STT_MAX_WINDOW)
+from ..network import SequenceInSequenceOutServer, Transmit
+from ..utils import get_codec
+from .speech_to_text import TranscriberMixin
+
+Word = Tuple[float, float, str] # start, end (seconds into the stream), text
+
+def _normalize(word: str) -> str:
+    return re.sub(r'[^\w]', '', word.lower())
+
+class IncrementalTranscriber:
+    """
+    Usage:
+        transcriber = IncrementalTranscriber(whisper)
+        for audio in chunks:              # float32 arrays
+            transcriber.add(audio)
+            if transcriber.due():
+                print(transcriber.update())  # committed + tentative text
+        print(transcriber.finish())        # final transcript
+    """
+    def __init__(self, model,
+                       rate=AUDIO_SAMPLE_RATE,
+                       interval=STT_PARTIAL_INTERVAL,
+                       max_window=STT_MAX_WINDOW):
+        """
+        arg::model must have transcribe_words(audio, prompt) (see Whisper).
+        """
+        self.model = model
+        self.rate = rate
+        self.interval = interval
+        self.max_window = max_window
+        self.chunks = []        # uncommitted audio
+        self.n_samples = 0      # in self.chunks
+        self.offset = 0.0       # stream time of the first uncommitted sample
+        self.committed: List[Word] = []
+        self.tentative: List[Word] = []
+        self.new_samples = 0    # since the last pass
+        self.passes = 0
+
+    def add(self, audio: np.ndarray) -> None:
+        self.chunks.append(audio)
+        self.n_samples += len(audio)
+        self.new_samples += len(audio)
+
+    def due(self) -> bool:
+        return self.new_samples >= self.interval * self.rate
+
+    @property
+    def window_seconds(self) -> float:
+        return self.n_samples / self.rate
+
+    def update(self) -> str:
+        """
+        Transcribe the uncommitted window, commit what the last two passes
+        agree on, and return the current hypothesis.
+        """
+        words = self._transcribe()
+        n_stable = 0
+        for old, new in zip(self.tentative, words):
+            if _normalize(old[2]) != _normalize(new[2]):
+                break
+            n_stable += 1
+        self._commit(words[:n_stable])
+        self.tentative = words[n_stable:]
+        if self.window_seconds > self.max_window and self.tentative:
+            # no agreement for too long: keep the window within Whisper's 30 s
+            self._commit(self.tentative)
+            self.tentative = []
+        return self.text
+
+    def finish(self) -> str:
+        """
+        Transcribe the uncommitted tail one last time, and commit it all.
+        """
+        if self.n_samples:
+            self._commit(self._transcribe())
+        self.tentative = []
+        return self.text
+
+    @property
+    def text(self) -> str:
+        return ''.join(w[2] for w in self.committed + self.tentative).strip()
+
+    def _transcribe(self) -> List[Word]:
+        self.new_samples = 0
+        if not self.n_samples:
+            return []
+        if len(self.chunks) > 1:
+            self.chunks = [np.concatenate(self.chunks)]
+        prompt = ''.join(w[2] for w in self.committed)[-200:]
+        words = self.model.transcribe_words(self.chunks[0], prompt)
+        self.passes += 1
+        committed_end = self.committed[-1][1] if self.committed else 0.0
+        # Whisper may repeat a word that straddles the window's start
+        return [(start + self.offset, end + self.offset, text) for start, end, text in words
+                if end + self.offset > committed_end + 0.01]
+
+    def _commit(self, words: List[Word]) -> None:
+        if not words:
+            return
+        self.committed.extend(words)
+        n_drop = min(self.n_samples, int((words[-1][1] - self.offset) * self.rate))
+        if n_drop <= 0:
+            return
+        audio = np.concatenate(self.chunks) if len(self.chunks) > 1 else self.chunks[0]
+        self.chunks = [audio[n_drop:]]
+        self.n_samples -= n_drop
+        self.offset += n_drop / self.rate
+
+
+class StreamingSpeechToTextServer(TranscriberMixin, SequenceInSequenceOutServer):
+    """
+    See the module docstring. Audio frames are encoded with the codec
+    negotiated for the request, as for SpeechToTextServer.
+    """
+    def __init__(self, model_name=WHISPER_MODEL,
+                        host='',
+                        port=PORT,
+                        chunk_size=CHUNK_SIZE,
+                        transport=None,
+                        stt=None):
+
+        super().__init__(host, port, chunk_size, transport=transport)
+        self._init_stt(model_name, stt)
+
+    def _negotiate(self, requested):
+        """
+        Extends TranscriberMixin._negotiate(): clients may opt in to
+        partial transcripts.
+        """
+        accepted = super()._negotiate(requested)
+        if requested.get('partials'):
+            accepted['partials'] = True
+        return accepted
+
+    def _process(self, sequence: Iterator[bytes]) -> Iterator[bytes]:
+        codec = get_codec(self.options.get('codec', 'pcm16'))
+        partials = self.options.get('partials', False)
+        transcriber = IncrementalTranscriber(self.stt)
+        last_sent = None
+        busy = 0.0
+        odd_byte = b'' # a pcm16 sample split across frames
+        for frame in sequence:
+            if codec.name == 'pcm16':
+                if odd_byte:
+                    frame, odd_byte = odd_byte + frame, b''
+                if len(frame) % 2:
+                    frame, odd_byte = frame[:-1], bytes(frame[-1:])
+            transcriber.add(codec.decode(frame))
+            if transcriber.due():
+                start = time.perf_counter()
+                hypothesis = transcriber.update()
+                busy += time.perf_counter() - start
+                if partials and hypothesis and hypothesis != last_sent:
+                    last_sent = hypothesis
+                    yield hypothesis.encode('utf-8')
+
+        start = time.perf_counter()
+        audio_seconds = transcriber.offset + transcriber.window_seconds
+        tail_seconds = transcriber.window_seconds
+        transcript = transcriber.finish()
+        finalize = time.perf_counter() - start
+        print(f"Transcribed {audio_seconds:.1f} s in {transcriber.passes} passes; "
+              f"finalized the last {tail_seconds:.1f} s in {finalize:.2f} s after end of stream.")
+        self._record_speed(audio_seconds, busy + finalize)
+        yield transcript.encode('utf-8')
+
+    def _send(self, client_socket, sequence: Iterator[bytes]) -> None:
+        """
+        Without partials, reply like SpeechToTextServer: one message, with
+        no end of transmission.
+        """
+        if self.options.get('partials'):
+            return super()._send(client_socket, sequence)
+        for message in sequence:
+            Transmit.send_over_socket(client_socket, message)
+            self._stats.frames_out += 1
+            self._stats.bytes_out += len(message)
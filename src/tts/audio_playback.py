@@ -10,7 +10,8 @@ import queue
 import logging
 
 from .text_to_speech import UnrealSpeech
-from ..utils import buffer_to_array, save_wav
+from ..utils import buffer_to_array, save_wav, StreamingResampler
+from ..config import TTS_SAMPLE_RATE, PLAYBACK_DEVICE_RATE
 
 logger = logging.getLogger(__name__)
 
@@ -148,26 +149,38 @@ class StreamedAudioPlayer:
     works with StreamingAudioBuffer, which wraps
     a response object representing audio streamed
     over the network (e.g., from UnrealSpeech).
+    Audio at rate (TTS_SAMPLE_RATE) is converted to the output device's
+    native rate (or device_rate), rather than left to PortAudio/ALSA.
     """
-    def __init__(self, audio_buffer):
+    def __init__(self, audio_buffer, rate=TTS_SAMPLE_RATE, device_rate=PLAYBACK_DEVICE_RATE):
         self.audio_buffer = audio_buffer
         self.paudio = pyaudio.PyAudio()
         self.stream = None
         self.window_size = WINDOW_SIZE # bytes per window
+        self.rate = rate
+        self.device_rate = device_rate or int(
+            self.paudio.get_default_output_device_info()['defaultSampleRate'])
 
     def play(self):
         logger.debug('opening paudio stream...')
         stream = self.paudio.open(format=pyaudio.paInt16,
                         channels=1,
-                        rate=22050,
+                        rate=self.device_rate,
                         output=True)
         logger.debug('paudio stream opened')
 
         n = self.window_size
         buf = self.audio_buffer
+        resampler = None
+        if self.device_rate != self.rate:
+            resampler = StreamingResampler(self.rate, self.device_rate)
 
         while len(data := buf.read(n)):
+            if resampler is not None:
+                data = resampler.process(data).tobytes()
             stream.write(data)
+        if resampler is not None:
+            stream.write(resampler.flush().tobytes())
 
         stream.close()
         buf.close()
@@ -3,5 +3,10 @@ try:
 except ImportError as e:
     print('Skipping KeyboardListener import: no supported on linux.')
 from .parsing import SentenceParser
-from .wav_utils import save_wav
-from .array_utils import buffer_to_array, normalize
+from .wav_utils import save_wav, WavWriter
+from .array_utils import buffer_to_array, normalize, AudioAccumulator
+from .audio_codecs import get_codec, CODEC_NAMES
+from .ring_buffer import AudioRingBuffer, RingCursor
+from .vad import VoiceActivityDetector, SilenceTrimmer
+from .encoding import EncoderPool, get_encoder_pool
+from .resample import StreamingResampler, resample
@@ -5,3 +5,55 @@ def buffer_to_array(buffer, dtype=np.int16):
 
 def normalize(arr):
     return arr.astype(np.float32) / np.iinfo(np.int16).max
+
+
+class AudioAccumulator:
+    """
+    Collects an utterance as normalized float32 while it arrives, so it
+    is ready for the model the moment the last chunk is in: each chunk is
+    scaled straight into a preallocated buffer, which doubles in size when
+    full (amortized O(1) per sample, with at most one spare buffer's worth
+    of memory). Compared to joining the bytes and converting at the end,
+    this saves the joined copy, the int16 view's float cast and the divide.
+
+    Usage:
+        audio = AudioAccumulator()
+        audio.extend_int16(pcm)   # int16 array or 16-bit PCM bytes
+        audio.extend(floats)      # already normalized float32
+        model(audio.array)        # float32 view, no copy
+    """
+    def __init__(self, initial_samples=16000 * 10):
+        self._buffer = np.empty(max(initial_samples, 1), dtype=np.float32)
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def nbytes(self):
+        return self._n * 4
+
+    @property
+    def array(self) -> np.ndarray:
+        return self._buffer[:self._n]
+
+    def _reserve(self, n):
+        """
+        Room for arg::n more samples; returns the slice to write them to.
+        """
+        end = self._n + n
+        if end > len(self._buffer):
+            grown = np.empty(max(end, 2 * len(self._buffer)), dtype=np.float32)
+            grown[:self._n] = self._buffer[:self._n]
+            self._buffer = grown
+        return self._buffer[self._n:end]
+
+    def extend_int16(self, pcm):
+        if not isinstance(pcm, np.ndarray):
+            pcm = np.frombuffer(pcm, dtype=np.int16)
+        np.multiply(pcm, np.float32(1 / np.iinfo(np.int16).max), out=self._reserve(len(pcm)))
+        self._n += len(pcm)
+
+    def extend(self, samples: np.ndarray):
+        self._reserve(len(samples))[:] = samples
+        self._n += len(samples)
@@ -0,0 +1,322 @@
+"""
+On-wire codecs for 16-bit mono PCM audio, in NumPy.
+
+    pcm16     : raw 16-bit PCM (no compression)
+    mulaw     : G.711 mu-law, 8 bits per sample (2x smaller)
+    alaw      : G.711 A-law, 8 bits per sample (2x smaller)
+    ima-adpcm : IMA ADPCM, 4 bits per sample plus block headers (~3.9x smaller)
+
+The G.711 codecs are table lookups over whole frames, well under 0.1 ms
+of CPU per second of audio. IMA ADPCM is sequential within a block, so
+it runs a Python loop over sample positions (vectorized only across the
+blocks of a frame): roughly 30 ms to encode and 15 ms to decode per
+second of 16 kHz audio, in 4096-sample frames (see benchmark()). Pick it
+only where bandwidth matters more than that CPU time.
+
+Every encoded frame is self-contained, so frames can be decoded in any
+order (or dropped) without corrupting the rest of the stream.
+
+Main public API usage:
+    codec = get_codec('mulaw')
+    payload = codec.encode(pcm_bytes)         # bytes in, bytes out
+    audio = codec.decode(payload)             # float32 in [-1, 1]
+    pcm = codec.decode_int16(payload)         # int16 samples
+"""
+from typing import Dict, Union
+import numpy as np
+
+_int16_scale = np.float32(1.0 / np.iinfo(np.int16).max) # matches utils.normalize
+
+Audio = Union[bytes, bytearray, memoryview, np.ndarray]
+
+def _as_int16(pcm: Audio) -> np.ndarray:
+    if isinstance(pcm, np.ndarray):
+        return pcm.astype(np.int16, copy=False)
+    return np.frombuffer(pcm, dtype=np.int16)
+
+
+class PCM16Codec:
+    name = 'pcm16'
+    bits_per_sample = 16
+
+    def encode(self, pcm: Audio) -> bytes:
+        if isinstance(pcm, np.ndarray):
+            return pcm.astype(np.int16, copy=False).tobytes()
+        return pcm # already 16-bit PCM bytes
+
+    def decode_int16(self, payload: Audio) -> np.ndarray:
+        return np.frombuffer(payload, dtype=np.int16)
+
+    def decode(self, payload: Audio) -> np.ndarray:
+        # one pass: int16 -> scaled float32, with no intermediate array
+        return np.multiply(self.decode_int16(payload), _int16_scale, dtype=np.float32)
+
+
+class _CompandingCodec(PCM16Codec):
+    """
+    G.711 codecs. Both directions are single table lookups: every int16
+    value is pre-encoded in a 65536-entry table, and every code pre-decoded
+    (to int16 and to normalized float32) in 256-entry tables.
+    """
+    bits_per_sample = 8
+
+    def __init__(self):
+        samples = np.arange(-32768, 32768, dtype=np.int32)
+        self._encode_table = self._encode(samples).astype(np.uint8)
+        codes = np.arange(256, dtype=np.int32)
+        self._decode_table = self._decode(codes).astype(np.int16)
+        self._decode_table_f32 = self._decode_table * _int16_scale
+
+    def encode(self, pcm: Audio) -> bytes:
+        # offset int16 into [0, 65536) to index the table
+        ix = _as_int16(pcm).view(np.uint16) ^ np.uint16(0x8000)
+        return self._encode_table.take(ix).tobytes()
+
+    def decode_int16(self, payload: Audio) -> np.ndarray:
+        return self._decode_table.take(np.frombuffer(payload, dtype=np.uint8))
+
+    def decode(self, payload: Audio) -> np.ndarray:
+        return self._decode_table_f32.take(np.frombuffer(payload, dtype=np.uint8))
+
+    @staticmethod
+    def _segment(x: np.ndarray, segment_ends) -> np.ndarray:
+        return np.searchsorted(np.asarray(segment_ends), x, side='left')
+
+
+class MuLawCodec(_CompandingCodec):
+    """
+    G.711 mu-law (as in Sun's reference g711.c, and audioop.lin2ulaw).
+    """
+    name = 'mulaw'
+    bias = 0x84
+    clip = 8159
+    segment_ends = (0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF)
+
+    def _encode(self, pcm: np.ndarray) -> np.ndarray:
+        x = pcm >> 2
+        mask = np.where(x < 0, 0x7F, 0xFF)
+        x = np.minimum(np.abs(x), self.clip) + (self.bias >> 2)
+        seg = self._segment(x, self.segment_ends)
+        code = (seg << 4) | ((x >> (seg + 1)) & 0xF)
+        return np.where(seg >= 8, 0x7F, code) ^ mask
+
+    def _decode(self, code: np.ndarray) -> np.ndarray:
+        u = ~code & 0xFF
+        t = (((u & 0x0F) << 3) + self.bias) << ((u & 0x70) >> 4)
+        return np.where(u & 0x80, self.bias - t, t - self.bias)
+
+
+class ALawCodec(_CompandingCodec):
+    """
+    G.711 A-law (as in Sun's reference g711.c, and audioop.lin2alaw).
+    """
+    name = 'alaw'
+    segment_ends = (0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF)
+
+    def _encode(self, pcm: np.ndarray) -> np.ndarray:
+        x = pcm >> 3
+        mask = np.where(x >= 0, 0xD5, 0x55)
+        x = np.where(x >= 0, x, -x - 1)
+        seg = self._segment(x, self.segment_ends)
+        shift = np.where(seg < 2, 1, seg)
+        code = (seg << 4) | ((x >> shift) & 0xF)
+        return np.where(seg >= 8, 0x7F, code) ^ mask
+
+    def _decode(self, code: np.ndarray) -> np.ndarray:
+        a = code ^ 0x55
+        seg = (a & 0x70) >> 4
+        t = ((a & 0x0F) << 4) + np.where(seg == 0, 8, 0x108)
+        t = t << np.maximum(seg - 1, 0)
+        return np.where(a & 0x80, t, -t)
+
+
+class ImaAdpcmCodec(PCM16Codec):
+    """
+    IMA ADPCM, in independent blocks of samples_per_block samples.
+
+    Frame layout (little-endian):
+        uint32 n_samples
+        per block:  int16 first sample, uint8 step index, uint8 (zero),
+                    then (samples_per_block - 1) 4-bit codes, high nibble first.
+    Frames may be concatenated (e.g. by SequenceInMessageOutServer): the
+    decoders accept any number of whole frames back to back.
+
+    ADPCM is sequential within a block, so the encoder and decoder step
+    through sample positions in a Python loop, working on all blocks at
+    once: its cost is per sample position, and a frame of few blocks
+    gains little from NumPy.
+    """
+    name = 'ima-adpcm'
+    bits_per_sample = 4
+    samples_per_block = 257 # 1 header sample + 256 codes = 132 bytes/block
+
+    step_table = np.array([
+        7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37,
+        41, 45, 50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173,
+        190, 209, 230, 253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658,
+        724, 796, 876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066,
+        2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358, 5894,
+        6484, 7132, 7845, 8630, 9493, 10442, 11487, 12635, 13899, 15289,
+        16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767], dtype=np.int32)
+    index_table = np.array([-1, -1, -1, -1, 2, 4, 6, 8] * 2, dtype=np.int32)
+    header_dtype = np.dtype([('sample', '<i2'), ('index', 'u1'), ('pad', 'u1')])
+
+    def __init__(self):
+        # Predictor change and next step index for every (step index,
+        # code), so each sample step is a couple of table lookups.
+        index = np.arange(len(self.step_table))[:, None]
+        code = np.arange(16)[None, :]
+        step = self.step_table[index]
+        vpdiff = ((step >> 3)
+                  + np.where(code & 4, step, 0)
+                  + np.where(code & 2, step >> 1, 0)
+                  + np.where(code & 1, step >> 2, 0))
+        self.delta_table = np.where(code & 8, -vpdiff, vpdiff).astype(np.int32)
+        self.next_index_table = np.clip(index + self.index_table[code], 0, 88).astype(np.int32)
+
+    @property
+    def block_bytes(self) -> int:
+        return self.header_dtype.itemsize + (self.samples_per_block - 1) // 2
+
+    def encode(self, pcm: Audio) -> bytes:
+        x = _as_int16(pcm)
+        n = len(x)
+        if not n: # e.g. an empty flush at the end of a stream: just the header
+            return np.array([0], dtype='<u4').tobytes()
+        spb = self.samples_per_block
+        n_blocks = -(-n // spb)
+        blocks = np.zeros((n_blocks, spb), dtype=np.int32)
+        blocks.flat[:n] = x
+        if n % spb: # repeat the last sample rather than padding with silence
+            blocks.flat[n:] = x[-1]
+
+        # Start each block at a step size close to its first difference,
+        # since blocks can't inherit the index from their predecessor.
+        first_diff = np.abs(blocks[:, 1] - blocks[:, 0])
+        index = np.searchsorted(self.step_table, first_diff).clip(0, 88)
+        header = np.zeros(n_blocks, dtype=self.header_dtype)
+        header['sample'] = blocks[:, 0]
+        header['index'] = index
+
+        pred = blocks[:, 0].copy()
+        codes = np.empty((n_blocks, spb - 1), dtype=np.uint8)
+        for i in range(1, spb):
+            step = self.step_table[index]
+            diff = blocks[:, i] - pred
+            code = np.where(diff < 0, 8, 0)
+            diff = np.abs(diff)
+            # 3-bit magnitude: compare against step, step/2, step/4
+            b2 = diff >= step
+            diff = diff - np.where(b2, step, 0)
+            b1 = diff >= (step >> 1)
+            diff = diff - np.where(b1, step >> 1, 0)
+            b0 = diff >= (step >> 2)
+            code |= (b2 << 2) | (b1 << 1) | b0
+            pred, index = self._step(pred, index, code)
+            codes[:, i - 1] = code
+
+        packed = (codes[:, 0::2] << 4) | codes[:, 1::2]
+        frame = np.empty((n_blocks, self.block_bytes), dtype=np.uint8)
+        frame[:, :self.header_dtype.itemsize] = header.view(np.uint8).reshape(n_blocks, -1)
+        frame[:, self.header_dtype.itemsize:] = packed
+        return np.array([n], dtype='<u4').tobytes() + frame.tobytes()
+
+    def decode_int16(self, payload: Audio) -> np.ndarray:
+        buf = np.frombuffer(payload, dtype=np.uint8)
+        block_bytes = self.block_bytes
+
+        # locate the blocks (and sample count) of each concatenated frame
+        spans, counts = [], []
+        pos = 0
+        while pos < len(buf):
+            n = int(buf[pos:pos+4].view('<u4')[0])
+            n_blocks = -(-n // self.samples_per_block)
+            spans.append(buf[pos+4:pos+4+n_blocks*block_bytes])
+            counts.append((n, n_blocks))
+            pos += 4 + n_blocks * block_bytes
+        if not spans:
+            return np.empty(0, dtype=np.int16)
+        frame = np.concatenate(spans).reshape(-1, block_bytes)
+
+        n_blocks = len(frame)
+        hsize = self.header_dtype.itemsize
+        header = np.ascontiguousarray(frame[:, :hsize]).view(self.header_dtype).ravel()
+        packed = frame[:, hsize:]
+        codes = np.empty((n_blocks, self.samples_per_block - 1), dtype=np.int32)
+        codes[:, 0::2] = packed >> 4
+        codes[:, 1::2] = packed & 0x0F
+
+        out = np.empty((n_blocks, self.samples_per_block), dtype=np.int16)
+        pred = header['sample'].astype(np.int32)
+        index = header['index'].astype(np.int32)
+        out[:, 0] = pred
+        for i in range(1, self.samples_per_block):
+            pred, index = self._step(pred, index, codes[:, i - 1])
+            out[:, i] = pred
+
+        if len(counts) == 1:
+            return out.ravel()[:counts[0][0]]
+        # drop each frame's padding at the end of its last block
+        out = out.reshape(-1)
+        keep, start = [], 0
+        for n, n_frame_blocks in counts:
+            keep.append(out[start:start+n])
+            start += n_frame_blocks * self.samples_per_block
+        return np.concatenate(keep)
+
+    def decode(self, payload: Audio) -> np.ndarray:
+        return np.multiply(self.decode_int16(payload), _int16_scale, dtype=np.float32)
+
+    def _step(self, pred, index, code):
+        """
+        Shared by encoder and decoder, so both track the same predictor.
+        """
+        pred = np.clip(pred + self.delta_table[index, code], -32768, 32767)
+        return pred, self.next_index_table[index, code]
+
+
+_codec_classes = {c.name: c for c in (PCM16Codec, MuLawCodec, ALawCodec, ImaAdpcmCodec)}
+CODEC_NAMES = tuple(_codec_classes)
+CODECS: Dict[str, PCM16Codec] = {}
+
+def get_codec(name: str) -> PCM16Codec:
+    """
+    Codecs are built on first use (the G.711 tables take a few ms).
+    """
+    if name not in CODECS:
+        if name not in _codec_classes:
+            raise ValueError(f"Unknown audio codec: {name}")
+        CODECS[name] = _codec_classes[name]()
+    return CODECS[name]
+
+def benchmark(seconds=10, rate=16000, chunk=4096):
+    """
+    Report encode / decode CPU cost per second of audio, and the
+    compression ratio, for each codec on chunk-sized frames of noisy tone.
+    """
+    import time
+    t = np.arange(seconds * rate) / rate
+    rng = np.random.default_rng(0)
+    signal = 8000 * np.sin(2 * np.pi * 220 * t) + 500 * rng.standard_normal(len(t))
+    pcm = signal.astype(np.int16)
+    frames = [pcm[i:i+chunk].tobytes() for i in range(0, len(pcm), chunk)]
+
+    print(f"{'codec':<10} {'ratio':>6} {'encode ms/s':>12} {'decode ms/s':>12} {'SNR dB':>7}")
+    for name in CODEC_NAMES:
+        codec = get_codec(name)
+        start = time.perf_counter()
+        encoded = [codec.encode(f) for f in frames]
+        encode_time = time.perf_counter() - start
+        start = time.perf_counter()
+        decoded = [codec.decode(e) for e in encoded]
+        decode_time = time.perf_counter() - start
+
+        ratio = len(pcm) * 2 / sum(len(e) for e in encoded)
+        audio = np.concatenate(decoded)
+        reference = pcm * _int16_scale
+        snr = 10 * np.log10(np.sum(reference ** 2) / np.sum((audio - reference) ** 2 + 1e-20))
+        print(f"{name:<10} {ratio:>6.2f} {1e3 * encode_time / seconds:>12.3f} "
+              f"{1e3 * decode_time / seconds:>12.3f} {snr:>7.1f}")
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,65 @@
+"""
+Background encoding of WAV recordings (e.g. to MP3 or Opus), in a pool of
+worker processes, so encoding never blocks the recording thread and
+several recordings can be encoded at once, across cores.
+
+Main public API usage:
+    job = get_encoder_pool().submit('take1.wav', 'mp3') # returns at once
+    job.add_done_callback(...)                         # concurrent.futures.Future
+    mp3_path = job.result()                            # waits
+"""
+from typing import Optional
+import concurrent.futures
+import threading
+from ..config import ENCODER_WORKERS
+
+# pydub export() arguments per output format
+FORMATS = {
+    'mp3': dict(format='mp3'),
+    'opus': dict(format='opus', codec='libopus'),
+    'ogg': dict(format='ogg', codec='libopus'),
+}
+
+def encode_file(wav_path, out_path, fmt, bitrate=None):
+    """
+    Runs in a worker process. Returns arg::out_path.
+    """
+    from pydub import AudioSegment # imported in the worker only
+    audio_segment = AudioSegment.from_wav(wav_path)
+    audio_segment.export(out_path, bitrate=bitrate, **FORMATS[fmt])
+    return out_path
+
+
+class EncoderPool:
+    """
+    Process pool for encode_file() jobs. Each submit() returns a
+    concurrent.futures.Future resolving to the encoded file's path (or
+    raising the encoder's error).
+    """
+    def __init__(self, max_workers: Optional[int] = ENCODER_WORKERS):
+        self.max_workers = max_workers
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+
+    def submit(self, wav_path, fmt='mp3', out_path=None, bitrate=None) -> concurrent.futures.Future:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported format {fmt!r}: use one of {tuple(FORMATS)}")
+        if out_path is None:
+            out_path = wav_path.rsplit('.', maxsplit=1)[0] + '.' + fmt
+        return self.executor.submit(encode_file, wav_path, out_path, fmt, bitrate)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+def get_encoder_pool() -> EncoderPool:
+    """
+    The pool shared by all recorders in this process, created on first use.
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = EncoderPool()
+        return _default_pool
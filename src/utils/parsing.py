@@ -1,14 +1,21 @@
-from typing import Union, Iterable
+from typing import Union, Iterable, List
 import re
 import queue
+import warnings
 
 class SentenceParser:
+    """
+    Splits streamed text into sentences. Each token fed may hold several
+    tokens' text (a coalesced frame, see network/coalesce.py), so it may
+    end several sentences at once. n_frames counts what was fed (one
+    per token only if the server does not coalesce them).
+    """
     sentinel = None
 
     def __init__(self):
-        self.tokens = []
+        self.frames = []
         self.stack = []
-        self.n_tokens = 0
+        self.n_frames = 0
         #self.q = queue.Queue()
 
     def _detect_sentence_end(self, text):
@@ -26,41 +33,67 @@ class SentenceParser:
             (?=[A-Z])                 # Lookahead for a capital letter (start of a new sentence)
         """, re.VERBOSE)
 
-        # Find all sentence-ending positions
-        matches = [match.end() for match in sentence_end_pattern.finditer(text)]
+        # Find all sentence-ending positions (where the whitespace after them starts)
+        matches = [match.start() for match in sentence_end_pattern.finditer(text)]
         return matches
 
     def get_sentences(self, token_seq: Iterable[bytes]) -> Iterable[str]:
         for token in token_seq:
-            sentence = self.feed(token.decode("utf-8"))
-            if sentence is not None:
-                yield sentence
+            yield from self.feed_sentences(bytes(token).decode("utf-8"))
         last_sentence = self.end()
-        self.n_tokens = len(self.tokens)
+        self.n_frames = len(self.frames)
         self.reset()
         yield last_sentence
 
+    @property
+    def n_tokens(self) -> int:
+        """
+        Deprecated: use n_frames, which this is. It counts tokens only if
+        the server does not coalesce them.
+        """
+        warnings.warn("SentenceParser.n_tokens is deprecated: use n_frames",
+                      DeprecationWarning, stacklevel=2)
+        return self.n_frames
+
+    @property
+    def tokens(self):
+        """
+        Deprecated: use frames.
+        """
+        warnings.warn("SentenceParser.tokens is deprecated: use frames",
+                      DeprecationWarning, stacklevel=2)
+        return self.frames
+
     def reset(self):
-        self.tokens = []
+        self.frames = []
         self.stack = []
 
     def end(self):
         last_sentence = ''.join(self.stack)
-        self.tokens.extend(self.stack)
         #self.q.put(last_sentence)
         #self.q.put(SentenceParser.sentinel)
         return last_sentence
 
     def feed(self, token: str) -> Union[str, None]:
+        sentences = self.feed_sentences(token)
+        return ''.join(sentences) if sentences else None
+
+    def feed_sentences(self, token: str) -> List[str]:
+        """
+        The sentences arg::token completes, if any. A sentence ending in
+        an earlier token is cut where arg::token starts (as tokens usually
+        carry their leading space), one ending inside it where the
+        whitespace after it starts.
+        """
+        offset = sum(len(t) for t in self.stack)
+        self.frames.append(token)
         self.stack.append(token)
         text = ''.join(self.stack)
-        if self._detect_sentence_end(text):
-            *sentence_tokens, next_start_token = self.stack
-            text = ''.join(sentence_tokens)
-            #self.q.put(text)
-            self.tokens.extend(sentence_tokens)
-            self.stack = [next_start_token]
-            return text
-        return None
+        ends = [max(end, offset) for end in self._detect_sentence_end(text)]
+        if not ends:
+            return []
+        starts = [0] + ends
+        self.stack = [text[ends[-1]:]]
+        return [text[a:b] for a, b in zip(starts, ends)]
 
 
@@ -0,0 +1,127 @@
+"""
+Streaming sample rate conversion by a rational factor (polyphase FIR),
+vectorized with NumPy.
+
+The rate ratio out_rate / in_rate is reduced to up / down. Conceptually,
+the input is upsampled by `up` (zeros inserted), lowpass filtered, and
+decimated by `down`; the polyphase form only computes the output samples
+that are kept, each as a taps_per_phase-tap dot product with one phase of
+the filter. All the output samples of a chunk are computed at once.
+
+The last taps_per_phase - 1 input samples and the output position are
+carried over between chunks, so a stream converted chunk by chunk is
+identical to converting it in one go, whatever the chunk sizes.
+
+Main public API usage:
+    resampler = StreamingResampler(48000, 16000)
+    out = resampler.process(pcm)  # bytes or int16/float array in; same dtype out
+    tail = resampler.flush()      # at end of stream
+"""
+from math import gcd
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+def design_filter(up: int, down: int, taps_per_phase: int, rolloff: float = 0.9,
+                  beta: float = 8.0) -> np.ndarray:
+    """
+    Kaiser-windowed sinc lowpass for the upsampled rate, cutting off at
+    rolloff times the lower of the two Nyquist frequencies. Returns it as
+    a (up, taps_per_phase) polyphase bank, each phase's taps reversed so
+    they line up with a window of consecutive input samples.
+    """
+    n = up * taps_per_phase
+    cutoff = rolloff * 0.5 / max(up, down) # cycles per upsampled sample
+    t = np.arange(n) - (n - 1) / 2
+    h = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(n, beta)
+    h *= up / h.sum() # unity gain at DC after zero-stuffing
+    # phase p holds h[p], h[p + up], h[p + 2 up], ...
+    bank = h.reshape(taps_per_phase, up).T
+    return np.ascontiguousarray(bank[:, ::-1], dtype=np.float32)
+
+
+class StreamingResampler:
+    """
+    Converts a stream of (interleaved) audio from arg::in_rate to
+    arg::out_rate, one chunk at a time. Int16 input (bytes or arrays) gives
+    rounded, clipped int16 output; float input gives float32 output.
+    Higher taps_per_phase means a sharper filter and more CPU.
+    """
+    def __init__(self, in_rate: int, out_rate: int, channels: int = 1,
+                       taps_per_phase: int = 16):
+        g = gcd(in_rate, out_rate)
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.up = out_rate // g
+        self.down = in_rate // g
+        self.channels = channels
+        self.taps = taps_per_phase
+        self.bank = design_filter(self.up, self.down, taps_per_phase)
+        self.reset()
+
+    @property
+    def passthrough(self) -> bool:
+        return self.up == self.down
+
+    def reset(self):
+        # K-1 samples of history, as if the stream were preceded by silence
+        self._history = np.zeros((self.taps - 1, self.channels), dtype=np.float32)
+        self._n_in = 0  # input frames consumed
+        self._n_out = 0 # output frames produced
+
+    def process(self, data) -> np.ndarray:
+        """
+        Convert the next chunk. Returns as many output frames as the input
+        seen so far allows (about len(data) * out_rate / in_rate).
+        """
+        if isinstance(data, np.ndarray):
+            x = data
+        else:
+            x = np.frombuffer(data, dtype=np.int16, count=len(data) // 2)
+        as_int16 = x.dtype == np.int16
+        if self.passthrough:
+            return x if as_int16 else x.astype(np.float32, copy=False)
+
+        frames = x.reshape(-1, self.channels).astype(np.float32)
+        if not len(frames): # too short to slide the filter over
+            return np.empty(0, dtype=np.int16 if as_int16 else np.float32)
+        ext = np.concatenate((self._history, frames))
+        n_in = self._n_in + len(frames)
+
+        # Output frame n sits at upsampled position n * down, i.e. after
+        # input frame (n * down) // up, using filter phase (n * down) % up.
+        last = (n_in * self.up - 1) // self.down # last output computable
+        n = np.arange(self._n_out, last + 1, dtype=np.int64)
+        position = n * self.down
+        index = position // self.up - self._n_in # into frames; ext is offset by taps - 1
+        phase = position % self.up
+
+        windows = sliding_window_view(ext, self.taps, axis=0) # (len, channels, taps)
+        y = np.einsum('nct,nt->nc', windows[index], self.bank[phase])
+
+        self._history = ext[len(ext) - (self.taps - 1):]
+        self._n_in = n_in
+        self._n_out = last + 1
+
+        y = y.reshape(-1)
+        if as_int16:
+            return np.clip(np.rint(y), -32768, 32767).astype(np.int16)
+        return y
+
+    def flush(self) -> np.ndarray:
+        """
+        Output still held back by the filter delay, at the end of a stream.
+        """
+        pad = np.zeros(self.taps // 2 * self.channels, dtype=np.int16)
+        return self.process(pad)
+
+    def expected_frames(self, n_in_frames: int) -> int:
+        return n_in_frames * self.up // self.down
+
+
+def resample(data, in_rate: int, out_rate: int, channels: int = 1,
+             taps_per_phase: int = 16) -> np.ndarray:
+    """
+    One-shot conversion of a whole signal.
+    """
+    resampler = StreamingResampler(in_rate, out_rate, channels, taps_per_phase)
+    return np.concatenate((resampler.process(data), resampler.flush()))
@@ -0,0 +1,193 @@
+"""
+Preallocated ring buffer of int16 audio frames, written by one producer
+(e.g. a PyAudio callback) and read by any number of consumers, each via
+its own RingCursor.
+
+The writer never waits: it copies into the ring and then publishes the
+new total frame count. Consumers that fall more than a ring's worth
+behind lose the oldest frames; these are counted (overruns), never
+silently skipped.
+
+Usage:
+    ring = AudioRingBuffer(capacity=16000 * 10, channels=1)
+    cursor = ring.cursor()
+    ring.write(pcm_bytes)                   # producer
+    block = cursor.read_exact(4096, timeout=1.0)  # consumer: int16 array
+"""
+from typing import Optional
+import threading
+import time
+import numpy as np
+
+class AudioRingBuffer:
+    def __init__(self, capacity: int, channels: int = 1):
+        """
+        arg::capacity is in frames (one sample per channel).
+        """
+        self.capacity = capacity
+        self.channels = channels
+        self._data = np.zeros(capacity * channels, dtype=np.int16)
+        # Total frames ever written. Only the writer assigns it, after the
+        # frames are in place; reading an int attribute is atomic.
+        self.write_pos = 0
+        # A write in progress overwrites up to this many of the oldest
+        # frames before it is published, so readers keep clear of them.
+        self.max_write = 0
+        self.closed = False
+        self._cursors = ()
+
+    def cursor(self, from_oldest: bool = False) -> 'RingCursor':
+        """
+        New consumer, starting at the newest frame (or at the oldest frame
+        still in the ring).
+        """
+        start = max(0, self.write_pos - self.readable) if from_oldest else self.write_pos
+        cursor = RingCursor(self, start)
+        self._cursors = self._cursors + (cursor,)
+        return cursor
+
+    @property
+    def readable(self) -> int:
+        """
+        How far behind the writer a consumer may be without losing frames.
+        """
+        return self.capacity - self.max_write
+
+    def remove_cursor(self, cursor: 'RingCursor') -> None:
+        self._cursors = tuple(c for c in self._cursors if c is not cursor)
+
+    def write(self, data) -> int:
+        """
+        Append interleaved int16 frames (bytes or array). Returns the
+        number of frames written. Never blocks.
+        """
+        samples = np.frombuffer(data, dtype=np.int16) if not isinstance(data, np.ndarray) else data
+        n_frames = len(samples) // self.channels
+        if n_frames > self.capacity: # only the newest frames can survive
+            samples = samples[-self.capacity * self.channels:]
+            self.write_pos += n_frames - self.capacity
+            n_frames = self.capacity
+        if n_frames > self.max_write:
+            self.max_write = n_frames
+
+        start = (self.write_pos % self.capacity) * self.channels
+        first = min(len(samples), len(self._data) - start)
+        self._data[start:start+first] = samples[:first]
+        self._data[:len(samples)-first] = samples[first:]
+        self.write_pos += n_frames
+
+        for cursor in self._cursors:
+            cursor._ready.set()
+        return n_frames
+
+    def close(self) -> None:
+        """
+        No more frames will be written: waiting consumers return what is
+        left, then empty blocks.
+        """
+        self.closed = True
+        self.wake()
+
+    def wake(self) -> None:
+        """
+        Wake every waiting consumer (e.g. so it can notice a stop request).
+        """
+        for cursor in self._cursors:
+            cursor._woken = True
+            cursor._ready.set()
+
+    def _copy(self, pos: int, n_frames: int) -> np.ndarray:
+        start = (pos % self.capacity) * self.channels
+        n = n_frames * self.channels
+        first = min(n, len(self._data) - start)
+        if first == n:
+            return self._data[start:start+n].copy()
+        return np.concatenate((self._data[start:], self._data[:n-first]))
+
+
+class RingCursor:
+    """
+    One consumer's read position in an AudioRingBuffer.
+
+    overruns  : frames this consumer lost because the writer lapped it.
+    underruns : timed reads that found too few frames (capture starved).
+    """
+    def __init__(self, ring: AudioRingBuffer, pos: int):
+        self.ring = ring
+        self.pos = pos
+        self.overruns = 0
+        self.underruns = 0
+        self._ready = threading.Event()
+        self._woken = False
+
+    def available(self) -> int:
+        return min(self.ring.write_pos - self.pos, self.ring.readable)
+
+    def read(self, max_frames: Optional[int] = None) -> np.ndarray:
+        """
+        Up to arg::max_frames frames (all available by default), without
+        waiting. Returns an owned int16 array (possibly empty).
+        """
+        ring = self.ring
+        write_pos = ring.write_pos
+        self._skip_overrun(write_pos)
+        n_frames = write_pos - self.pos
+        if max_frames is not None:
+            n_frames = min(n_frames, max_frames)
+        if n_frames <= 0:
+            return np.empty(0, dtype=np.int16)
+
+        block = ring._copy(self.pos, n_frames)
+        # The writer may have overwritten the start of what we copied
+        # while we were copying it: keep only frames still intact.
+        lost = ring.write_pos - ring.readable - self.pos
+        if lost > 0:
+            self.overruns += min(lost, n_frames)
+            block = block[lost * ring.channels:]
+            n_frames -= min(lost, n_frames)
+            self.pos += lost
+        self.pos += n_frames
+        return block
+
+    def read_exact(self, n_frames: int, timeout: Optional[float] = None) -> Optional[np.ndarray]:
+        """
+        Wait for arg::n_frames frames and return them. Returns None if
+        they did not arrive within arg::timeout seconds, or if woken (see
+        AudioRingBuffer.wake) first; returns what is left (possibly
+        fewer frames) once the ring is closed.
+        """
+        if not self.wait(n_frames, timeout):
+            if self.ring.closed:
+                return self.read(n_frames)
+            return None
+        return self.read(n_frames)
+
+    def wait(self, n_frames: int = 1, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until arg::n_frames frames are available. False on timeout
+        (counted as an underrun), on wake(), or once the ring is closed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.available() < n_frames:
+            if self.ring.closed:
+                return False
+            if self._woken:
+                self._woken = False
+                return False
+            self._ready.clear()
+            if self.available() >= n_frames: # written before the clear
+                break
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if (remaining is not None and remaining <= 0) or not self._ready.wait(remaining):
+                self.underruns += 1
+                return False
+        return True
+
+    def close(self) -> None:
+        self.ring.remove_cursor(self)
+
+    def _skip_overrun(self, write_pos: int) -> None:
+        behind = write_pos - self.pos
+        if behind > self.ring.readable:
+            self.overruns += behind - self.ring.readable
+            self.pos = write_pos - self.ring.readable
@@ -0,0 +1,220 @@
+"""
+Voice activity detection for 16-bit PCM audio, vectorized with NumPy.
+
+Audio is cut into short frames (VAD_FRAME_MS). A frame is speech when it
+is loud enough (energy, in dBFS), or nearly loud enough and noisy like a
+fricative ('s', 'f', 'sh': high zero-crossing rate, little energy).
+Hiss and hum stay below the energy threshold; clicks are ignored by
+requiring a few speech frames in a row before speech starts.
+
+Decisions are smoothed with a hangover: speech continues until
+VAD_HANGOVER_MS after the last speech frame, so short pauses between
+words do not split an utterance.
+
+Main public API usage:
+    vad = VoiceActivityDetector()
+    flags = vad.process(pcm_bytes)    # one bool per complete frame
+    vad.in_speech                     # state after the last frame
+
+    trimmer = SilenceTrimmer()
+    for chunk in trimmer.feed(pcm_bytes): # chunks worth sending, in order
+        send(chunk)
+    trimmer.ended                     # silence long enough to end an utterance
+"""
+from typing import List
+import collections
+import numpy as np
+from ..config import (AUDIO_SAMPLE_RATE, VAD_FRAME_MS, VAD_THRESHOLD_DB, VAD_ZCR_THRESHOLD,
+                      VAD_FRICATIVE_MARGIN_DB, VAD_MIN_SPEECH_MS, VAD_HANGOVER_MS,
+                      VAD_PREROLL_MS, VAD_END_SILENCE_MS)
+
+_int16_full_scale = np.float32(32768.0)
+
+def frame_features(frames: np.ndarray):
+    """
+    Energy (dBFS) and zero-crossing rate (crossings per sample) of each
+    row of a 2D array of frames: int16, or floats in [-1, 1].
+    """
+    full_scale = 1.0 if frames.dtype.kind == 'f' else _int16_full_scale
+    x = frames.astype(np.float32)
+    rms = np.sqrt(np.mean(np.square(x), axis=1))
+    energy_db = 20 * np.log10(rms / full_scale + 1e-10)
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frames.shape[1] - 1)
+    return energy_db, zcr
+
+
+class VoiceActivityDetector:
+    """
+    Streaming frame-level VAD: feed audio in chunks of any size with
+    process(); samples that do not fill a frame are kept for the next
+    call. State carries over between calls, so results do not depend on
+    how the audio was chunked.
+    """
+    def __init__(self, rate=AUDIO_SAMPLE_RATE,
+                       frame_ms=VAD_FRAME_MS,
+                       threshold_db=VAD_THRESHOLD_DB,
+                       zcr_threshold=VAD_ZCR_THRESHOLD,
+                       fricative_margin_db=VAD_FRICATIVE_MARGIN_DB,
+                       min_speech_ms=VAD_MIN_SPEECH_MS,
+                       hangover_ms=VAD_HANGOVER_MS):
+        self.rate = rate
+        self.frame_size = int(rate * frame_ms / 1000)
+        self.frame_ms = frame_ms
+        self.threshold_db = threshold_db
+        self.zcr_threshold = zcr_threshold
+        self.fricative_margin_db = fricative_margin_db
+        self.min_speech_frames = max(1, round(min_speech_ms / frame_ms))
+        self.hangover_frames = round(hangover_ms / frame_ms)
+        self.reset()
+
+    def reset(self):
+        self._remainder = np.empty(0, dtype=np.int16)
+        self.n_frames = 0        # frames processed so far
+        self._last_quiet = -1    # index of the last non-speech frame (before smoothing)
+        self._last_speech = -10**9 # index of the last confirmed speech frame
+        self.in_speech = False
+
+    def process(self, pcm) -> np.ndarray:
+        """
+        Speech / non-speech decision for each complete frame of arg::pcm
+        (bytes, int16 array, or float array in [-1, 1]), after onset and
+        hangover smoothing.
+        """
+        x = np.frombuffer(pcm, dtype=np.int16) if not isinstance(pcm, np.ndarray) else pcm
+        if len(self._remainder):
+            x = np.concatenate((self._remainder, x))
+        n = len(x) // self.frame_size
+        self._remainder = x[n * self.frame_size:].copy()
+        if n == 0:
+            return np.zeros(0, dtype=bool)
+
+        energy_db, zcr = frame_features(x[:n * self.frame_size].reshape(n, self.frame_size))
+        raw = ((energy_db > self.threshold_db)
+               | ((energy_db > self.threshold_db - self.fricative_margin_db)
+                  & (zcr > self.zcr_threshold)))
+
+        index = self.n_frames + np.arange(n)
+        # onset: only count frames ending a run of min_speech_frames raw speech frames
+        last_quiet = np.maximum.accumulate(np.where(raw, self._last_quiet, index))
+        confirmed = raw & (index - last_quiet >= self.min_speech_frames)
+        # hangover: speech until hangover_frames after the last confirmed frame
+        last_speech = np.maximum.accumulate(np.where(confirmed, index, self._last_speech))
+        speech = index - last_speech <= self.hangover_frames
+
+        self._last_quiet = int(last_quiet[-1])
+        self._last_speech = int(last_speech[-1])
+        self.n_frames += n
+        self.in_speech = bool(speech[-1])
+        return speech
+
+    @property
+    def silence_ms(self) -> float:
+        """
+        Time since the last confirmed speech frame.
+        """
+        return (self.n_frames - 1 - self._last_speech) * self.frame_ms
+
+    def trim(self, pcm, pad_ms=VAD_PREROLL_MS) -> np.ndarray:
+        """
+        Whole-utterance helper: arg::pcm without leading and trailing
+        silence (keeping arg::pad_ms either side). Empty if there is no
+        speech at all. Does not change the streaming state.
+        """
+        x = np.frombuffer(pcm, dtype=np.int16) if not isinstance(pcm, np.ndarray) else pcm
+        vad = VoiceActivityDetector(self.rate, self.frame_ms, self.threshold_db,
+                                    self.zcr_threshold, self.fricative_margin_db,
+                                    self.min_speech_frames * self.frame_ms,
+                                    self.hangover_frames * self.frame_ms)
+        speech = np.flatnonzero(vad.process(x))
+        if len(speech) == 0:
+            return x[:0]
+        # confirmed speech starts min_speech_frames - 1 frames late
+        first = max(0, speech[0] - (self.min_speech_frames - 1)) * self.frame_size
+        last = (speech[-1] + 1) * self.frame_size
+        pad = int(self.rate * pad_ms / 1000)
+        return x[max(0, first - pad):last + pad]
+
+
+class SilenceTrimmer:
+    """
+    Decides, chunk by chunk, which audio is worth sending: silence before
+    the first speech is dropped (except a short pre-roll, so the onset of
+    the first word is not cut), and silence after speech is held back
+    until speech resumes, or dropped if it never does.
+
+    The hangover keeps the end of each word, so trailing silence beyond
+    it is never sent.
+    """
+    def __init__(self, rate=AUDIO_SAMPLE_RATE,
+                       chunk_ms=None,
+                       preroll_ms=VAD_PREROLL_MS,
+                       end_silence_ms=VAD_END_SILENCE_MS,
+                       vad=None):
+        """
+        arg::chunk_ms sizes the pre-roll in chunks; by default it is
+        measured from the first chunk fed.
+        """
+        self.rate = rate
+        self.vad = vad or VoiceActivityDetector(rate)
+        self.preroll_ms = preroll_ms
+        self.end_silence_ms = end_silence_ms
+        self.chunk_ms = chunk_ms
+        self.reset()
+
+    def reset(self):
+        self.vad.reset()
+        self.preroll = collections.deque(maxlen=self._preroll_chunks())
+        self.held = []
+        self.started = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _preroll_chunks(self):
+        if not self.chunk_ms:
+            return 1
+        return max(1, -(-int(self.preroll_ms) // int(self.chunk_ms)))
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """
+        Run the VAD over a chunk of PCM, and return the chunks (possibly
+        none, possibly earlier ones) that should be sent now.
+        """
+        if self.chunk_ms is None:
+            self.chunk_ms = len(data) / 2 / self.rate * 1000
+            self.preroll = collections.deque(self.preroll, maxlen=self._preroll_chunks())
+        self.bytes_in += len(data)
+        is_speech = self.vad.process(data).any()
+
+        out = []
+        if not self.started:
+            if is_speech:
+                self.started = True
+                out.extend(self.preroll)
+                self.preroll.clear()
+                out.append(data)
+            else:
+                self.preroll.append(data)
+        elif is_speech:
+            out.extend(self.held)
+            self.held = []
+            out.append(data)
+        else:
+            self.held.append(data)
+        self.bytes_out += sum(len(c) for c in out)
+        return out
+
+    @property
+    def ended(self) -> bool:
+        """
+        Speech has started, and has been followed by end_silence_ms of
+        silence.
+        """
+        return self.started and self.vad.silence_ms >= self.end_silence_ms
+
+    @property
+    def trimmed_ratio(self) -> float:
+        """
+        Fraction of the audio fed that was not sent.
+        """
+        return 1 - self.bytes_out / self.bytes_in if self.bytes_in else 0.0
@@ -1,3 +1,4 @@
+import struct
 import wave
 from ..config import CHANNELS, AUDIO_SAMPLE_RATE
 
@@ -13,3 +14,63 @@ def save_wav(buffer,
     wf.setframerate(frame_rate)
     wf.writeframes(buffer)
     wf.close()
+
+
+class WavWriter:
+    """
+    Writes a WAV file as audio arrives, so a recording never has to be
+    held in memory. The header is written up front with a zero length
+    and patched with the real sizes every patch_interval bytes (so a
+    crash leaves a playable file) and on close().
+
+    Usage:
+        wav = WavWriter('out.wav')
+        wav.write(pcm_bytes) # repeatedly
+        wav.close()
+    """
+    patch_interval = 1 << 20
+
+    def __init__(self, path,
+                       channels=CHANNELS,
+                       sample_width=2,
+                       frame_rate=AUDIO_SAMPLE_RATE):
+        self.path = path
+        self.channels = channels
+        self.sample_width = sample_width
+        self.frame_rate = frame_rate
+        self.data_size = 0
+        self._patched_size = 0
+        self.f = open(path, 'wb')
+        self.f.write(self._header(0))
+
+    def _header(self, data_size):
+        block_align = self.channels * self.sample_width
+        return struct.pack('<4sI4s4sIHHIIHH4sI',
+                           b'RIFF', 36 + data_size, b'WAVE',
+                           b'fmt ', 16, 1, self.channels, self.frame_rate,
+                           self.frame_rate * block_align, block_align, 8 * self.sample_width,
+                           b'data', data_size)
+
+    def write(self, data):
+        self.f.write(data)
+        self.data_size += len(data)
+        if self.data_size - self._patched_size >= self.patch_interval:
+            self._patch_header()
+
+    def _patch_header(self):
+        self.f.seek(0)
+        self.f.write(self._header(self.data_size))
+        self.f.seek(0, 2)
+        self._patched_size = self.data_size
+
+    @property
+    def duration(self):
+        return self.data_size / (self.channels * self.sample_width * self.frame_rate)
+
+    def close(self):
+        if self.f.closed:
+            return
+        if self.data_size % 2: # RIFF chunks are word-aligned
+            self.f.write(b'\0')
+        self._patch_header()
+        self.f.close()
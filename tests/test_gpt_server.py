@@ -0,0 +1,59 @@
+"""
+GPTServer over a local socket, with stand-in models (gpt4all need not be
+installed).
+"""
+import os
+import sys
+import types
+import pytest
+
+sys.modules.setdefault('gpt4all', types.SimpleNamespace(GPT4All=None))
+from src.gpt.gpt import GPTServer
+from src.network import Client, UnixTransport
+
+class StubModel:
+    tokens = ['Hello', ' there', '.', ' Bye']
+
+    def __init__(self):
+        self.prompts = []
+
+    def start_session(self, ping=True):
+        pass
+
+    def end_session(self):
+        pass
+
+    def get_tokens(self, prompt):
+        self.prompts.append(prompt)
+        yield from self.tokens
+
+
+@pytest.fixture(params=[False, True], ids=['plain', 'coalesced'])
+def server(request, tmp_path):
+    model = StubModel()
+    server = GPTServer(transport=UnixTransport(str(tmp_path / 'gpt.sock')),
+                       models=[model], coalesce_tokens=request.param)
+    server.serve()
+    yield server, model
+    server.shutdown()
+
+def ask(server, prompt, **options):
+    client = Client(transport=server.transport)
+    try:
+        accepted = client.negotiate(**options)
+        client.send(prompt.encode('utf-8'))
+        return accepted, b''.join(client.receive_stream())
+    finally:
+        client.close()
+
+def test_negotiated_session(server):
+    server, model = server
+    accepted, reply = ask(server, 'hi', session='kiosk-1', priority=2)
+    assert accepted == dict(session='kiosk-1', priority=2)
+    assert reply == b'Hello there. Bye'
+    assert 'kiosk-1' in server.sessions.sessions
+    assert server.sessions.sessions['kiosk-1'].turns == [('hi', 'Hello there. Bye')]
+
+    ask(server, 'again', session='kiosk-1')
+    assert model.prompts[-1] == 'again' # same instance, same context: no recap
+    assert len(server.sessions.sessions['kiosk-1'].turns) == 2